@@ -0,0 +1,314 @@
+""" Binary columnar storage for preprocessed simulation input
+
+A packet store is a folder which contains one raw file per column (fixed-width,
+little endian) and a small json file describing the columns. All columns can
+be memory-mapped, which makes loading (parts of) a trace almost free.
+
+We store the following columns:
+- ts: float timestamp (float64)
+- src: src IP as int (uint32), the /24 prefix is simply src >> 8
+- rnd_<n>: border router if random (worst case), for 4, 8, 16, 32, 64 routers (uint8)
+- per_<n>: border router if consistent (best case), for 4, 8, 16, 32, 64 routers (uint8)
+- flag: flag bit, 1 if at least one everflow bit is set (uint8)
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+STORE_VERSION = 1
+META_FILE = 'meta.json'
+INDEX_FILE = 'index.npz'
+
+# by default, the index contains an entry every INDEX_STEP packets
+INDEX_STEP = 1000000
+
+BORDERS = [4, 8, 16, 32, 64]
+
+COLUMNS = (
+    [('ts', '<f8'), ('src', '<u4')] +
+    [('rnd_{}'.format(n), 'u1') for n in BORDERS] +
+    [('per_{}'.format(n), 'u1') for n in BORDERS] +
+    [('flag', 'u1')]
+)
+
+# column order of the preprocessed simulation input csv file
+CSV_COLUMNS = (
+    ['ts', 'src', 'prefix_24'] +
+    ['rnd_{}'.format(n) for n in BORDERS] +
+    ['per_{}'.format(n) for n in BORDERS] +
+    ['flag']
+)
+
+
+def column_file(path, name):
+    """ Returns the file name of a single column in a store
+
+    path (str): store folder
+    name (str): column name
+
+    returns: file name of the raw column data
+    """
+    return os.path.join(path, '{}.bin'.format(name))
+
+
+def router_column(n_border, time_persistent):
+    """ Returns the column name which contains the border router assignment
+
+    n_border (int): number of border routers (4, 8, 16, 32 or 64)
+    time_persistent (bool): persistent (True) or random (False) assignment
+
+    returns: column name
+    """
+
+    if n_border not in BORDERS:
+        raise ValueError('no precomputed border router assignment for {} routers'.format(n_border))
+
+    if time_persistent:
+        return 'per_{}'.format(n_border)
+    else:
+        return 'rnd_{}'.format(n_border)
+
+
+class PktStoreWriter:
+    """ Writes packets chunk by chunk to a packet store
+
+    Use it as a context manager, the meta data is only written on close.
+    """
+
+    def __init__(self, path):
+        """ constructor
+
+        path (str): store folder, created if it does not exist yet
+        """
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.n_pkts = 0
+        self.files = dict()
+        for name, _ in COLUMNS:
+            self.files[name] = open(column_file(path, name), 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, columns):
+        """ Appends a chunk of packets
+
+        columns (dict): column name -> array-like values (all of the same length)
+        """
+
+        length = None
+        arrays = dict()
+        for name, dtype in COLUMNS:
+            arrays[name] = np.asarray(columns[name], dtype=dtype)
+
+            if length is None:
+                length = len(arrays[name])
+            elif len(arrays[name]) != length:
+                raise ValueError('column {} has {} entries, expected {}'.format(name, len(arrays[name]), length))
+
+        for name, _ in COLUMNS:
+            arrays[name].tofile(self.files[name])
+
+        self.n_pkts += length
+
+    def close(self):
+        """ Closes all column files and writes the meta data """
+
+        if not self.files:
+            return
+
+        for data_out in self.files.values():
+            data_out.close()
+        self.files = dict()
+
+        meta = {
+            'version': STORE_VERSION,
+            'n_pkts': self.n_pkts,
+            'columns': [[name, dtype] for name, dtype in COLUMNS],
+        }
+        with open(os.path.join(self.path, META_FILE), 'w') as data_out:
+            json.dump(meta, data_out)
+
+
+def is_pkt_store(path):
+    """ Checks if a given path is a packet store
+
+    path (str): file or folder name
+
+    returns: True if path is a packet store folder
+    """
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def load_pkt_store(path):
+    """ Opens all columns of a packet store as read-only memory maps
+
+    path (str): store folder
+
+    returns: dict (column name: np.memmap)
+    """
+
+    with open(os.path.join(path, META_FILE), 'r') as data_in:
+        meta = json.load(data_in)
+
+    if meta['version'] != STORE_VERSION:
+        raise ValueError('unsupported packet store version {} in {}'.format(meta['version'], path))
+
+    store = dict()
+    for name, dtype in meta['columns']:
+        if meta['n_pkts'] == 0:
+            # numpy can not map empty files
+            store[name] = np.empty(0, dtype=dtype)
+        else:
+            store[name] = np.memmap(column_file(path, name), dtype=dtype, mode='r', shape=(meta['n_pkts'],))
+
+    return store
+
+
+def convert_csv(infile, path, chunk_size=10000000):
+    """ Converts an already preprocessed simulation input csv file to a packet store
+
+    infile (str): preprocessed csv file (see preprocess_pkt_csv.py)
+    path (str): store folder
+    chunk_size (int): number of lines to convert at once
+    """
+
+    # the /24 prefix string is not needed, it is derived from src
+    use_columns = [name for name in CSV_COLUMNS if name != 'prefix_24']
+    dtypes = dict(COLUMNS)
+
+    with PktStoreWriter(path) as writer:
+        # round_trip parsing makes sure we get the same values as float(ts)
+        for chunk in pd.read_csv(infile, header=None, names=CSV_COLUMNS, usecols=use_columns,
+                                 dtype=dtypes, float_precision='round_trip', chunksize=chunk_size):
+            writer.append({name: chunk[name].values for name in use_columns})
+
+
+def index_file(path):
+    """ Returns the file name of the iteration boundary index of a simulation input
+
+    path (str): packet store folder or preprocessed csv file
+
+    returns: file name of the sidecar index
+    """
+
+    if os.path.isdir(path):
+        return os.path.join(path, INDEX_FILE)
+    else:
+        return path + '.' + INDEX_FILE
+
+
+def save_index(path, first_second, second_rows, second_offsets, step, step_offsets, n_pkts):
+    """ Writes the iteration boundary index of a simulation input
+
+    Offsets are byte offsets for csv files and row numbers for packet stores.
+
+    path (str): packet store folder or preprocessed csv file
+    first_second (int): int(ts) of the first packet
+    second_rows (list): first row with int(ts) >= first_second + i, for each second i
+        (the last entry is always the number of packets)
+    second_offsets (list): offsets of the rows in second_rows
+    step (int): distance in packets between two entries in step_offsets
+    step_offsets (list): offset of every step-th row
+    n_pkts (int): total number of packets
+    """
+
+    np.savez(
+        index_file(path),
+        first_second=first_second,
+        second_rows=np.asarray(second_rows, dtype=np.int64),
+        second_offsets=np.asarray(second_offsets, dtype=np.int64),
+        step=step,
+        step_offsets=np.asarray(step_offsets, dtype=np.int64),
+        n_pkts=n_pkts,
+    )
+
+
+def load_index(path):
+    """ Loads the iteration boundary index of a simulation input
+
+    path (str): packet store folder or preprocessed csv file
+
+    returns: dict (name: value), see save_index
+    """
+
+    with np.load(index_file(path)) as data:
+        index = {name: data[name] for name in data.files}
+
+    for name in ['first_second', 'step', 'n_pkts']:
+        index[name] = int(index[name])
+
+    return index
+
+
+def build_store_index(path, step=INDEX_STEP):
+    """ Builds the iteration boundary index of a packet store
+    Assumes that packets are in chronological order
+
+    path (str): store folder
+    step (int): distance in packets between two index entries
+    """
+
+    ts = load_pkt_store(path)['ts']
+    n_pkts = len(ts)
+
+    if n_pkts == 0:
+        save_index(path, 0, [0], [0], step, [], 0)
+        return
+
+    first_second = int(ts[0])
+    seconds = np.arange(first_second, int(ts[-1]) + 2, dtype=np.float64)
+    second_rows = np.searchsorted(ts, seconds, side='left')
+
+    step_rows = np.arange(0, n_pkts, step, dtype=np.int64)
+
+    save_index(path, first_second, second_rows, second_rows, step, step_rows, n_pkts)
+
+
+def build_csv_index(infile, step=INDEX_STEP):
+    """ Builds the iteration boundary index of a preprocessed csv file
+    Assumes that packets are in chronological order
+
+    infile (str): preprocessed csv file (see preprocess_pkt_csv.py)
+    step (int): distance in packets between two index entries
+    """
+
+    first_second = None
+    second_rows = list()
+    second_offsets = list()
+    step_offsets = list()
+
+    offset = 0
+    row = 0
+
+    with open(infile, 'rb') as data_in:
+        for line in data_in:
+            second = int(float(line[:line.index(b',')]))
+
+            if first_second is None:
+                first_second = second
+
+            # fill all seconds up to the current one (also seconds without packets)
+            while first_second + len(second_rows) <= second:
+                second_rows.append(row)
+                second_offsets.append(offset)
+
+            if row % step == 0:
+                step_offsets.append(offset)
+
+            offset += len(line)
+            row += 1
+
+    # everything after the last second starts at the end of the file
+    second_rows.append(row)
+    second_offsets.append(offset)
+
+    save_index(infile, first_second or 0, second_rows, second_offsets, step, step_offsets, row)
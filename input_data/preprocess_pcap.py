@@ -0,0 +1,289 @@
+""" Preprocesses a pcap trace directly into a binary packet store
+
+Same output as extracting the packet headers with tshark and running
+preprocess_pkt_csv.py -b on the result (see README), but without the two text
+round trips. Supported are pcap files (also gzip compressed) with Ethernet
+(incl. VLAN tags) or raw IP link types. pcapng files are not supported.
+
+Records are read in blocks (memory-mapped for uncompressed files). Only the
+record boundaries are found in a python loop, all header fields are gathered
+with numpy for the whole block at once.
+"""
+
+import argparse
+import gzip
+import struct
+from datetime import datetime
+import numpy as np
+from pkt_store import PktStoreWriter, build_store_index
+from preprocess_pkt_csv import merge_first_dst, get_chunk_routers, get_store_columns, PROGRESS_STEP
+
+
+# default size of the record blocks which are parsed at once
+BLOCK_BYTES = 64 * 2**20
+
+# blocks fit records up to this captured length, larger ones are considered corrupted
+MAX_RECORD = 2**18
+
+PCAP_HEADER = 24
+RECORD_HEADER = 16
+
+# magic number -> (byte order, nanosecond timestamps)
+MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', False),
+    b'\xa1\xb2\xc3\xd4': ('>', False),
+    b'\x4d\x3c\xb2\xa1': ('<', True),
+    b'\xa1\xb2\x3c\x4d': ('>', True),
+}
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_IPV4 = 228
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = [0x8100, 0x88a8]
+
+PROTO_TCP = 6
+
+# tcp.flags.fin, tcp.flags.syn and tcp.flags.reset
+TCP_FLAGS = 0x07
+
+
+def get_uint(data, pos, size, byte_order='>'):
+    """ Reads an unsigned integer at given positions of a block
+
+    data (array): block (uint8)
+    pos (array): positions of the first byte (may be invalid, values are then undefined)
+    size (int): number of bytes
+    byte_order (str): '<' little or '>' big endian (network byte order)
+
+    returns: np.array (uint64) with the values
+    """
+
+    values = np.zeros(len(pos), dtype=np.uint64)
+    for i in range(size):
+        shift = 8 * i if byte_order == '<' else 8 * (size - 1 - i)
+        values |= data[np.minimum(pos + i, len(data) - 1)].astype(np.uint64) << np.uint64(shift)
+
+    return values
+
+
+def get_record_offsets(data, byte_order):
+    """ Finds the start of all complete records of a block
+
+    data (array): block (uint8) starting at a record header
+    byte_order (str): byte order of the record headers
+
+    returns: (offsets, end)
+        offsets: np.array with the offset of each complete record
+        end: offset after the last complete record
+    """
+
+    unpack_length = struct.Struct(byte_order + 'I').unpack_from
+    buffer = memoryview(data)
+    size = len(data)
+    offsets = []
+    pos = 0
+
+    # tight loop, this is the only per record python code
+    while pos + RECORD_HEADER <= size:
+        next_pos = pos + RECORD_HEADER + unpack_length(buffer, pos + 8)[0]
+        if next_pos > size:
+            if next_pos - pos > RECORD_HEADER + MAX_RECORD:
+                raise ValueError('invalid pcap record length {}'.format(next_pos - pos - RECORD_HEADER))
+            break
+
+        offsets.append(pos)
+        pos = next_pos
+
+    return (np.array(offsets, dtype=np.int64), pos)
+
+
+def get_timestamps(sec, frac, nanoseconds):
+    """ Returns the float timestamps of records
+
+    Same values as float() of frame.time_epoch printed by tshark
+
+    sec (array): seconds
+    frac (array): microseconds or nanoseconds
+    nanoseconds (bool): frac are nanoseconds
+
+    returns: np.array (float64) with the timestamps
+    """
+
+    if not nanoseconds:
+        # exact integer division, rounded the same way as the decimal string
+        return (sec.astype(np.int64) * 1000000 + frac.astype(np.int64)) / 1e6
+
+    # does not fit into the float mantissa, use the decimal string instead
+    text = np.char.add(np.char.add(sec.astype('S'), b'.'), np.char.zfill(frac.astype('S'), 9))
+    return text.astype(np.float64)
+
+
+def parse_records(data, offsets, header):
+    """ Parses the packet headers of all records of a block
+
+    We skip packets which are not IPv4 or incomplete
+
+    args:
+        data (array): block (uint8)
+        offsets (array): offset of each record (see get_record_offsets)
+        header (dict): pcap file header (see read_header)
+
+    returns: dict (column name: array), same as preprocess_pkt_csv.parse_lines
+        ts: timestamps (float)
+        src: src IPs as int
+        dst: dst IPs as int
+        flag: 1 if at least one everflow bit is set, 0 otherwise
+    """
+
+    byte_order = header['byte_order']
+    start = offsets + RECORD_HEADER
+    end = start + get_uint(data, offsets + 8, 4, byte_order).astype(np.int64)
+
+    if header['linktype'] == LINKTYPE_ETHERNET:
+        ip = start + 14
+        ethertype = get_uint(data, ip - 2, 2)
+        # up to two (stacked) VLAN tags
+        for _ in range(2):
+            vlan = np.isin(ethertype, ETHERTYPE_VLAN) & (ip + 4 <= end)
+            ethertype[vlan] = get_uint(data, ip[vlan] + 2, 2)
+            ip[vlan] += 4
+        valid = (ethertype == ETHERTYPE_IPV4) & (ip <= end)
+    else:
+        ip = start
+        valid = np.ones(len(offsets), dtype=bool)
+
+    # complete IPv4 header (without options)
+    version_ihl = get_uint(data, ip, 1)
+    valid &= ((version_ihl >> np.uint64(4)) == 4) & (ip + 20 <= end)
+
+    offsets, ip, end, version_ihl = offsets[valid], ip[valid], end[valid], version_ihl[valid]
+
+    # tcp flags only in the first fragment and if the header was captured
+    tcp = ip + 4 * (version_ihl & np.uint64(0x0f)).astype(np.int64)
+    first_fragment = (get_uint(data, ip + 6, 2) & np.uint64(0x1fff)) == 0
+    has_flags = (get_uint(data, ip + 9, 1) == PROTO_TCP) & first_fragment & (tcp + 14 <= end)
+    flags = get_uint(data, tcp + 13, 1) & np.uint64(TCP_FLAGS)
+
+    return {
+        'ts': get_timestamps(get_uint(data, offsets, 4, byte_order), get_uint(data, offsets + 4, 4, byte_order),
+                             header['nanoseconds']),
+        'src': get_uint(data, ip + 12, 4).astype(np.uint32),
+        'dst': get_uint(data, ip + 16, 4).astype(np.uint32),
+        'flag': (has_flags & (flags != 0)).astype(np.uint8),
+    }
+
+
+def read_header(data):
+    """ Parses the pcap file header
+
+    data (bytes): first PCAP_HEADER bytes of the file
+
+    returns: dict with the byte_order, nanoseconds (bool) and linktype
+    """
+
+    if len(data) < PCAP_HEADER or data[:4] not in MAGIC:
+        raise ValueError('not a pcap file (pcapng is not supported)')
+
+    byte_order, nanoseconds = MAGIC[data[:4]]
+    linktype = struct.unpack_from(byte_order + 'I', data, 20)[0] & 0x0fffffff
+
+    if linktype not in [LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_IPV4]:
+        raise ValueError('unsupported pcap link type {}'.format(linktype))
+
+    return {'byte_order': byte_order, 'nanoseconds': nanoseconds, 'linktype': linktype}
+
+
+def read_blocks(infile, block_size):
+    """ Reads the records of a pcap file block by block
+
+    Uncompressed files are memory-mapped, gzip compressed files (.gz) are
+    decompressed block by block. A truncated last record is ignored.
+
+    args:
+        infile (str): pcap file name
+        block_size (int): approximate size of each block in bytes
+
+    yields: (header, data, offsets), see read_header and get_record_offsets
+    """
+
+    block_size = max(block_size, RECORD_HEADER + MAX_RECORD)
+
+    if infile.endswith('.gz'):
+        with gzip.open(infile, 'rb') as data_in:
+            header = read_header(data_in.read(PCAP_HEADER))
+
+            rest = b''
+            while True:
+                new = data_in.read(block_size)
+                data = np.frombuffer(rest + new, dtype=np.uint8)
+
+                offsets, end = get_record_offsets(data, header['byte_order'])
+                if len(offsets) > 0:
+                    yield (header, data, offsets)
+
+                if not new:
+                    break
+                rest = data[end:].tobytes()
+
+    else:
+        with open(infile, 'rb') as data_in:
+            header = read_header(data_in.read(PCAP_HEADER))
+
+        data = np.memmap(infile, dtype=np.uint8, mode='r')[PCAP_HEADER:]
+        pos = 0
+        while pos < len(data):
+            block = data[pos:pos + block_size]
+
+            offsets, end = get_record_offsets(block, header['byte_order'])
+            if len(offsets) == 0:
+                break
+            yield (header, block, offsets)
+
+            pos += end
+
+
+def preprocess_pcap(infile, outpath, block_size=BLOCK_BYTES):
+    """ Preprocesses a pcap trace into a binary packet store
+    Same store as preprocess_pkt_csv.preprocess_binary of the tshark output
+    (see README), including the iteration boundary index.
+
+    We skip input packets which are not IPv4 or incomplete.
+
+    args:
+        infile (str): pcap file name (.pcap or .pcap.gz)
+        outpath (str): output store folder
+        block_size (int): approximate number of bytes to parse at once
+    """
+
+    print('starting to preprocess {} (pcap) at {}'.format(infile, datetime.now()))
+
+    # first packet of each /24 prefix seen so far
+    prefixes = np.empty(0, dtype=np.uint32)
+    first_dst = np.empty(0, dtype=np.uint32)
+    n_pkts = 0
+
+    with PktStoreWriter(outpath) as writer:
+        for header, data, offsets in read_blocks(infile, block_size):
+            columns = parse_records(data, offsets, header)
+            prefixes, first_dst = merge_first_dst(prefixes, first_dst, columns['src'], columns['dst'])
+
+            writer.append(get_store_columns(columns, get_chunk_routers(columns, prefixes, first_dst)))
+
+            if (n_pkts + len(columns['src'])) // PROGRESS_STEP > n_pkts // PROGRESS_STEP:
+                print('processed {} pkts at {}'.format(n_pkts + len(columns['src']), datetime.now()))
+            n_pkts += len(columns['src'])
+
+    build_store_index(outpath)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--infile', required=True, type=str,
+                        help='pcap trace (.pcap or .pcap.gz)')
+    parser.add_argument('-o', '--outfile', default='simulation_input', type=str,
+                        help='output packet store folder, default simulation_input')
+    args = parser.parse_args()
+
+    preprocess_pcap(args.infile, args.outfile)
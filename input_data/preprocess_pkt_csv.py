@@ -1,8 +1,24 @@
+import argparse
+import io
+import os
+import tempfile
 from datetime import datetime
-from ip_conversion import ipv4_to_str, ipv4_to_int
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from itertools import islice
+from ip_conversion import ipv4_to_int_array, ipv4_to_str_array
+from pkt_store import PktStoreWriter, BORDERS, convert_csv, build_csv_index, build_store_index, is_pkt_store
 
 
-def preprocess(infile, outfile):
+# default size of the input chunks which are parsed in parallel
+CHUNK_BYTES = 256 * 2**20
+
+# progress is printed every PROGRESS_STEP packets
+PROGRESS_STEP = 100000000
+
+
+def preprocess(infile, outfile, chunk_size=10000000):
     """ Preprocesses a given input packet csv file to only contain the relevant data
     We will generate an output csv file which contains the following columns:
     - float timestamp
@@ -12,81 +28,386 @@ def preprocess(infile, outfile):
     - border router if consistent (best case), for 4, 8, 16, 32, 64 routers
     - flag bit (1 if at least one everflow bit is set)
 
-    We skip input packets which are incomplete
+    We skip input packets which are incomplete. Afterwards, we also write an
+    index with the file offsets of each second and every INDEX_STEP packets
+    (see pkt_store.py) to support random access to iterations.
 
     args:
         infile (str): input file name
         outfile (str): output file name
+        chunk_size (int): number of lines to parse at once
     """
 
     print('starting to preprocess {} at {}'.format(infile, datetime.now()))
 
-    border_dict_4 = dict()
-    border_dict_8 = dict()
-    border_dict_16 = dict()
-    border_dict_32 = dict()
-    border_dict_64 = dict()
-    ip_slice_4 = int(2**32 / 4)
-    ip_slice_8 = int(2**32 / 8)
-    ip_slice_16 = int(2**32 / 16)
-    ip_slice_32 = int(2**32 / 32)
-    ip_slice_64 = int(2**32 / 64)
-
-    i = 0
-
-    with open(infile, 'r') as data_in, open(outfile, 'w') as data_out:
-        for line in data_in:
-            ts, src_ip, dst_ip, ip_id, _, _, syn, fin, rst = line.strip().split(',')[:9]
-            if not dst_ip:
-                continue
-
-            src_ip_int = ipv4_to_int(src_ip)
-            temp = (src_ip_int >> 8) << 8
-            prefix_24 = ipv4_to_str(temp)+'/24'
-
-            dst_ip_int = ipv4_to_int(dst_ip)
-            router_4 = int(dst_ip_int / ip_slice_4) + 1
-            router_8 = int(dst_ip_int / ip_slice_8) + 1
-            router_16 = int(dst_ip_int / ip_slice_16) + 1
-            router_32 = int(dst_ip_int / ip_slice_32) + 1
-            router_64 = int(dst_ip_int / ip_slice_64) + 1
-
-            if prefix_24 not in border_dict_4:
-                border_dict_4[prefix_24] = router_4
-                border_dict_8[prefix_24] = router_8
-                border_dict_16[prefix_24] = router_16
-                border_dict_32[prefix_24] = router_32
-                border_dict_64[prefix_24] = router_64
-
-            if syn == '1' or fin == '1' or rst == '1':
-                flags = '1'
-            else:
-                flags = '0'
-
-            data_out.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(
-                ts,
-                src_ip_int,
-                prefix_24,
-                router_4,
-                router_8,
-                router_16,
-                router_32,
-                router_64,
-                border_dict_4[prefix_24],
-                border_dict_8[prefix_24],
-                border_dict_16[prefix_24],
-                border_dict_32[prefix_24],
-                border_dict_64[prefix_24],
-                flags
-            ))
-
-            i += 1
-            if i % 100000000 == 0:
-                print('processed {} pkts at {}'.format(i, datetime.now()))
+    with open(outfile, 'wb') as data_out:
+        for columns, routers in preprocess_chunks(infile, chunk_size):
+            data_out.write(get_csv_lines(columns, routers))
+
+    build_csv_index(outfile)
+
+
+def preprocess_binary(infile, outpath, chunk_size=10000000):
+    """ Preprocesses a given input packet csv file into a binary packet store
+    The store contains the same information as the csv output of preprocess
+    but as fixed-width columns (see pkt_store.py). The /24 prefix is not
+    stored as it can be derived from the src IP.
+
+    We skip input packets which are incomplete. Afterwards, we also write an
+    index with the rows of each second and every INDEX_STEP packets.
+
+    args:
+        infile (str): input file name
+        outpath (str): output store folder
+        chunk_size (int): number of lines to parse at once
+    """
+
+    print('starting to preprocess {} (binary) at {}'.format(infile, datetime.now()))
+
+    with PktStoreWriter(outpath) as writer:
+        for columns, routers in preprocess_chunks(infile, chunk_size):
+            writer.append(get_store_columns(columns, routers))
+
+    build_store_index(outpath)
+
+
+def preprocess_chunks(infile, chunk_size):
+    """ Parses a given input packet csv file chunk by chunk
+
+    args:
+        infile (str): input file name
+        chunk_size (int): number of lines per chunk
+
+    yields: (columns, routers) of each chunk, see parse_lines and get_chunk_routers
+    """
+
+    # first packet of each /24 prefix seen so far
+    prefixes = np.empty(0, dtype=np.uint32)
+    first_dst = np.empty(0, dtype=np.uint32)
+    n_pkts = 0
+
+    with open(infile, 'rb') as data_in:
+        while True:
+            data = b''.join(islice(data_in, chunk_size))
+            if not data:
+                break
+
+            columns = parse_lines(data)
+            prefixes, first_dst = merge_first_dst(prefixes, first_dst, columns['src'], columns['dst'])
+
+            yield (columns, get_chunk_routers(columns, prefixes, first_dst))
+
+            if (n_pkts + len(columns['src'])) // PROGRESS_STEP > n_pkts // PROGRESS_STEP:
+                print('processed {} pkts at {}'.format(n_pkts + len(columns['src']), datetime.now()))
+            n_pkts += len(columns['src'])
+
+
+def parse_lines(data):
+    """ Parses lines of the input packet csv file
+
+    We skip input packets which are incomplete
+
+    args:
+        data (bytes): complete lines of the input file
+
+    returns: dict (column name: array)
+        ts: timestamps as in the input file (bytes)
+        src: src IPs as int
+        dst: dst IPs as int
+        flag: 1 if at least one everflow bit is set, 0 otherwise
+    """
+
+    # lines with more fields are truncated, lines with less are padded with empty fields
+    chunk = pd.read_csv(io.BytesIO(data), header=None, names=list(range(9)), usecols=[0, 1, 2, 6, 7, 8],
+                        index_col=False, dtype=str, na_filter=False)
+
+    # skip incomplete packets
+    chunk = chunk[chunk[2] != '']
+
+    return {
+        'ts': chunk[0].values.astype('S'),
+        'src': ipv4_to_int_array(chunk[1].values),
+        'dst': ipv4_to_int_array(chunk[2].values),
+        'flag': ((chunk[6] == '1') | (chunk[7] == '1') | (chunk[8] == '1')).values.astype(np.uint8),
+    }
+
+
+def merge_first_dst(prefixes, first_dst, src, dst):
+    """ Adds the first packet of all new /24 prefixes of a chunk
+
+    args:
+        prefixes (array): /24 prefixes (src >> 8) seen so far (sorted)
+        first_dst (array): dst IP of the first packet of each prefix seen so far
+        src (array): src IPs of the chunk
+        dst (array): dst IPs of the chunk
+
+    returns: (prefixes, first_dst) including the prefixes of the chunk
+    """
+
+    # np.unique returns the first occurrence of each prefix
+    chunk_prefixes, first = np.unique(src >> 8, return_index=True)
+
+    # prefixes seen in an earlier chunk keep their first packet
+    new = ~np.isin(chunk_prefixes, prefixes, assume_unique=True)
+    prefixes = np.concatenate([prefixes, chunk_prefixes[new]])
+    first_dst = np.concatenate([first_dst, dst[first][new]])
+
+    order = np.argsort(prefixes, kind='stable')
+
+    return (prefixes[order], first_dst[order])
+
+
+def get_routers(dst, n_border):
+    """ Returns the border router of each packet based on its dst IP
+    Same as int(dst / (2**32 / n_border)) + 1
+
+    dst (array): dst IPs as int
+    n_border (int): number of border routers (power of two)
+
+    returns: np.array (uint8) with the border routers (1 ... n_border)
+    """
+    return ((dst.astype(np.uint64) * n_border) >> 32).astype(np.uint8) + 1
+
+
+def get_chunk_routers(columns, prefixes, first_dst):
+    """ Returns the random and persistent border routers of each packet of a chunk
+
+    args:
+        columns (dict): parsed columns of the chunk (see parse_lines)
+        prefixes (array): /24 prefixes (sorted), at least all prefixes of the chunk
+        first_dst (array): dst IP of the first packet of each prefix
+
+    returns: dict (column name: routers), rnd_<n> and per_<n> for all numbers of routers
+    """
+
+    persistent_dst = first_dst[np.searchsorted(prefixes, columns['src'] >> 8)]
+
+    routers = dict()
+    for n in BORDERS:
+        routers['rnd_{}'.format(n)] = get_routers(columns['dst'], n)
+    for n in BORDERS:
+        routers['per_{}'.format(n)] = get_routers(persistent_dst, n)
+
+    return routers
+
+
+def get_csv_lines(columns, routers):
+    """ Formats the lines of the preprocessed csv file of a chunk
+
+    args:
+        columns (dict): parsed columns of the chunk (see parse_lines)
+        routers (dict): border routers of the chunk (see get_chunk_routers)
+
+    returns: csv lines (bytes)
+    """
+
+    if len(columns['src']) == 0:
+        return b''
+
+    # create each /24 prefix string and router number only once
+    prefixes, inverse = np.unique(columns['src'] >> 8, return_inverse=True)
+    names = np.array([name.encode() for name in ipv4_to_str_array(prefixes << 8) + '/24'], dtype=object)
+    numbers = np.array([str(i).encode() for i in range(256)], dtype=object)
+
+    cells = [columns['ts'].tolist(), columns['src'].astype('S').tolist(), names[inverse].tolist()]
+    cells += [numbers[values].tolist() for values in routers.values()]
+    cells += [numbers[columns['flag']].tolist()]
+
+    return b'\n'.join(map(b','.join, zip(*cells))) + b'\n'
+
+
+def get_store_columns(columns, routers):
+    """ Returns the packet store columns of a chunk
+
+    args:
+        columns (dict): parsed columns of the chunk (see parse_lines)
+        routers (dict): border routers of the chunk (see get_chunk_routers)
+
+    returns: dict (column name: array), see pkt_store.COLUMNS
+    """
+
+    values = {'ts': columns['ts'].astype(np.float64), 'src': columns['src'], 'flag': columns['flag']}
+    values.update(routers)
+
+    return values
+
+
+def get_chunk_offsets(infile, chunk_bytes):
+    """ Splits a file into chunks which start at line boundaries
+
+    infile (str): input file name
+    chunk_bytes (int): approximate size of each chunk in bytes
+
+    returns: list of (start, end) byte offsets
+    """
+
+    size = os.path.getsize(infile)
+    offsets = [0]
+
+    with open(infile, 'rb') as data_in:
+        while offsets[-1] < size:
+            data_in.seek(min(offsets[-1] + chunk_bytes, size))
+            # move to the start of the next line
+            data_in.readline()
+            offsets.append(min(data_in.tell(), size))
+
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def parse_chunk(args):
+    """ Parses one chunk of the input packet csv file (see parse_lines)
+    Worker function of the parallel preprocessing, the parsed columns are saved
+    in a temporary file as the persistent routers are only known after all
+    chunks are parsed
+
+    args: (infile, start, end, tmp_file)
+        infile (str): input file name
+        start (int): first byte of the chunk
+        end (int): end byte of the chunk (exclusive)
+        tmp_file (str): file to save the parsed columns in
+
+    returns: (n_pkts, prefixes, first_dst)
+        n_pkts: number of parsed packets
+        prefixes: /24 prefixes (src >> 8) in the chunk (sorted)
+        first_dst: dst IP of the first packet of each /24 prefix in the chunk
+    """
+
+    infile, start, end, tmp_file = args
+
+    with open(infile, 'rb') as data_in:
+        data_in.seek(start)
+        columns = parse_lines(data_in.read(end - start))
+
+    np.savez(tmp_file, **columns)
+
+    empty = np.empty(0, dtype=np.uint32)
+    prefixes, first_dst = merge_first_dst(empty, empty, columns['src'], columns['dst'])
+
+    return (len(columns['src']), prefixes, first_dst)
+
+
+def format_chunk(args):
+    """ Computes all output columns of a parsed chunk (see parse_chunk)
+    Worker function of the parallel preprocessing
+
+    args: (tmp_file, prefixes, first_dst, binary)
+        tmp_file (str): file with the parsed columns of the chunk (removed afterwards)
+        prefixes: all /24 prefixes of the trace (sorted)
+        first_dst: dst IP of the first packet of each /24 prefix in the trace
+        binary (bool): return columns for a packet store (True) or csv lines (False)
+
+    returns: dict (column name: array) if binary, csv lines (bytes) otherwise
+    """
+
+    tmp_file, prefixes, first_dst, binary = args
+
+    with np.load(tmp_file) as data:
+        columns = {name: data[name] for name in data.files}
+    os.remove(tmp_file)
+
+    routers = get_chunk_routers(columns, prefixes, first_dst)
+
+    if binary:
+        return get_store_columns(columns, routers)
+    else:
+        return get_csv_lines(columns, routers)
+
+
+def preprocess_parallel(infile, outfile, binary=False, processes=None, chunk_bytes=CHUNK_BYTES):
+    """ Same as preprocess (or preprocess_binary) but parses the input in parallel
+
+    The input is split into chunks at line boundaries which are parsed in a
+    process pool. The persistent border router of a /24 prefix depends on the
+    first packet of that prefix in the whole trace. We therefore merge the
+    first packet of each prefix of all chunks (in chunk order) before the
+    routers are assigned in a second pass over the parsed chunks.
+
+    args:
+        infile (str): input file name
+        outfile (str): output file name (csv) or store folder (binary)
+        binary (bool): write a binary packet store instead of a csv file
+        processes (int): number of worker processes, default: number of CPUs
+        chunk_bytes (int): approximate size of the input chunks in bytes
+    """
+
+    print('starting to preprocess {} in parallel at {}'.format(infile, datetime.now()))
+
+    chunks = get_chunk_offsets(infile, chunk_bytes)
+
+    # parsed chunks are kept next to the output
+    tmp_dir = tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(outfile)))
+
+    with tmp_dir, Pool(processes) as pool:
+        tmp_files = [os.path.join(tmp_dir.name, 'chunk_{}.npz'.format(i)) for i in range(len(chunks))]
+
+        # first pass: parse all chunks and merge the first packet of each prefix
+        prefixes = np.empty(0, dtype=np.uint32)
+        first_dst = np.empty(0, dtype=np.uint32)
+        n_pkts = 0
+
+        tasks = [(infile, start, end, tmp_file) for (start, end), tmp_file in zip(chunks, tmp_files)]
+        for n_chunk, chunk_prefixes, chunk_dst in pool.imap(parse_chunk, tasks):
+            # prefixes seen in an earlier chunk keep their first packet
+            prefixes, first_dst = merge_first_dst(prefixes, first_dst, chunk_prefixes << 8, chunk_dst)
+            n_pkts += n_chunk
+
+        print('parsed {} pkts at {}'.format(n_pkts, datetime.now()))
+
+        # second pass: assign routers and write the chunks in order
+        tasks = [(tmp_file, prefixes, first_dst, binary) for tmp_file in tmp_files]
+        if binary:
+            with PktStoreWriter(outfile) as writer:
+                for columns in pool.imap(format_chunk, tasks):
+                    writer.append(columns)
+        else:
+            with open(outfile, 'wb') as data_out:
+                for lines in pool.imap(format_chunk, tasks):
+                    data_out.write(lines)
+
+    if binary:
+        build_store_index(outfile)
+    else:
+        build_csv_index(outfile)
 
 
 if __name__ == "__main__":
-    infile = 'simulation_input_temp.csv'
-    outfile = 'simulation_input.csv'
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--infile', default=None, type=str,
+                        help='packet csv file extracted with tshark (or preprocessed csv file if converting)')
+    parser.add_argument('-o', '--outfile', default=None, type=str,
+                        help='output file (csv) or folder (binary), default simulation_input.csv or simulation_input')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='write a binary columnar packet store instead of a csv file')
+    parser.add_argument('-c', '--convert', action='store_true',
+                        help='convert an already preprocessed csv file (infile) to a binary packet store')
+    parser.add_argument('-x', '--index', action='store_true',
+                        help='only (re)build the iteration boundary index of a preprocessed csv file or packet store (infile)')
+    parser.add_argument('-j', '--jobs', default=1, type=int,
+                        help='number of processes which parse the packet csv file in parallel (default 1, sequential)')
+    args = parser.parse_args()
 
-    preprocess(infile, outfile)
+    if args.index:
+        infile = args.infile or 'simulation_input.csv'
+        if is_pkt_store(infile):
+            build_store_index(infile)
+        else:
+            build_csv_index(infile)
+    elif args.convert:
+        infile = args.infile or 'simulation_input.csv'
+        outfile = args.outfile or 'simulation_input'
+        convert_csv(infile, outfile)
+        build_store_index(outfile)
+    elif args.binary:
+        infile = args.infile or 'simulation_input_temp.csv'
+        outfile = args.outfile or 'simulation_input'
+        if args.jobs > 1:
+            preprocess_parallel(infile, outfile, True, args.jobs)
+        else:
+            preprocess_binary(infile, outfile)
+    else:
+        infile = args.infile or 'simulation_input_temp.csv'
+        outfile = args.outfile or 'simulation_input.csv'
+        if args.jobs > 1:
+            preprocess_parallel(infile, outfile, False, args.jobs)
+        else:
+            preprocess(infile, outfile)
@@ -5,7 +5,7 @@
 import pandas as pd
 import numpy as np
 import logging
-from ip_conversion import ipv4_to_int
+from ip_conversion import ipv4_to_int, ipv4_to_int_array
 
 logging.getLogger("get.table_c").setLevel(logging.DEBUG)
 
@@ -36,6 +36,50 @@ def get_router(ip):
         return 4
 
 
+def get_routers(ips):
+    """ Same as get_router for many IPs at once
+
+    ips (array): IPs as int
+
+    returns: np.array with the routers (1 ... 4)
+    """
+    return (np.asarray(ips, dtype=np.uint32) >> 30).astype(np.uint32) + 1
+
+
+def get_valid_ips(src_ips, dst_ips):
+    """ Converts src and dst IPs to int, rows with invalid IPs are skipped
+
+    src_ips (list): src IPs in dot notation
+    dst_ips (list): dst IPs in dot notation
+
+    returns: (src, dst, valid)
+        src: np.array with the valid src IPs as int
+        dst: np.array with the valid dst IPs as int
+        valid: np.array, True for rows with valid IPs
+    """
+
+    try:
+        return (ipv4_to_int_array(src_ips), ipv4_to_int_array(dst_ips), np.ones(len(src_ips), dtype=bool))
+    except ValueError:
+        pass
+
+    # convert row by row to find the invalid ones
+    src = list()
+    dst = list()
+    valid = list()
+    for src_ip, dst_ip in zip(src_ips, dst_ips):
+        try:
+            src.append(ipv4_to_int(src_ip))
+            dst.append(ipv4_to_int(dst_ip))
+            valid.append(True)
+        except OSError:
+            print('invalid IPs in', src_ip, dst_ip)
+            del src[len(dst):]
+            valid.append(False)
+
+    return (np.array(src, dtype=np.uint32), np.array(dst, dtype=np.uint32), np.array(valid, dtype=bool))
+
+
 def get_mirrored_table(filename, start_line):
     """ Function to get pandas table from mirrored data
 
@@ -54,10 +98,11 @@ def get_mirrored_table(filename, start_line):
     ii = 0
     counters = [0, 0, 0, 0]
 
-    with open(filename, 'r') as data_in:
-        in_table = list()
-        out_table = list()
+    timestamps = list()
+    src_ips = list()
+    dst_ips = list()
 
+    with open(filename, 'r') as data_in:
         for ii, line in enumerate(data_in):
             if ii <= start_line:
                 continue
@@ -66,40 +111,24 @@ def get_mirrored_table(filename, start_line):
             if len(cells) != 11:
                 continue
 
-            # make sure we have expected timestamp format
-            ts = int(float(cells[0])*1000)
-
             if cells[8] == "" or cells[10] == "":
                 continue
 
-            # as we sometimes read in the file when the last line is not completely written (incomplete dst IP)
-            try:
-                src_ip = ipv4_to_int(cells[8])
-                dst_ip = ipv4_to_int(cells[10])
-            except OSError:
-                print('invalid IPs in', cells[8], cells[10])
-                continue
-
-            router = get_router(dst_ip)
-            direction = 'in'
-
-            counters[router-1] += 1
-
-            # one packet per line so we always report 1
-            if direction == 'in':
-                in_table.append((router, src_ip, dst_ip, ts, 1))
-            else:
-                out_table.append((router, src_ip, dst_ip, ts, 1))
+            # make sure we have expected timestamp format
+            timestamps.append(int(float(cells[0])*1000))
+            src_ips.append(cells[8])
+            dst_ips.append(cells[10])
 
-    column_type = [('router_ip', 'uint32'), ('src_ip', 'uint32'),
-                   ('dst_ip', 'uint32'), ('ts_end', 'uint64'),
-                   ('pkts', 'uint32')]
+    # as we sometimes read in the file when the last line is not completely written (incomplete dst IP)
+    src_ip, dst_ip, valid = get_valid_ips(src_ips, dst_ips)
 
-    in_arr = np.array(in_table, dtype=column_type)
-    in_arr_final = pd.DataFrame.from_records(in_arr)
+    router = get_routers(dst_ip)
+    for i, count in enumerate(np.bincount(router - 1, minlength=4).tolist()):
+        counters[i] += count
 
-    out_arr = np.array(out_table, dtype=column_type)
-    out_arr_final = pd.DataFrame.from_records(out_arr)
+    # all packets are incoming, one packet per line so we always report 1
+    in_arr_final = get_table(router, src_ip, dst_ip, np.array(timestamps, dtype=np.uint64)[valid], 1)
+    out_arr_final = get_table([], [], [], [], [])
 
     return (in_arr_final, out_arr_final, ii, counters)
 
@@ -118,10 +147,13 @@ def get_sampled_table(filename):
     # Date first seen (raw), Date last seen (raw), Date flow received (raw), Duration, Proto, Src IP Addr, Dst IP Addr, Src Pt, Dst Pt, In Pkt, Out Pkt, In Byte, Out Byte, Flows, Exp ID, Router IP, Input, Output
     #    1630411579.810,1630411579.810,0.000,    0.000,TCP  ,   44.85.129.200,       10.90.0.2,   443, 36264,    4096,       0,  270336,       0,    1,     1,         0.0.0.0,436233216,436211200
 
-    with open(filename, 'r') as data_in:
-        in_table = list()
-        out_table = list()
+    routers = list()
+    timestamps = list()
+    src_ips = list()
+    dst_ips = list()
+    pkts = list()
 
+    with open(filename, 'r') as data_in:
         for line in data_in:
             # also remove spaces around entries
             cells = [x.strip() for x in line.strip().split(',')]
@@ -132,32 +164,48 @@ def get_sampled_table(filename):
             if cells[17] not in IP_TO_ROUTER:
                 continue
 
-            router = IP_TO_ROUTER[cells[17]]
-            direction = 'in'
+            routers.append(IP_TO_ROUTER[cells[17]])
 
             # make sure we have expected timestamp format
-            ts = int(float(cells[0])*1000)
+            timestamps.append(int(float(cells[0])*1000))
 
-            src_ip = ipv4_to_int(cells[5])
-            dst_ip = ipv4_to_int(cells[6])
-            pkts = int(cells[9])
+            src_ips.append(cells[5])
+            dst_ips.append(cells[6])
+            pkts.append(int(cells[9]))
 
-            if direction == 'in':
-                in_table.append((router, src_ip, dst_ip, ts, pkts))
-            else:
-                out_table.append((router, src_ip, dst_ip, ts, pkts))
+    # all packets are incoming
+    in_arr_final = get_table(routers, ipv4_to_int_array(src_ips), ipv4_to_int_array(dst_ips), timestamps, pkts)
+    out_arr_final = get_table([], [], [], [], [])
+
+    return (in_arr_final, out_arr_final)
+
+
+def get_table(routers, src_ips, dst_ips, timestamps, pkts):
+    """ Function to get pandas table from packet columns
+
+    Args:
+        routers (array): router of each entry
+        src_ips (array): src IP (int) of each entry
+        dst_ips (array): dst IP (int) of each entry
+        timestamps (array): timestamp (ms) of each entry
+        pkts (array or int): number of packets of each entry
+
+    Returns:
+        pandas table with the columns router_ip, src_ip, dst_ip, ts_end and pkts
+    """
 
     column_type = [('router_ip', 'uint32'), ('src_ip', 'uint32'),
                    ('dst_ip', 'uint32'), ('ts_end', 'uint64'),
                    ('pkts', 'uint32')]
 
-    in_arr = np.array(in_table, dtype=column_type)
-    in_arr_final = pd.DataFrame.from_records(in_arr)
+    arr = np.empty(len(src_ips), dtype=column_type)
+    arr['router_ip'] = routers
+    arr['src_ip'] = src_ips
+    arr['dst_ip'] = dst_ips
+    arr['ts_end'] = timestamps
+    arr['pkts'] = pkts
 
-    out_arr = np.array(out_table, dtype=column_type)
-    out_arr_final = pd.DataFrame.from_records(out_arr)
-
-    return (in_arr_final, out_arr_final)
+    return pd.DataFrame.from_records(arr)
 
 
 if __name__ == '__main__':
@@ -3,6 +3,7 @@
 
 import struct
 import socket
+import numpy as np
 
 
 def ipv4_to_int(ip):
@@ -17,6 +18,59 @@ def ipv4_to_str(ip):
     return socket.inet_ntoa(struct.pack("!I", ip))
 
 
+def ipv4_to_int_array(ips):
+    """ Converts many IPv4 addresses from str (or bytes) to int at once
+
+    ips (array-like): IPv4 addresses in dot notation
+
+    returns: np.array (uint32) with the IPv4 addresses as int
+    """
+
+    chars = np.asarray(ips, dtype='S')
+    n_ips = len(chars)
+    if n_ips == 0:
+        return np.empty(0, dtype=np.uint32)
+
+    # one row per address, padded with spaces and terminated by a dot
+    # -> the whole array can be parsed as one string of dot separated numbers
+    text = np.full((n_ips, chars.itemsize + 1), ord('.'), dtype=np.uint8)
+    text[:, :-1] = chars.view(np.uint8).reshape(n_ips, chars.itemsize)
+
+    # each address has exactly 3 dots (no empty octets) and at most 15 characters
+    dots = text == ord('.')
+    empty = dots[:, 0] | np.any(dots[:, :-1] & (dots[:, 1:] | (text[:, 1:] == 0)), axis=1)
+    if chars.itemsize > 15 or np.any(dots.sum(axis=1) != 4) or np.any(empty):
+        raise ValueError('invalid IPv4 address in input')
+
+    text[text == 0] = ord(' ')
+
+    # parsing stops early at invalid characters
+    octets = np.fromstring(text.tobytes(), dtype=np.int64, sep='.')
+    if len(octets) != 4 * n_ips or np.any((octets < 0) | (octets > 255)):
+        raise ValueError('invalid IPv4 address in input')
+
+    octets = octets.astype(np.uint32).reshape(n_ips, 4)
+
+    return (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+
+
+def ipv4_to_str_array(ips):
+    """ Converts many IPv4 addresses from int to str at once
+
+    ips (array-like): IPv4 addresses as int
+
+    returns: np.array (object) with the IPv4 addresses in dot notation
+    """
+
+    ips = np.asarray(ips, dtype=np.uint32)
+
+    # each octet string is only created once
+    numbers = np.array([str(i) for i in range(256)], dtype=object)
+    octets = [numbers[(ips >> shift) & 255].tolist() for shift in [24, 16, 8, 0]]
+
+    return np.array(list(map('.'.join, zip(*octets))), dtype=object)
+
+
 def ipv6_to_int(ip):
     """ Fast way to convert IPv6 from str to int
     to combine to one int: (hi << 64) | lo
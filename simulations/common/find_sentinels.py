@@ -4,6 +4,7 @@
 import numpy as np
 import pandas as pd
 import logging
+from collections import deque
 
 
 logger = logging.getLogger("main_step")
@@ -13,6 +14,268 @@ logger.addHandler(logger_handler)
 logger_handler.setFormatter(logging.Formatter("[MAIN:%(asctime)s - %(funcName)12s()] %(message)s",  datefmt='%Y-%m-%d %H:%M:%S'))
 
 
+def search_sentinels(ips, routers, start=16, end=8, num_stop=1):
+    """ Vectorized sentinel search on plain arrays
+
+    Sorts the unique (IP, router) pairs once and then, level by level, masks the
+    IPs of all pairs which are not covered yet. Groups of equal prefixes are
+    contiguous in the sorted pairs, a group is a sentinel if it contains at most
+    num_stop different routers. Covered pairs are removed before the next level.
+
+    ips (array-like): IP of each row (int)
+    routers (array-like): router (unique feature) of each row (int)
+    start (int): start sentinel search as 32-start (default 16)
+    end (int): end sentinel search as 32-end (default 8)
+    num_stop (int): stopping criteria for search (default == 1 <= real Sentinel)
+
+    returns: (sentinels, temp, found)
+        sentinels (dict): sentinel IP -> (size, router)
+        temp (np.ndarray): per row, prefix IP of the level the row was covered at (or of the last level)
+        found (np.ndarray): per row, True if the row is covered by a sentinel
+    """
+
+    ips = np.asarray(ips, dtype=np.uint64)
+    routers = np.asarray(routers, dtype=np.uint64)
+
+    # unique (IP, router) pairs, sorted by IP and then router
+    pairs, inverse = np.unique((ips << np.uint64(32)) | routers, return_inverse=True)
+    pair_ips = (pairs >> np.uint64(32)).astype(np.int64)
+    pair_routers = (pairs & np.uint64(0xffffffff)).astype(np.int64)
+
+    pair_temp = np.zeros(len(pairs), dtype=np.int64)
+    pair_found = np.zeros(len(pairs), dtype=bool)
+    active = np.arange(len(pairs))
+
+    sentinels = dict()
+
+    # the legacy pandas search never found sentinels on level start
+    # ("" == False does not hold for the initial result column),
+    # we keep this behavior such that the results stay the same
+    for i in range(start-1, end-1, -1):
+        if len(active) == 0:
+            break
+
+        logger.info("Starting Sentinel search level %s", 32-i)
+
+        prefixes = (pair_ips[active] >> i) << i
+        group_routers = pair_routers[active]
+        pair_temp[active] = prefixes
+
+        # groups of equal prefixes are contiguous
+        starts = np.flatnonzero(np.r_[True, prefixes[1:] != prefixes[:-1]])
+        sizes = np.diff(np.r_[starts, len(active)])
+
+        if num_stop == 1:
+            is_sentinel = np.minimum.reduceat(group_routers, starts) == np.maximum.reduceat(group_routers, starts)
+        else:
+            # count the different routers per group
+            group_ids = np.repeat(np.arange(len(starts)), sizes)
+            order = np.lexsort((group_routers, group_ids))
+            sorted_routers = group_routers[order]
+            is_new = np.r_[True, (sorted_routers[1:] != sorted_routers[:-1]) | (group_ids[order][1:] != group_ids[order][:-1])]
+            is_sentinel = np.add.reduceat(is_new, starts) <= num_stop
+
+        # router of the last pair in each sentinel group
+        last = starts[is_sentinel] + sizes[is_sentinel] - 1
+        for ip, router in zip(prefixes[last].tolist(), group_routers[last].tolist()):
+            sentinels[ip] = (32-i, router)
+
+        covered = np.repeat(is_sentinel, sizes)
+        pair_found[active[covered]] = True
+        active = active[~covered]
+
+    return sentinels, pair_temp[inverse], pair_found[inverse]
+
+
+class SentinelWindow:
+    """ Sentinel search over a sliding window of packet batches
+
+    Keeps, per prefix level, the routers seen below each prefix with reference
+    counts. On the last level a (prefix, router) pair is present as long as one
+    batch in the window contains it, on all other levels a count is the number
+    of child prefixes containing the router. Adding or expiring a batch only
+    propagates pairs which appear or disappear (counts becoming 1 or 0) and
+    only the subtrees (below a prefix of the first level) with changed router
+    sets are searched again.
+
+    Finds the same sentinels as search_sentinels with num_stop == 1.
+    """
+
+    def __init__(self, size, start=16, end=8):
+        """ constructor
+
+        size (int): number of batches in the window
+        start (int): start sentinel search as 32-start (default 16)
+        end (int): end sentinel search as 32-end (default 8)
+        """
+
+        self.size = size
+
+        # shift of each searched level, from the first (shortest prefix) to the last one
+        # (level start is skipped, as in search_sentinels)
+        self.shifts = list(range(start-1, end-1, -1))
+
+        # per level: prefix IP -> (router -> count)
+        self.nodes = [dict() for _ in self.shifts]
+
+        # unique (prefix << 32 | router) pairs of the last level for each batch
+        self.batches = deque()
+        self.changed_roots = set()
+
+        # sentinel IP -> (size, router) and sentinel IPs per first level prefix
+        self.sentinels = dict()
+        self.root_sentinels = dict()
+
+    def push(self, ips, routers):
+        """ Adds a batch of packets and expires the oldest one if the window is full
+
+        ips (array-like): IP of each packet (int)
+        routers (array-like): router of each packet (int)
+        """
+
+        if self.shifts:
+            shift = np.uint64(self.shifts[-1])
+            ips = np.asarray(ips, dtype=np.uint64)
+            routers = np.asarray(routers, dtype=np.uint64)
+            keys = np.unique((((ips >> shift) << shift) << np.uint64(32)) | routers)
+        else:
+            keys = np.empty(0, dtype=np.uint64)
+
+        # pairs which are not in the window yet
+        if self.batches:
+            added = keys[~np.isin(keys, np.concatenate(self.batches))]
+        else:
+            added = keys
+
+        self.batches.append(keys)
+        self.update(added.tolist(), 1)
+
+        # pairs which are not in any other batch of the window
+        if len(self.batches) > self.size:
+            expired = self.batches.popleft()
+            expired = expired[~np.isin(expired, np.concatenate(self.batches))]
+            self.update(expired.tolist(), -1)
+
+    def update(self, keys, delta):
+        """ Updates the reference counts for pairs which appeared or disappeared
+
+        keys (list): (prefix << 32 | router) pairs of the last level
+        delta (int): 1 if the pairs appeared, -1 if they disappeared
+        """
+
+        for level in range(len(self.shifts)-1, -1, -1):
+            nodes = self.nodes[level]
+
+            changed = list()
+            for key in keys:
+                prefix = key >> 32
+                router = key & 0xffffffff
+
+                prefix_routers = nodes.get(prefix)
+                if prefix_routers is None:
+                    prefix_routers = nodes[prefix] = dict()
+
+                count = prefix_routers.get(router, 0) + delta
+                if count == 0:
+                    del prefix_routers[router]
+                    if not prefix_routers:
+                        del nodes[prefix]
+                    changed.append(key)
+                else:
+                    prefix_routers[router] = count
+                    if count == 1 and delta == 1:
+                        changed.append(key)
+
+            # every change on the last level can change the sentinels below its first level prefix
+            if level == len(self.shifts)-1:
+                root_shift = self.shifts[0]
+                self.changed_roots.update(((key >> 32) >> root_shift) << root_shift for key in changed)
+
+            if level > 0:
+                shift = self.shifts[level-1]
+                keys = [((((key >> 32) >> shift) << shift) << 32) | (key & 0xffffffff) for key in changed]
+
+    def search_root(self, root, others=()):
+        """ Searches the sentinels below a first level prefix
+
+        root (int): first level prefix IP
+        others (list): other windows whose packets are considered as well
+
+        returns: list of (IP, size, router)
+        """
+
+        found = list()
+        stack = [(root, 0)]
+        while stack:
+            prefix, level = stack.pop()
+
+            prefix_routers = self.nodes[level].get(prefix, dict())
+            if others:
+                prefix_routers = set(prefix_routers)
+                for other in others:
+                    prefix_routers.update(other.nodes[level].get(prefix, dict()))
+
+            if not prefix_routers:
+                continue
+
+            # first prefix with a single router is a sentinel
+            if len(prefix_routers) == 1:
+                found.append((prefix, 32-self.shifts[level], next(iter(prefix_routers))))
+
+            elif level+1 < len(self.shifts):
+                shift = self.shifts[level+1]
+                stack.append((prefix, level+1))
+                stack.append((prefix | (1 << shift), level+1))
+
+        return found
+
+    def get_sentinels(self):
+        """ Returns the sentinels of all batches in the window
+
+        returns: dict (sentinel IP: (size, router)), do not modify
+        """
+
+        for root in self.changed_roots:
+            for ip in self.root_sentinels.pop(root, list()):
+                del self.sentinels[ip]
+
+            found = self.search_root(root)
+            for ip, size, router in found:
+                self.sentinels[ip] = (size, router)
+
+            if found:
+                self.root_sentinels[root] = [ip for ip, _, _ in found]
+
+        self.changed_roots = set()
+
+        return self.sentinels
+
+    def get_merged_sentinels(self, other):
+        """ Returns the sentinels of all batches in this and another window
+        (both with the same search levels). Only the subtrees in which the
+        other window contains packets are searched again, the sentinels of
+        all other subtrees are the ones of this window.
+
+        other (SentinelWindow): window with (usually few) additional packets
+
+        returns: dict (sentinel IP: (size, router))
+        """
+
+        sentinels = dict(self.get_sentinels())
+
+        if not self.shifts:
+            return sentinels
+
+        for root in other.nodes[0]:
+            for ip in self.root_sentinels.get(root, list()):
+                del sentinels[ip]
+
+            for ip, size, router in self.search_root(root, [other]):
+                sentinels[ip] = (size, router)
+
+        return sentinels
+
+
 class Sentinel:
     """ Sentinel class
 
@@ -121,26 +384,17 @@ class Sentinel:
         returns: set of all found sentinels (IP, size, router)
         """
 
-        temp_set = dict()
-
-        self.t_in['temp'] = ""
-        self.t_in[result_name] = ""
-
-        # end-1 as second point is not included in range
-        for i in range(start, end-1, -1):
-            logger.info("Starting Sentinel search level %s for %s", 32-i, result_name)
-            self.t_in.loc[self.t_in[result_name] == False, 'temp'] = self.t_in[ip_to_use].loc[self.t_in[result_name] == False].apply(lambda ip: (ip >> i) << i)
-
-            if for_ingress:
-                temp = self.t_in.loc[self.t_in[result_name] == False].groupby('temp')[unique_column].nunique()
-            else:
-                temp = self.t_out.loc[self.t_out[result_name] == False].groupby('temp')[unique_column].nunique()
+        if for_ingress:
+            table = self.t_in
+        else:
+            table = self.t_out
 
-            for ip, count in temp.items():
-                if count <= num_stop:
-                    temp_set[ip] = 32-i
+        sentinels, temp, found = search_sentinels(table[ip_to_use].values, table[unique_column].values,
+                                                  start=start, end=end, num_stop=num_stop)
+        table['temp'] = temp
+        table[result_name] = found
 
-            self.t_in[result_name] = self.t_in['temp'].apply(lambda key: key in temp_set)
+        temp_set = {ip: size for ip, (size, _) in sentinels.items()}
 
         # mark matching observations on other side of the network
         if mark_name:
@@ -172,7 +426,7 @@ class Sentinel:
             self.write_all_sentinels(for_ingress, ip_to_use, temp_set)
 
         if not keep_temp:
-            self.t_in.drop(columns=['temp'], inplace=True)
+            table.drop(columns=['temp'], inplace=True)
 
         if for_ingress:
             if ip_to_use == 'src_ip':
@@ -1,4 +1,9 @@
+import argparse
+import os
+import re
 from os import walk
+from multiprocessing import Pool
+import pandas as pd
 
 # number of border routers to use for load- and frequency-based results
 B_TO_USE = 32
@@ -9,37 +14,147 @@ L_TO_USE = 4
 # frequency to use for border- and load-based results
 F_TO_USE = 1024
 
-# switch between 30 and 60
+# switch between 30 and 60
 DURATION = 60
 
 FLOAT_VALUES = [
     'iteration_end_ts'
 ]
 
+# columns of the result files (see ../sim_output.py) which are not results
+INDEX_COLUMNS = ['iteration', 'variant']
+
+# variant of results which are shared by all top k cases
+SHARED = 'shared'
+
+# result columns used for the plot data, only those are read
+RESULT_COLUMNS = [
+    'n_total_packets',
+    'n_prefixes',
+    'n_mirrored_packets',
+    'prefix_correct_sampling',
+    'prefix_covered_not_unique_sampling',
+    'pkt_covered_correct_sampling',
+    'pkt_covered_correct_not_unique_sampling',
+    'prefix_correct_sentinel',
+    'prefix_covered_not_unique_sentinel',
+    'pkt_covered_correct_sentinel',
+    'pkt_covered_not_unique_sentinel',
+    'n_sentinels_total_mirroring',
+    'n_sentinels_added_mirroring',
+    'n_sentinels_removed_mirroring',
+    'n_mirrored_packets_mirroring',
+    'prefix_correct_mirroring',
+    'prefix_covered_not_unique_mirroring',
+    'prefix_not_active_mirroring',
+    'pkt_covered_correct_mirroring',
+    'pkt_covered_not_unique_mirroring',
+]
+
+# values of each top k case which are written into the plot data
+CASE_VALUES = [
+    'sentinels_total_mirroring',
+    'sentinels_added_mirroring',
+    'sentinels_removed_mirroring',
+    'coverage_sentinel_mirroring_prefix',
+    'coverage_sentinel_mirroring_packet',
+    'mirrored_traffic_magnifier',
+    'verified_prefix_space',
+    'verified_prefix_space_in_trace',
+]
+
+# all values which are averaged over the iterations of a simulation (see get_plot_values)
+PLOT_VALUES = [
+    'coverage_sampling_prefix',
+    'coverage_sampling_packet',
+    'coverage_sentinel_sampling_prefix',
+    'coverage_sentinel_sampling_packet',
+    'mirrored_traffic_everflow',
+    'active_prefix_space',
+    'coverage_sampling_prefix_absolute',
+] + CASE_VALUES
+
+# names of the result files written by the runner
+RESULT_NAME = re.compile(r'^b_(\d+)_l_(\d+)_d_(\d+)_f_(\d+)_m_(\d+)_t_(\d+)$')
+
+# index levels of all results which identify a single simulation (see load_results)
+EXPERIMENT_LEVELS = ['experiment', 'border', 'load', 'duration', 'frequency', 'magnifier', 'traffic']
+
 # simulation results to consider: ADD YOUR RESULT NAMES HERE, e.g. '2022-01-01_18-03-02'
 result_folders = [
     
 ]
 
 
-def read_data(filename):
-    """ Reads in all data from a simulation csv results file
+def read_data(filename, columns=None):
+    """ Reads in data from a simulation csv results file
+
+    Result files have one row per iteration and variant (see ../sim_output.py),
+    only the given columns are parsed. Files of older simulations with one row
+    per result are read as well.
 
     Args:
       filename (str): file to read
+      columns (list): result columns to read (e.g., prefix_correct_mirroring for all variants),
+                      None to read all
 
     Returns:
       dict (metric: values)
-        metric: specific result metric
+        metric: specific result metric (e.g., top_100_activity_prefix_correct_mirroring)
         values: list with values for each iteration
     """
 
+    with open(filename, 'r') as data_in:
+        header = data_in.readline().strip().split(',')
+
+    if header[:len(INDEX_COLUMNS)] != INDEX_COLUMNS:
+        return read_data_rows(filename, columns)
+
+    if columns is None:
+        columns = header[len(INDEX_COLUMNS):]
+    columns = [column for column in header if column in columns]
+
+    dtypes = {column: 'float64' if column in FLOAT_VALUES else 'Int64' for column in columns}
+    dtypes['variant'] = 'str'
+    frame = pd.read_csv(filename, usecols=INDEX_COLUMNS + columns, dtype=dtypes, float_precision='round_trip')
+
+    data = dict()
+    for variant, rows in frame.groupby('variant', sort=False):
+        for column in columns:
+            values = rows[column].dropna()
+            if len(values) == 0:
+                continue
+
+            if variant == SHARED:
+                data[column] = values.tolist()
+            else:
+                data['{}_{}'.format(variant, column)] = values.tolist()
+
+    return data
+
+
+def read_data_rows(filename, columns=None):
+    """ Reads in data from a simulation csv results file with one row per result
+    (written by older simulations)
+
+    Args:
+      filename (str): file to read
+      columns (list): result columns to read, see read_data
+
+    Returns:
+      dict (metric: values), see read_data
+    """
+
     data = dict()
 
     with open(filename, 'r') as data_in:
         for line in data_in:
             cells = line.strip().split(',')
 
+            if columns is not None and not any(cells[0] == column or cells[0].endswith('_' + column)
+                                               for column in columns):
+                continue
+
             if cells[0] not in FLOAT_VALUES:
                 data[cells[0]] = [int(x) for x in cells[1:]]
             else:
@@ -48,6 +163,7 @@ def read_data(filename):
     return data
 
 
+# no longer used, see get_plot_values
 def get_prefix_space_average(correct, correct_not_unique, not_active):
     """ Returns the average prefix space covered by sentinels with mirroring
 
@@ -71,6 +187,7 @@ def get_prefix_space_average(correct, correct_not_unique, not_active):
     return get_average(temp)
 
 
+# no longer used, see get_plot_values
 def get_unique_coverage_average(correct, correct_not_unique, total):
     """ Returns the average coverage values for correctly (unique) packets
         or /24 prefixes based on ground truth data
@@ -108,39 +225,225 @@ def get_average(data_1, data_2=None):
         return sum([x/y for x, y in zip(data_1, data_2)]) / len(data_1)
 
 
-def prepare_plot_data():
-    """ Extracts all simulation results and prepares specific plot input files
+def read_frame(filename, columns):
+    """ Reads in data from a simulation csv results file as a frame
+
+    All results are read as floats (integer results are exact) such that
+    missing values are NaN and the frame can be aggregated with numpy.
+
+    Args:
+      filename (str): file to read
+      columns (list): result columns to read (see read_data)
+
+    Returns:
+      pd.DataFrame indexed by (variant, iteration) with one column per result column,
+      results which are not in the file are NaN
     """
 
-    data = dict()
+    with open(filename, 'r') as data_in:
+        header = data_in.readline().strip().split(',')
+
+    if header[:len(INDEX_COLUMNS)] == INDEX_COLUMNS:
+        usecols = INDEX_COLUMNS + [column for column in header if column in columns]
+        dtypes = {column: 'float64' for column in usecols}
+        dtypes.update({'iteration': 'int64', 'variant': 'str'})
+
+        frame = pd.read_csv(filename, usecols=usecols, dtype=dtypes, float_precision='round_trip')
+        return frame.set_index(['variant', 'iteration']).reindex(columns=columns)
+
+    # older simulations: split the result names into variant and column,
+    # their results start at iteration 3
+    variants = dict()
+    for name, values in read_data_rows(filename, columns).items():
+        for column in sorted(columns, key=len, reverse=True):
+            if name == column:
+                variant = SHARED
+            elif name.endswith('_' + column):
+                variant = name[:-len(column) - 1]
+            else:
+                continue
+
+            variants.setdefault(variant, dict())[column] = values
+            break
+
+    index = list()
+    data = {column: list() for column in columns}
+    for variant, results in variants.items():
+        n_iterations = max(len(values) for values in results.values())
+        index.extend((variant, 3 + i) for i in range(n_iterations))
+
+        for column in columns:
+            values = results.get(column, [])
+            data[column].extend(values + [float('nan')] * (n_iterations - len(values)))
+
+    return pd.DataFrame(data, index=pd.MultiIndex.from_tuples(index, names=['variant', 'iteration']),
+                        columns=columns, dtype='float64')
+
+
+def read_result(path):
+    """ Reads a result file (used by the worker processes of load_results)
+
+    Args:
+      path (str): result file
+
+    Returns:
+      (path, frame), see read_frame
+    """
+    return (path, read_frame(path, RESULT_COLUMNS))
+
+
+def merge_duplicate(name, old, new):
+    """ Merges the results of a simulation which are available twice
+
+    Args:
+      name (str): simulation name (e.g., b_4_l_1_d_60_f_1024_m_1_t_0)
+      old (pd.DataFrame): results read first (see read_frame)
+      new (pd.DataFrame): results read afterwards, for now we want the newer values
 
-    # get all simulation results in specified folders
-    for result in result_folders:
+    Returns:
+      pd.DataFrame with the merged results
+    """
+
+    print('results for {} are available twice in given files'.format(name))
+    if old.equals(new):
+        print('   both files contain the same values')
+        return old
+
+    print('   the read in values differ!!!')
+    merged = old.reindex(old.index.union(new.index))
+    for variant in new.index.unique('variant'):
+        for column in new.columns:
+            values = new.loc[variant, column].dropna()
+            if len(values) == 0:
+                continue
+
+            key = column if variant == SHARED else '{}_{}'.format(variant, column)
+            old_values = old.loc[variant, column].dropna() if variant in old.index.unique('variant') else values[:0]
+
+            if len(old_values) == 0:
+                print('   {} does not exist in old data'.format(key))
+            elif old_values.tolist() != values.tolist():
+                print(key)
+                print('   old:', old_values.mean())
+                print('   new:', values.mean())
+
+            merged.loc[variant, column] = values.reindex(merged.loc[variant].index).values
+
+    return merged.dropna(how='all')
+
+
+def load_results(folders, processes=None):
+    """ Reads all simulation results in the given folders in parallel
+
+    Args:
+      folders (list): result folders (see result_folders)
+      processes (int): number of processes reading result files, None means all cores
+
+    Returns:
+      pd.DataFrame with one column per result column (see RESULT_COLUMNS)
+      indexed by (EXPERIMENT_LEVELS, variant, iteration), experiment is the
+      simulation name (e.g., b_4_l_1_d_60_f_1024_m_1_t_0)
+    """
+
+    paths = list()
+    for result in folders:
         for (dirpath, _, filenames) in walk(result):
             for file in filenames:
-                if file.endswith('csv'):
-                    data_name = file.split('.')[0]
-                    data_got = read_data(dirpath+'/'+file)
-                    if data_name in data:
-                        print('results for {} are available twice in given files'.format(data_name))
-                        if data_got == data[data_name]:
-                            print('   both files contain the same values')
-                        else:
-                            print('   the read in values differ!!!')
-                            for key, value in data_got.items():
-                                if key not in data[data_name]:
-                                    print('   {} does not exist in old data'.format(key))
-                                    data[data_name][key] = data_got[key]
-                                elif data[data_name][key] != data_got[key]:
-                                    print(key)
-                                    print('   old:', get_average(data[data_name][key]))
-                                    print('   new:', get_average(data_got[key]))
-                                    # for now we want the newer values
-                                    data[data_name][key] = data_got[key]
-
-                    # in case of different entries, we keep the old ones
-                    else:
-                        data[data_name] = data_got
+                if file.endswith('csv') and RESULT_NAME.match(file.split('.')[0]):
+                    paths.append(os.path.join(dirpath, file))
+
+    if not paths:
+        return pd.DataFrame(
+            columns=RESULT_COLUMNS,
+            index=pd.MultiIndex.from_tuples([], names=EXPERIMENT_LEVELS + ['variant', 'iteration']))
+
+    with Pool(processes) as pool:
+        frames = dict()
+        for path, frame in pool.imap(read_result, paths):
+            name = os.path.basename(path).split('.')[0]
+            if name in frames:
+                frames[name] = merge_duplicate(name, frames[name], frame)
+            else:
+                frames[name] = frame
+
+    keys = [(name, *[int(x) for x in RESULT_NAME.match(name).groups()]) for name in frames]
+    return pd.concat(frames.values(), keys=keys, names=EXPERIMENT_LEVELS)
+
+
+def get_plot_values(results):
+    """ Computes the averages over all iterations of each simulation
+
+    Args:
+      results (pd.DataFrame): results of all simulations (see load_results)
+
+    Returns:
+      pd.DataFrame indexed by (EXPERIMENT_LEVELS, variant) with one column per plot value
+      (e.g., coverage_sampling_prefix), values shared by all top k cases use the variant SHARED
+    """
+
+    results = results.reset_index()
+
+    # results of each top k case are relative to the shared totals of the same iteration
+    totals = ['n_total_packets', 'n_prefixes', 'n_mirrored_packets']
+    shared = results.loc[results['variant'] == SHARED, EXPERIMENT_LEVELS + ['iteration'] + totals]
+    cases = results.loc[results['variant'] != SHARED].drop(columns=totals).merge(
+        shared, on=EXPERIMENT_LEVELS + ['iteration'], how='left')
+
+    values = pd.DataFrame({
+        # ... shared by all top k cases
+        'mirrored_traffic_everflow': shared['n_mirrored_packets'] / shared['n_total_packets'],
+        'active_prefix_space': shared['n_prefixes'],
+    })
+    values[EXPERIMENT_LEVELS] = shared[EXPERIMENT_LEVELS]
+    values['variant'] = SHARED
+
+    prefix_sentinel = cases['prefix_correct_mirroring'] - cases['prefix_covered_not_unique_mirroring']
+    case_values = pd.DataFrame({
+        # ... sampling only
+        'coverage_sampling_prefix': (cases['prefix_correct_sampling'] - cases['prefix_covered_not_unique_sampling'])
+        / cases['n_prefixes'],
+        'coverage_sampling_packet': (cases['pkt_covered_correct_sampling'] - cases['pkt_covered_correct_not_unique_sampling'])
+        / cases['n_total_packets'],
+        'coverage_sampling_prefix_absolute': cases['prefix_correct_sampling'],
+
+        # ... sentinels based on samples
+        'coverage_sentinel_sampling_prefix': (cases['prefix_correct_sentinel'] - cases['prefix_covered_not_unique_sentinel'])
+        / cases['n_prefixes'],
+        'coverage_sentinel_sampling_packet': (cases['pkt_covered_correct_sentinel'] - cases['pkt_covered_not_unique_sentinel'])
+        / cases['n_total_packets'],
+
+        # ... total and added/removed sentinels
+        'sentinels_total_mirroring': cases['n_sentinels_total_mirroring'],
+        'sentinels_added_mirroring': cases['n_sentinels_added_mirroring'],
+        'sentinels_removed_mirroring': cases['n_sentinels_removed_mirroring'],
+
+        # ... coverage
+        'coverage_sentinel_mirroring_prefix': prefix_sentinel / cases['n_prefixes'],
+        'coverage_sentinel_mirroring_packet': (cases['pkt_covered_correct_mirroring'] - cases['pkt_covered_not_unique_mirroring'])
+        / cases['n_total_packets'],
+
+        # ... mirroring
+        'mirrored_traffic_magnifier': cases['n_mirrored_packets_mirroring'] / cases['n_total_packets'],
+
+        # ... total prefix space coverage (and in gt data only)
+        'verified_prefix_space': prefix_sentinel + cases['prefix_not_active_mirroring'],
+        'verified_prefix_space_in_trace': prefix_sentinel,
+    })
+    case_values[EXPERIMENT_LEVELS + ['variant']] = cases[EXPERIMENT_LEVELS + ['variant']]
+
+    # average over all iterations (empty values are skipped)
+    values = pd.concat([values, case_values]).astype({name: 'float64' for name in PLOT_VALUES})
+    return values.groupby(EXPERIMENT_LEVELS + ['variant'], sort=False)[PLOT_VALUES].mean()
+
+
+def prepare_plot_data(processes=None):
+    """ Extracts all simulation results and prepares specific plot input files
+
+    Args:
+      processes (int): number of processes reading result files, None means all cores
+    """
+
+    plot_values = get_plot_values(load_results(result_folders, processes))
 
     n_border_routers = [4, 8, 16, 32, 64]
     load_factor = [1, 2, 4, 12]
@@ -157,132 +460,22 @@ def prepare_plot_data():
         else:
             suffixes.append('full')
 
-    # calculate all possible output data of interest
+    # all possible output data of interest (plot value and simulation name: average)
     output_data = dict()
-    for m in [0, 1]:
-        for t in [0, 1, 2, 3]:
-            for border in n_border_routers:
-                for load in load_factor:
-                    for frequency in frequencies:
-                        name = 'b_{}_l_{}_d_{}_f_{}_m_{}_t_{}'.format(
-                            border,
-                            load,
-                            DURATION,
-                            frequency,
-                            m,
-                            t,
-                        )
-
-                        # skip if current name not in input files
-                        if name not in data:
-                            continue
-
-                        # compute pkt coverage and mirrored traffic values
-                        # ... sampling only
-                        output_data['coverage_sampling_prefix_{}'.format(name)] = get_unique_coverage_average(
-                            data[name]['full_prefix_correct_sampling'],
-                            data[name]['full_prefix_covered_not_unique_sampling'],
-                            data[name]['n_prefixes']
-                        )
-
-                        output_data['coverage_sampling_packet_{}'.format(name)] = get_unique_coverage_average(
-                            data[name]['full_pkt_covered_correct_sampling'],
-                            data[name]['full_pkt_covered_correct_not_unique_sampling'],
-                            data[name]['n_total_packets']
-                        )
-
-                        # ... sentinels based on samples
-                        output_data['coverage_sentinel_sampling_prefix_{}'.format(name)] = get_unique_coverage_average(
-                            data[name]['full_prefix_correct_sentinel'],
-                            data[name]['full_prefix_covered_not_unique_sentinel'],
-                            data[name]['n_prefixes']
-                        )
-
-                        output_data['coverage_sentinel_sampling_packet_{}'.format(name)] = get_unique_coverage_average(
-                            data[name]['full_pkt_covered_correct_sentinel'],
-                            data[name]['full_pkt_covered_not_unique_sentinel'],
-                            data[name]['n_total_packets']
-                        )
-
-                        # ... everflow only
-                        # ... ... mirrored traffic
-                        if m == 0:
-                            output_data['mirrored_traffic_everflow_{}'.format(name)] = get_average(
-                                data[name]['n_mirrored_packets'],
-                                data[name]['n_total_packets'],
-                            )
+    data = set()
+    for (name, *_, variant), row in plot_values.iterrows():
+        data.add(name)
+        for value, average in row.dropna().items():
+            if variant == SHARED or value.startswith('coverage_sampling') or value.startswith('coverage_sentinel_sampling'):
+                output_data['{}_{}'.format(value, name)] = average
+            else:
+                output_data['{}_{}_{}'.format(value, variant, name)] = average
 
-                        # ... magnifier only
-                        if m == 1:
-                            # ... ... total active prefix space (same for all suffixes)
-                            output_data['active_prefix_space_{}'.format(name)] = get_average(
-                                    data[name]['n_prefixes'],
-                            )
-
-                            # ... ... absolute value of covered prefix space with samples only
-                            #         note that we also count not unique prefixes to have same value for worst and best
-                            output_data['coverage_sampling_prefix_absolute_{}'.format(name)] = get_average(
-                                    data[name]['full_prefix_correct_sampling']
-                            )
-
-                            for suffix in suffixes:
-                                # we do not have the suffix in all files:
-                                if suffix + '_n_sentinels_total_mirroring' not in data[name]:
-                                    output_data['sentinels_total_mirroring_{}_{}'.format(suffix, name)] = -1
-                                    output_data['sentinels_added_mirroring_{}_{}'.format(suffix, name)] = -1
-                                    output_data['sentinels_removed_mirroring_{}_{}'.format(suffix, name)] = -1
-                                    output_data['coverage_sentinel_mirroring_prefix_{}_{}'.format(suffix, name)] = -1
-                                    output_data['coverage_sentinel_mirroring_packet_{}_{}'.format(suffix, name)] = -1
-                                    output_data['mirrored_traffic_magnifier_{}_{}'.format(suffix, name)] = -1
-                                    output_data['verified_prefix_space_{}_{}'.format(suffix, name)] = -1
-                                    output_data['verified_prefix_space_in_trace_{}_{}'.format(suffix, name)] = -1
-
-                                else:
-                                    # ... ... total and added/removed sentinels
-                                    output_data['sentinels_total_mirroring_{}_{}'.format(suffix, name)] = get_average(
-                                        data[name][suffix + '_n_sentinels_total_mirroring'],
-                                    )
-
-                                    output_data['sentinels_added_mirroring_{}_{}'.format(suffix, name)] = get_average(
-                                        data[name][suffix + '_n_sentinels_added_mirroring'],
-                                    )
-
-                                    output_data['sentinels_removed_mirroring_{}_{}'.format(suffix, name)] = get_average(
-                                        data[name][suffix + '_n_sentinels_removed_mirroring'],
-                                    )
-
-                                    # ... ... coverage
-                                    output_data['coverage_sentinel_mirroring_prefix_{}_{}'.format(suffix, name)] = get_unique_coverage_average(
-                                        data[name][suffix + '_prefix_correct_mirroring'],
-                                        data[name][suffix + '_prefix_covered_not_unique_mirroring'],
-                                        data[name]['n_prefixes']
-                                    )
-
-                                    output_data['coverage_sentinel_mirroring_packet_{}_{}'.format(suffix, name)] = get_unique_coverage_average(
-                                        data[name][suffix + '_pkt_covered_correct_mirroring'],
-                                        data[name][suffix + '_pkt_covered_not_unique_mirroring'],
-                                        data[name]['n_total_packets']
-                                    )
-
-                                    # ... ... mirroring
-                                    output_data['mirrored_traffic_magnifier_{}_{}'.format(suffix, name)] = get_average(
-                                        data[name][suffix + '_n_mirrored_packets_mirroring'],
-                                        data[name]['n_total_packets'],
-                                    )
-
-                                    # ... ... total prefix space coverage
-                                    output_data['verified_prefix_space_{}_{}'.format(suffix, name)] = get_prefix_space_average(
-                                        data[name][suffix + '_prefix_correct_mirroring'],
-                                        data[name][suffix + '_prefix_covered_not_unique_mirroring'],
-                                        data[name][suffix + '_prefix_not_active_mirroring'],
-                                    )
-
-                                    # ... ... total prefix space coverage (in gt data only)
-                                    output_data['verified_prefix_space_in_trace_{}_{}'.format(suffix, name)] = get_prefix_space_average(
-                                        data[name][suffix + '_prefix_correct_mirroring'],
-                                        data[name][suffix + '_prefix_covered_not_unique_mirroring'],
-                                        None,
-                                    )
+    # we do not have all suffixes in all files
+    for name in data:
+        for suffix in suffixes:
+            for value in CASE_VALUES:
+                output_data.setdefault('{}_{}_{}'.format(value, suffix, name), -1)
 
     # prepare the csv header line
     csv_header = list()
@@ -484,4 +677,9 @@ def prepare_plot_data():
 
 
 if __name__ == "__main__":
-    prepare_plot_data()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-j', '--processes', default=None, type=int,
+                        help='number of processes reading result files, default all cores')
+    args = parser.parse_args()
+
+    prepare_plot_data(args.processes)
@@ -3,8 +3,10 @@
 
 from common.helpers import setup_logging
 import sys
+import json
 import argparse
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from pathlib import Path
 
@@ -28,12 +30,21 @@ permutation_values = {0: -1, 1: -1, 2: 5, 3: 20}
 
 pcap = '../input_data/simulation_input.csv'
 
+# Approximate memory usage of a single simulation run
+# (all packets of an iteration are kept in memory, peak RSS grows by about
+# 130 bytes (magnifier) and 230 bytes (everflow) per packet of an iteration)
+MEMORY_PER_PKT = 250  # bytes
+MEMORY_BASE = 100 * 1024**2  # bytes
+
 
 def run_simulation(command):
     """ Starts a single simulation run
 
     Args:
         command (str): command string to use
+
+    Returns:
+        int: exit code of the simulation (0 if successful)
     """
 
     log.info("Running simulation...")
@@ -45,6 +56,106 @@ def run_simulation(command):
     log.info("Result run_evaluation (if none, all correct): {}".format(error))
     log.info("{}".format(stdout))
 
+    return result.returncode
+
+
+def get_available_memory():
+    """ Returns the currently available memory
+
+    Returns:
+        int: available memory in bytes (None if unknown)
+    """
+
+    try:
+        with open('/proc/meminfo', 'r') as data_in:
+            for line in data_in:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+
+def estimate_memory(pps):
+    """ Estimates the memory usage of a single simulation run
+
+    Args:
+        pps (int): PPS for simulation
+
+    Returns:
+        int: estimated memory usage in bytes
+    """
+
+    return MEMORY_BASE + pps * duration * MEMORY_PER_PKT
+
+
+def run_simulations(runs, jobs, memory_limit, now):
+    """ Runs prepared simulations in a bounded pool
+
+    A run is only started if at most jobs-1 other runs are active and if
+    its estimated memory fits next to the estimates of all active runs.
+    Runs are started in the given order (if a run does not fit, later
+    smaller runs can still start). A run which does not fit at all is
+    started once nothing else is running.
+
+    Args:
+        runs (list): prepared runs (see prepare_single_run)
+        jobs (int): maximal number of parallel runs
+        memory_limit (int): memory available for all runs in bytes (None: no limit)
+        now (datetime): runner start time
+
+    Returns:
+        int: number of failed runs
+    """
+
+    pending = list(runs)
+    active = dict()
+    n_done = 0
+    n_failed = 0
+
+    log.info("Scheduling {} simulations ({} jobs, memory limit: {})".format(
+        len(runs), jobs, 'none' if memory_limit is None else '{:.1f} GB'.format(memory_limit / 1024**3)))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or active:
+            # admit as many pending runs as possible
+            used = sum(run['memory'] for run in active.values())
+            for run in list(pending):
+                if len(active) >= jobs:
+                    break
+
+                fits = memory_limit is None or used + run['memory'] <= memory_limit
+                if fits or not active:
+                    pending.remove(run)
+                    run['start'] = datetime.now()
+                    active[executor.submit(run_simulation, run['command'])] = run
+                    used += run['memory']
+
+                    log.info("Started {} (estimated memory {:.1f} GB, {} active)".format(
+                        run['name'], run['memory'] / 1024**3, len(active)))
+
+            finished, _ = wait(active, return_when=FIRST_COMPLETED)
+            for future in finished:
+                run = active.pop(future)
+                returncode = future.result()
+                n_done += 1
+
+                simu_end = datetime.now()
+                if returncode != 0:
+                    n_failed += 1
+                    log.error("[{}/{}] {} failed with exit code {} after: {}".format(
+                        n_done, len(runs), run['name'], returncode, simu_end - run['start']))
+                else:
+                    log.info("[{}/{}] {} took: {}".format(n_done, len(runs), run['name'], simu_end - run['start']))
+                log.info("Running since: {}".format(simu_end - now))
+                log.info(" ")
+
+    if n_failed > 0:
+        log.error("{} of {} simulations failed".format(n_failed, len(runs)))
+
+    return n_failed
+
 
 def parse_args(args):
     """Parse command line parameters
@@ -91,11 +202,30 @@ def parse_args(args):
         default=2,
         type=int,
         help='experiment type to run (1: old, 2: border/load, 3: frequency')
+    parser.add_argument(
+        '-j', '--jobs',
+        default=1,
+        type=int,
+        help='maximal number of simulations to run in parallel (default 1)')
+    parser.add_argument(
+        '-M', '--memory',
+        default=None,
+        type=float,
+        help='memory available for all parallel simulations in GB (default: currently available memory)')
+    parser.add_argument(
+        '-S', '--sweep',
+        action='store_true',
+        help='run all simulations with the same PPS in one process over a single scan of the trace')
+    parser.add_argument(
+        '-x', '--profile',
+        action='store_true',
+        help='profile each stage of the simulations (see simulation.py --profile)')
 
     return parser.parse_args(args)
 
 
-def prepare_single_run(n_border_router, load, pps, sampling_rate, result_path, use_magnifier, use_persistent, now):
+def prepare_single_run(n_border_router, load, pps, sampling_rate, result_path, use_magnifier, use_persistent,
+                       profile=False):
     """ Prepares a single simulation run
 
     Args:
@@ -106,7 +236,11 @@ def prepare_single_run(n_border_router, load, pps, sampling_rate, result_path, u
         result_path (str): path to result directory
         use_magnifier (int): use magnifier (1) or not (0)
         use_persistent (int): (0) random, (1) static, (2) permutation 5%, (3) permutation 20%
-        now (datetime): runner start time
+        profile (bool): write a profile file next to the results
+
+    Returns:
+        dict: run with name (output file), command, estimated memory usage,
+            pps and simulation configuration (see prepare_sweeps)
     """
 
     out = "{} {} {}".format(n_border_router, load, pps)
@@ -144,19 +278,76 @@ def prepare_single_run(n_border_router, load, pps, sampling_rate, result_path, u
         permutation_values[use_persistent],
         in_simu_verbosity
     )
+    if profile:
+        command += ' -x'
 
     log.info("| #routers     | {} |".format(n_border_router))
     log.info("| load factor  | {} |".format(load))
     log.info("| frequency    | {} |".format(sampling_rate))
     log.info("| magnifier    | {} |".format(use_magnifier))
     log.info("| distribution | {} |".format(use_persistent))
+    log.info("| output       | {} |".format(out_file))
+
+    return {
+        'name': out_file,
+        'command': command,
+        'memory': estimate_memory(pps),
+        'pps': pps,
+        'config': {
+            'outfile': str(result_path / out_file),
+            'magnifier': use_magnifier,
+            'frequency': sampling_rate,
+            'border': n_border_router,
+            'traffic': use_persistent,
+            'amount': permutation_values[use_persistent],
+            'profile': profile,
+        },
+    }
+
+
+def prepare_sweeps(runs, result_path):
+    """ Combines all prepared runs with the same PPS into sweeps
+    A sweep reads each iteration only once and runs all its simulations
+    in the same process (see simulation.py --sweep).
 
-    simu_start = datetime.now()
-    run_simulation(command)
-    simu_end = datetime.now()
-    log.info("Last simulation took: {}".format(simu_end - simu_start))
-    log.info("Running since: {}".format(simu_end - now))
-    log.info(" ")
+    Args:
+        runs (list): prepared runs (see prepare_single_run)
+        result_path (str): path to result directory
+
+    Returns:
+        list: one run per PPS value with name, command and estimated memory usage
+    """
+
+    groups = dict()
+    for run in runs:
+        groups.setdefault(run['pps'], list()).append(run)
+
+    sweeps = list()
+    for pps, group in groups.items():
+        sweep_file = result_path / 'sweep_pps_{}.json'.format(pps)
+        with open(sweep_file, 'w') as data_out:
+            json.dump([run['config'] for run in group], data_out, indent=1)
+
+        command = "python3 simulation.py -P {} -i {} -d {} -p {} -S {}".format(
+            pps,
+            iterations,
+            duration,
+            pcap,
+            str(sweep_file)
+        )
+
+        # packets are shared but each simulation keeps its own packet lists
+        memory = MEMORY_BASE + sum(run['memory'] - MEMORY_BASE for run in group)
+
+        log.info("Sweep with {} simulations at {} pps".format(len(group), pps))
+
+        sweeps.append({
+            'name': sweep_file.name,
+            'command': command,
+            'memory': memory,
+        })
+
+    return sweeps
 
 
 def main(args):
@@ -181,6 +372,9 @@ def main(args):
         args.traffic)
     setup_logging(args.loglevel, logfile)
 
+    # all simulation runs, started once all of them are prepared
+    runs = list()
+
     # old experiments, not currently used in paper
     if args.experiment == 1:
         for n_border_router in n_border_routers:
@@ -195,14 +389,14 @@ def main(args):
                 )
 
                 # all old experiments used f=1024 by default
-                prepare_single_run(n_border_router,
-                                   load,
-                                   pps,
-                                   default_sampling_rate,
-                                   result_path,
-                                   args.magnifier,
-                                   args.traffic,
-                                   now)
+                runs.append(prepare_single_run(n_border_router,
+                                               load,
+                                               pps,
+                                               default_sampling_rate,
+                                               result_path,
+                                               args.magnifier,
+                                               args.traffic,
+                                               args.profile))
 
     # experiments focused on border and load values (f=1024)
     elif args.experiment == 2:
@@ -227,14 +421,14 @@ def main(args):
                     pps = int(N_PACKETS_TOTAL / 60 / 60 * 2)
 
                 # all uses 1024 sampling frequency
-                prepare_single_run(n_border_router,
-                                   load,
-                                   pps,
-                                   default_sampling_rate,
-                                   result_path,
-                                   args.magnifier,
-                                   args.traffic,
-                                   now)
+                runs.append(prepare_single_run(n_border_router,
+                                               load,
+                                               pps,
+                                               default_sampling_rate,
+                                               result_path,
+                                               args.magnifier,
+                                               args.traffic,
+                                               args.profile))
 
     # experiments focused on load and sampling frequency (b=32)
     elif args.experiment == 3:
@@ -259,14 +453,25 @@ def main(args):
                     pps = int(N_PACKETS_TOTAL / 60 / 60 * 2)
 
                 # all uses 32 border routers
-                prepare_single_run(default_border_routers,
-                                   load,
-                                   pps,
-                                   frequency,
-                                   result_path,
-                                   args.magnifier,
-                                   args.traffic,
-                                   now)
+                runs.append(prepare_single_run(default_border_routers,
+                                               load,
+                                               pps,
+                                               frequency,
+                                               result_path,
+                                               args.magnifier,
+                                               args.traffic,
+                                               args.profile))
+
+    if args.memory is not None:
+        memory_limit = int(args.memory * 1024**3)
+    else:
+        memory_limit = get_available_memory()
+
+    if args.sweep:
+        runs = prepare_sweeps(runs, result_path)
+
+    if run_simulations(runs, args.jobs, memory_limit, now) > 0:
+        sys.exit(1)
 
 
 def run():
@@ -0,0 +1,422 @@
+""" Benchmarks of the simulation hot paths on synthetic traces
+
+Generates CAIDA-like traces (skewed /24 popularity, a few /24 prefixes which
+enter through several border routers) of configurable sizes, runs the stages
+of a magnifier simulation iteration by iteration and times each stage on its
+own. Results (timings and peak RSS) are written as json such that they can be
+compared to the results of an earlier run (-c).
+"""
+
+import argparse
+import json
+import multiprocessing
+import os.path
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from sim_util import get_sentinels, get_ground_truth_data, make_pkt_array, concat_pkts
+from sim_pkts import get_preprocessed_pkts, get_store_columns, get_column_pkts, get_sampled_packets_per_router
+from sim_mirroring import get_mirroring_rules, get_mirrored_packets
+from sim_results import get_results_ground_truth
+from sim_profile import get_peak_rss
+
+from common.pkt_store import PktStoreWriter, load_pkt_store
+
+# synthetic traces are written with the same functions as the real simulation input
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_data'))
+from preprocess_pkt_csv import merge_first_dst, get_chunk_routers, get_store_columns as get_new_store_columns, get_csv_lines
+
+
+# all benchmarked stages in the order they run in an iteration
+STAGES = ['load_csv', 'load_store', 'sample', 'ground_truth', 'sentinels', 'rules', 'mirroring', 'results']
+
+# synthetic traces are generated in chunks of this many packets
+GENERATE_CHUNK = 10000000
+
+# first timestamp of synthetic traces
+START_TS = 1521119300
+
+
+def generate_trace(path, n_pkts, n_prefixes=2**18, skew=1.0, multi=0.05, flags=0.05, rate=400000,
+                   csv_file=None, seed=0):
+    """ Generates a synthetic trace as packet store (and optionally as preprocessed csv file)
+
+    The popularity of the /24 prefixes follows a zipf distribution. Most
+    prefixes always send to the same dst IP (one border router), some of them
+    to 2 - 4 different ones (-> several border routers in the random mapping).
+
+    path (str): store folder
+    n_pkts (int): number of packets
+    n_prefixes (int): number of distinct /24 prefixes
+    skew (float): zipf exponent of the /24 popularity
+    multi (float): fraction of /24 prefixes with several dst IPs
+    flags (float): fraction of packets with an everflow TCP flag
+    rate (int): average packets per second
+    csv_file (str): also write a preprocessed csv file, None to skip it
+    seed (int): random seed
+    """
+
+    rng = np.random.default_rng(seed)
+
+    # /24 prefixes and their popularity
+    keys = rng.choice(2**24, n_prefixes, replace=False).astype(np.uint32)
+    popularity = 1 / np.arange(1, n_prefixes + 1) ** skew
+    popularity /= popularity.sum()
+
+    # dst IPs of each prefix, only the first n_routes are used
+    dst_table = rng.integers(0, 2**32, (n_prefixes, 4), dtype=np.uint32)
+    n_routes = np.where(rng.random(n_prefixes) < multi, rng.integers(2, 5, n_prefixes), 1)
+
+    # first packet of each /24 prefix seen so far
+    prefixes = np.empty(0, dtype=np.uint32)
+    first_dst = np.empty(0, dtype=np.uint32)
+    last_ts = 0.0
+
+    data_out = open(csv_file, 'wb') if csv_file is not None else None
+
+    with PktStoreWriter(path) as writer:
+        for start in range(0, n_pkts, GENERATE_CHUNK):
+            n = min(GENERATE_CHUNK, n_pkts - start)
+
+            idx = rng.choice(n_prefixes, n, p=popularity)
+            gaps = rng.exponential(1 / rate, n)
+            columns = {
+                # microsecond timestamps as in CAIDA traces
+                'ts': np.round(START_TS + last_ts + np.cumsum(gaps), 6),
+                'src': (keys[idx] << 8) | rng.integers(0, 256, n, dtype=np.uint32),
+                'dst': dst_table[idx, rng.integers(0, 2**16, n) % n_routes[idx]],
+                'flag': (rng.random(n) < flags).astype(np.uint8),
+            }
+            last_ts = columns['ts'][-1] - START_TS
+
+            prefixes, first_dst = merge_first_dst(prefixes, first_dst, columns['src'], columns['dst'])
+            routers = get_chunk_routers(columns, prefixes, first_dst)
+
+            writer.append(get_new_store_columns(columns, routers))
+
+            if data_out is not None:
+                columns['ts'] = np.char.mod('%.6f', columns['ts']).astype('S')
+                data_out.write(get_csv_lines(columns, routers))
+
+    if data_out is not None:
+        data_out.close()
+
+
+class StageTimer:
+    """ Collects wall time, CPU time and peak RSS of the benchmarked stages """
+
+    def __init__(self, stages):
+        """ constructor
+
+        stages (list): names of the stages to time, all others are skipped
+        """
+
+        self.timings = {name: {'wall': [], 'cpu': [], 'pkts': 0, 'peak_rss_mb': 0.0} for name in stages}
+
+    def run(self, name, n_pkts, function, *args):
+        """ Runs and times a single stage (stages which are not timed only run)
+
+        name (str): stage name
+        n_pkts (int): number of packets processed by the stage
+        function (callable): stage function, called with args
+
+        returns: return value of function
+        """
+
+        if name not in self.timings:
+            return function(*args)
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+
+        result = function(*args)
+
+        timing = self.timings[name]
+        timing['wall'].append(time.perf_counter() - wall)
+        timing['cpu'].append(time.process_time() - cpu)
+        timing['pkts'] += n_pkts
+        timing['peak_rss_mb'] = get_peak_rss()
+
+        return result
+
+    def summary(self):
+        """ Summarizes all timed stages
+
+        returns: dict (stage name: dict with the total, mean, min and max wall time,
+                 total CPU time, ns per packet and peak RSS after the stage)
+        """
+
+        results = dict()
+        for name, timing in self.timings.items():
+            if not timing['wall']:
+                continue
+
+            wall = np.array(timing['wall'])
+            results[name] = {
+                'runs': len(wall),
+                'total_s': float(wall.sum()),
+                'mean_s': float(wall.mean()),
+                'min_s': float(wall.min()),
+                'max_s': float(wall.max()),
+                'cpu_s': float(sum(timing['cpu'])),
+                'ns_per_pkt': float(wall.sum() / max(1, timing['pkts']) * 1e9),
+                'peak_rss_mb': timing['peak_rss_mb'],
+            }
+
+        return results
+
+
+def run_benchmark(path, csv_file, stages, frequency, border, use_persistent, duration, pps,
+                  s_start, s_end, top, iteration):
+    """ Runs the stages of a magnifier simulation on a generated trace
+
+    Same order of the stages as in simulation.MagnifierSimulation: load the
+    packets, sample them, compute ground truth and sentinels, mirror packets
+    with the rules of the previous iteration, compute new mirroring rules and
+    ground truth-based results.
+
+    path (str): packet store folder
+    csv_file (str): preprocessed csv file (only needed for the load_csv stage)
+    stages (list): names of the stages to time
+    frequency (int): sampling frequency n -> every n-th packet is sampled
+    border (int): number of border routers
+    use_persistent (bool): persistent (True) or random (False) pkt to border mapping
+    duration (int): how long one iteration takes in seconds
+    pps (int): number of packets per second in each iteration
+    s_start (int): sentinel search prefix start size
+    s_end (int): sentinel search prefix end size
+    top (int): number of deployed sentinels (ordered by activity), None to use all
+    iteration (int): maximal number of iterations
+
+    returns: dict with the number of iterations, the timings of each stage (see StageTimer.summary)
+             and the peak RSS of the whole run
+    """
+
+    timer = StageTimer(stages)
+    store = load_pkt_store(path)
+    position = 0
+    data_in = open(csv_file, 'r') if 'load_csv' in stages else None
+
+    # sampling progress, sampled packets from n, n-1 and n-2 and the mirroring rules of n-1
+    progress = [0] * border
+    sampled = [[], [], []]
+    rules = None
+
+    n_iterations = 0
+    for i in range(iteration):
+        start = i * duration * pps
+        end = (i+1) * duration * pps
+
+        # text parsing of the same iteration, results are not used
+        if data_in is not None:
+            timer.run('load_csv', end - start, get_preprocessed_pkts, data_in, start, end, False, border, use_persistent)
+
+        def load():
+            columns, stop = get_store_columns(store, position, start, end, False)
+            src, _, routers, _, border_idx = get_column_pkts(columns, border, use_persistent)
+            return (make_pkt_array(src, routers), border_idx, stop)
+
+        pkts, border_idx, position = timer.run('load_store', end - start, load)
+
+        if len(pkts) == 0:
+            break
+        n_iterations += 1
+
+        def sample():
+            border_pkts = [pkts[idx] for idx in border_idx]
+            return get_sampled_packets_per_router(border_pkts, None, False, frequency, progress)[0]
+
+        sampled = [timer.run('sample', len(pkts), sample)] + sampled[:2]
+        samples = concat_pkts(sampled)
+
+        gt_data = timer.run('ground_truth', len(pkts), get_ground_truth_data, pkts)
+        sentinels = timer.run('sentinels', len(samples), get_sentinels, samples, s_start, s_end)
+
+        # mirroring rules of the previous iteration
+        if rules is not None:
+            timer.run('mirroring', len(pkts), get_mirrored_packets, rules, pkts, True)
+
+        rules, _ = timer.run('rules', len(samples), get_mirroring_rules, samples, s_start, s_end, 'activity', top)
+
+        timer.run('results', len(pkts), get_results_ground_truth, gt_data, sentinels, True)
+
+    if data_in is not None:
+        data_in.close()
+
+    return {
+        'iterations': n_iterations,
+        'stages': timer.summary(),
+        'peak_rss_mb': get_peak_rss(),
+    }
+
+
+def benchmark_size(n_pkts, config, stages, tmp_dir):
+    """ Generates a trace of a given size and benchmarks it
+
+    Runs in its own process such that the peak RSS only covers this size.
+
+    n_pkts (int): number of packets of the trace
+    config (dict): benchmark configuration (see benchmark)
+    stages (list): names of the stages to time
+    tmp_dir (str): folder for the generated trace
+
+    returns: dict with the results (see run_benchmark) and the trace generation time
+    """
+
+    path = os.path.join(tmp_dir, 'trace_{}'.format(n_pkts))
+    csv_file = path + '.csv' if 'load_csv' in stages else None
+
+    wall = time.perf_counter()
+    generate_trace(path, n_pkts, config['prefixes'], config['skew'], config['multi'], config['flags'],
+                   csv_file=csv_file, seed=config['seed'])
+    generate_s = time.perf_counter() - wall
+
+    results = run_benchmark(path, csv_file, stages, config['frequency'], config['border'], config['persistent'],
+                            config['duration'], config['pps'], config['start'], config['end'],
+                            config['top'], config['iteration'])
+    results['n_pkts'] = n_pkts
+    results['generate_s'] = generate_s
+
+    return results
+
+
+def benchmark(sizes, config, stages=STAGES, tmp_dir=None):
+    """ Benchmarks all stages for several trace sizes
+
+    sizes (list): number of packets of each trace
+    config (dict): frequency, border, persistent, duration, pps, start, end, top, iteration
+        (simulation parameters) and prefixes, skew, multi, flags, seed (trace parameters)
+    stages (list): names of the stages to time
+    tmp_dir (str): folder for the generated traces, default: temporary folder
+
+    returns: dict with the configuration, environment and the results of each size
+    """
+
+    results = {
+        'config': dict(config, stages=list(stages)),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'runs': [],
+    }
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as trace_dir:
+        for n_pkts in sizes:
+            with multiprocessing.Pool(1) as pool:
+                results['runs'].append(pool.apply(benchmark_size, (n_pkts, config, stages, trace_dir)))
+
+    return results
+
+
+def compare_results(results, baseline, threshold):
+    """ Finds stages which got slower than in an earlier benchmark
+
+    results (dict): current results (see benchmark)
+    baseline (dict): earlier results
+    threshold (float): relative slowdown of the ns per packet which is reported
+
+    returns: list of (n_pkts, stage, baseline ns per pkt, current ns per pkt)
+    """
+
+    baseline_runs = {run['n_pkts']: run for run in baseline['runs']}
+
+    slower = list()
+    for run in results['runs']:
+        if run['n_pkts'] not in baseline_runs:
+            continue
+
+        for name, timing in run['stages'].items():
+            old = baseline_runs[run['n_pkts']]['stages'].get(name)
+            if old is not None and timing['ns_per_pkt'] > old['ns_per_pkt'] * (1 + threshold):
+                slower.append((run['n_pkts'], name, old['ns_per_pkt'], timing['ns_per_pkt']))
+
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--pkts', default=[1000000], type=int, nargs='+',
+                        help='number of packets of the synthetic traces (one benchmark per size)')
+    parser.add_argument('-o', '--outfile', default='benchmark.json', type=str,
+                        help='filename to save the benchmark results')
+    parser.add_argument('-c', '--compare', default=None, type=str,
+                        help='results of an earlier benchmark, stages which got slower are reported')
+    parser.add_argument('-T', '--threshold', default=0.2, type=float,
+                        help='relative slowdown which is reported when comparing (default 0.2)')
+    parser.add_argument('-S', '--stages', default=STAGES, type=str, nargs='+', choices=STAGES,
+                        help='stages to benchmark (default all)')
+    parser.add_argument('-f', '--frequency', default=1024, type=int,
+                        help='sampling frequency')
+    parser.add_argument('-d', '--duration', default=30, type=int,
+                        help='duration of one iteration in seconds')
+    parser.add_argument('-P', '--pps', default=50000, type=int,
+                        help='number of replayed pkts/sec')
+    parser.add_argument('-s', '--start', default=16, type=int,
+                        help='sentinel search prefix start size')
+    parser.add_argument('-e', '--end', default=24, type=int,
+                        help='sentinel search prefix end size')
+    parser.add_argument('-i', '--iteration', default=20, type=int,
+                        help='maximal number of iterations')
+    parser.add_argument('-b', '--border', default=4, type=int,
+                        help='number of border routers to consider (4, 8, 16, 32 or 64)')
+    parser.add_argument('-t', '--traffic', default=1, type=int,
+                        help='pkt to border mapping in the best (1, default) or worst (0) way')
+    parser.add_argument('-k', '--top', default=1000, type=int,
+                        help='number of deployed sentinels (ordered by activity), -1 to use all')
+    parser.add_argument('--prefixes', default=2**18, type=int,
+                        help='number of distinct /24 prefixes in the synthetic traces')
+    parser.add_argument('--skew', default=1.0, type=float,
+                        help='zipf exponent of the /24 popularity')
+    parser.add_argument('--multi', default=0.05, type=float,
+                        help='fraction of /24 prefixes which enter through several border routers')
+    parser.add_argument('--flags', default=0.05, type=float,
+                        help='fraction of packets with an everflow TCP flag')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='random seed of the synthetic traces')
+    parser.add_argument('--tmp', default=None, type=str,
+                        help='folder for the generated traces (default: system temporary folder)')
+    args = parser.parse_args()
+
+    config = {
+        'frequency': args.frequency,
+        'border': args.border,
+        'persistent': args.traffic == 1,
+        'duration': args.duration,
+        'pps': args.pps,
+        'start': args.start,
+        'end': args.end,
+        'top': args.top if args.top != -1 else None,
+        'iteration': args.iteration,
+        'prefixes': args.prefixes,
+        'skew': args.skew,
+        'multi': args.multi,
+        'flags': args.flags,
+        'seed': args.seed,
+    }
+
+    results = benchmark(args.pkts, config, [name for name in STAGES if name in args.stages], args.tmp)
+
+    with open(args.outfile, 'w') as data_out:
+        json.dump(results, data_out, indent=2)
+
+    for run in results['runs']:
+        print('{} pkts, {} iterations, peak RSS {:.0f} MB'.format(run['n_pkts'], run['iterations'], run['peak_rss_mb']))
+        for name, timing in run['stages'].items():
+            print('  {:<14} {:>10.3f} s {:>10.1f} ns/pkt'.format(name, timing['total_s'], timing['ns_per_pkt']))
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as data_in:
+            slower = compare_results(results, json.load(data_in), args.threshold)
+
+        for n_pkts, name, old, new in slower:
+            print('{} pkts: {} got slower, {:.1f} -> {:.1f} ns/pkt'.format(n_pkts, name, old, new))
+
+        if slower:
+            sys.exit(1)
@@ -0,0 +1,426 @@
+""" Top k cases of magnifier simulations
+
+Each case (ordering and number of deployed sentinels) keeps its own history of
+mirrored packets and sentinels. Cases are independent of each other and can
+either run one after the other or in a pool of worker processes.
+"""
+
+import multiprocessing
+import traceback
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from sim_util import compare_sets, GroundTruth, get_pkt_arrays, get_prefix_counts, get_sentinel_window, update_sentinel_window
+from sim_util import concat_pkts, make_pkt_array
+from sim_mirroring import get_shared_sentinels, RuleTable
+from sim_results import get_results_ground_truth, get_results_ground_truth_invalidated_sentinels
+from sim_profile import StageProfiler
+
+
+class MirroringCase:
+    """ One top k case of a magnifier simulation """
+
+    def __init__(self, suffix, order, top, s_start, s_end, profile=False):
+        """ constructor
+
+        suffix (str): prefix of all result names of this case (e.g., top_100_activity_)
+        order (str): ordering criteria (None to use all sentinels)
+        top (int): number of deployed sentinels (None to use all sentinels)
+        s_start (int): sentinel search prefix start size
+        s_end (int): sentinel search prefix end size
+        profile (bool): measure the resource usage of each stage (see sim_profile.py)
+        """
+
+        self.suffix = suffix
+        self.order = order
+        self.top = top
+
+        # stages are profiled as variant without the trailing underscore (e.g., top_100_activity)
+        self.profiler = StageProfiler(profile)
+        self.variant = suffix.rstrip('_')
+
+        # mirrored packets and sentinels of previous iterations
+        self.mirrored_pkts = []
+        self.mirrored_pkts_n_1 = []
+        self.mirrored_pkts_n_2 = []
+        self.sentinels_with_mirroring = {}
+        self.sentinels_with_mirroring_n_1 = {}
+
+        # sentinels based on mirrored packets from n-1 and n-2
+        self.sentinel_window = get_sentinel_window(2, s_start, s_end)
+
+        # deployed mirroring rules, updated with the sentinels of each iteration
+        self.rule_table = RuleTable()
+
+    def run(self, i, current_pkts, gt_data, sampled_window, sampled_counts, sentinel_cache):
+        """ Runs one iteration of this case
+
+        i (int): iteration (the case has to run for all iterations i >= 1)
+        current_pkts (list or array): all packets of the current iteration
+        gt_data (GroundTruth): ground truth data of the current iteration (only needed if i >= 3)
+        sampled_window (SentinelWindow): sentinel window with the sampled packets from n-1 and n-2
+        sampled_counts (Counter): sampled packets from n-1 and n-2 per /24 prefix
+        sentinel_cache (dict): shared by all cases of the same iteration
+
+        returns: dict (result name: value), empty if i < 3
+        """
+
+        # order is important, do not change
+        self.mirrored_pkts_n_2 = self.mirrored_pkts_n_1
+        self.mirrored_pkts_n_1 = self.mirrored_pkts
+        self.sentinels_with_mirroring_n_1 = self.sentinels_with_mirroring
+
+        # update the mirrored part of the packet history with the packets from n-1
+        # variables are initialized with empty lists
+        # -> correct history for i == 1 or i == 2
+        update_sentinel_window(self.sentinel_window, self.mirrored_pkts_n_1)
+
+        # compute sentinels and deploy the matching mirroring rules
+        with self.profiler.stage(i, self.variant, 'sentinel'):
+            self.sentinels_with_mirroring = get_shared_sentinels(
+                sampled_window,
+                sampled_counts,
+                self.sentinel_window,
+                concat_pkts([self.mirrored_pkts_n_1, self.mirrored_pkts_n_2]),
+                self.order,
+                self.top,
+                sentinel_cache
+            )
+
+        with self.profiler.stage(i, self.variant, 'rules'):
+            n_rules_added, n_rules_removed = self.rule_table.update(self.sentinels_with_mirroring)
+
+        # get mirrored packets
+        with self.profiler.stage(i, self.variant, 'mirroring'):
+            self.mirrored_pkts, removed_sentinels = self.rule_table.get_mirrored_packets(
+                current_pkts,
+                True
+            )
+
+        # first real run, compute evaluation results
+        if i < 3:
+            return dict()
+
+        with self.profiler.stage(i, self.variant, 'scoring'):
+            return self.get_results(gt_data, n_rules_added, n_rules_removed, removed_sentinels)
+
+    def get_results(self, gt_data, n_rules_added, n_rules_removed, removed_sentinels):
+        """ Computes the evaluation results of the current iteration
+
+        gt_data (GroundTruth): ground truth data of the current iteration
+        n_rules_added (int): number of mirroring rules added in this iteration
+        n_rules_removed (int): number of mirroring rules removed in this iteration
+        removed_sentinels (set): sentinels whose rules were removed while mirroring
+
+        returns: dict (result name: value)
+        """
+
+        results = dict()
+        suffix = self.suffix
+
+        # output number of mirrored packets
+        results[suffix+'n_mirrored_packets_mirroring'] = len(self.mirrored_pkts)
+
+        # compute "old" sentinel statistics
+        n_sentinels_total, n_sentinels_added, n_sentinels_removed = compare_sets(
+            self.sentinels_with_mirroring,
+            self.sentinels_with_mirroring_n_1
+        )
+
+        # output sentinel statistic results
+        results[suffix+'n_sentinels_total_mirroring'] = n_sentinels_total
+        results[suffix+'n_sentinels_added_mirroring'] = n_sentinels_added
+        results[suffix+'n_sentinels_removed_mirroring'] = n_sentinels_removed
+
+        # output number of rule updates on the routers
+        results[suffix+'n_rules_added_mirroring'] = n_rules_added
+        results[suffix+'n_rules_removed_mirroring'] = n_rules_removed
+
+        # get still valid sentinels and results due to invalid sentinels
+        final_sentinels, results_lost = get_results_ground_truth_invalidated_sentinels(
+            self.sentinels_with_mirroring,
+            removed_sentinels,
+            gt_data
+        )
+
+        # output all results based on lost sentinels
+        results[suffix+'n_sentinels_invalidated_mirroring'] = len(self.sentinels_with_mirroring) - len(final_sentinels)
+        results[suffix+'prefix_lost_mirroring'] = results_lost[0]
+        results[suffix+'prefix_lost_not_unique_mirroring'] = results_lost[1]
+        results[suffix+'prefix_lost_not_active_mirroring'] = results_lost[2]
+        results[suffix+'pkt_lost_mirroring'] = results_lost[3]
+        results[suffix+'pkt_lost_not_unique_mirroring'] = results_lost[4]
+
+        # output results based on ground truth-based evaluation
+        # for sentinels with mirroring data which are still valid
+        results_gt_mirroring = get_results_ground_truth(
+            gt_data,
+            final_sentinels
+        )
+
+        results[suffix+'prefix_correct_mirroring'] = results_gt_mirroring[0]
+        results[suffix+'prefix_wrong_mirroring'] = results_gt_mirroring[1]
+        results[suffix+'prefix_not_active_mirroring'] = results_gt_mirroring[2]
+        results[suffix+'prefix_not_covered_mirroring'] = results_gt_mirroring[3]
+        results[suffix+'prefix_covered_not_unique_mirroring'] = results_gt_mirroring[4]
+        results[suffix+'prefix_not_covered_not_unique_mirroring'] = results_gt_mirroring[5]
+        results[suffix+'pkt_covered_correct_mirroring'] = results_gt_mirroring[7]
+        results[suffix+'pkt_covered_wrong_mirroring'] = results_gt_mirroring[8]
+        results[suffix+'pkt_covered_not_unique_mirroring'] = results_gt_mirroring[9]
+        results[suffix+'pkt_not_covered_mirroring'] = results_gt_mirroring[10]
+        results[suffix+'pkt_not_covered_not_unique_mirroring'] = results_gt_mirroring[11]
+
+        return results
+
+
+class CaseRunner:
+    """ Runs the cases of a magnifier simulation one after the other """
+
+    def __init__(self, cases, s_start, s_end):
+        """ constructor
+
+        cases (list): MirroringCase objects
+        s_start (int): sentinel search prefix start size
+        s_end (int): sentinel search prefix end size
+        """
+
+        self.cases = cases
+
+        # sampled packets from n-1 and n-2 (shared by all cases)
+        self.sampled_window = get_sentinel_window(2, s_start, s_end)
+
+    def run(self, i, current_pkts, gt_data, sampled_pkts_n_1, sampled_pkts_n_2):
+        """ Runs one iteration of all cases
+
+        i (int): iteration (i >= 1)
+        current_pkts (list or array): all packets of the current iteration
+        gt_data (GroundTruth): ground truth data of the current iteration (None if i < 3)
+        sampled_pkts_n_1 (list or array): sampled packets from n-1
+        sampled_pkts_n_2 (list or array): sampled packets from n-2
+
+        returns: list of result dicts (one per case)
+        """
+
+        # the sampled part of the packet history is the same for all cases
+        update_sentinel_window(self.sampled_window, sampled_pkts_n_1)
+        sampled_counts = get_prefix_counts(concat_pkts([sampled_pkts_n_1, sampled_pkts_n_2]))
+
+        # cases with the same mirrored packets share their sentinels
+        sentinel_cache = dict()
+
+        return [case.run(i, current_pkts, gt_data, self.sampled_window, sampled_counts, sentinel_cache)
+                for case in self.cases]
+
+    def pop_profile(self):
+        """ Returns and removes the profile rows of all cases
+
+        returns: list of profile rows (see sim_profile.PROFILE_COLUMNS)
+        """
+        return [row for case in self.cases for row in case.profiler.pop_rows()]
+
+    def get_state(self):
+        """ Returns the state of all cases (e.g., to write a checkpoint)
+
+        returns: dict with the shared sampled window and the cases
+        """
+        return {'sampled_window': self.sampled_window, 'cases': self.cases}
+
+    def set_state(self, state):
+        """ Continues with a state returned by get_state
+
+        state (dict): shared sampled window and the cases
+        """
+
+        self.sampled_window = state['sampled_window']
+        self.cases = state['cases']
+
+    def close(self):
+        """ nothing to clean up """
+        pass
+
+
+def attach_shared_memory(name):
+    """ Attaches to shared memory created by another process
+
+    name (str): name of the shared memory block
+
+    returns: SharedMemory
+    """
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13, attaching registers the block a second time
+        # and the resource tracker complains about it at shutdown
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def case_worker(conn, cases, s_start, s_end):
+    """ Worker process running a subset of the cases
+
+    conn (Connection): pipe to the main process
+    cases (list): MirroringCase objects of this worker
+    s_start (int): sentinel search prefix start size
+    s_end (int): sentinel search prefix end size
+    """
+
+    runner = CaseRunner(cases, s_start, s_end)
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+
+        # state of the cases is moved from and to the main process for checkpoints
+        if message[0] == 'get_state':
+            conn.send(runner.get_state())
+            continue
+        elif message[0] == 'set_state':
+            runner.set_state(message[1])
+            continue
+
+        i, name, n_pkts, sampled_pkts_n_1, sampled_pkts_n_2 = message
+
+        try:
+            # current packets are shared by the main process
+            shm = attach_shared_memory(name)
+            src = np.ndarray((n_pkts,), dtype=np.uint32, buffer=shm.buf)
+            routers = np.ndarray((n_pkts,), dtype=np.uint16, buffer=shm.buf, offset=4*n_pkts)
+            current_pkts = make_pkt_array(src, routers)
+
+            gt_data = None
+            if i >= 3:
+                gt_data = GroundTruth(src, routers)
+
+            del src, routers
+            shm.close()
+
+            results = runner.run(i, current_pkts, gt_data, sampled_pkts_n_1, sampled_pkts_n_2)
+            conn.send((results, runner.pop_profile()))
+
+        except Exception:
+            conn.send(traceback.format_exc())
+
+    conn.close()
+
+
+class CaseWorkers:
+    """ Runs the cases of a magnifier simulation in a pool of worker processes
+
+    Each worker owns a fixed subset of the cases (and their state). The packets
+    of each iteration are passed to the workers in shared memory.
+    """
+
+    def __init__(self, cases, workers, s_start, s_end):
+        """ constructor
+
+        cases (list): MirroringCase objects
+        workers (int): number of worker processes
+        s_start (int): sentinel search prefix start size
+        s_end (int): sentinel search prefix end size
+        """
+
+        self.n_cases = len(cases)
+        self.profile_rows = list()
+        self.assignments = list()
+        self.conns = list()
+        self.processes = list()
+
+        for w in range(min(workers, len(cases))):
+            assigned = list(range(w, len(cases), workers))
+            conn, worker_conn = multiprocessing.Pipe()
+
+            process = multiprocessing.Process(
+                target=case_worker,
+                args=(worker_conn, [cases[c] for c in assigned], s_start, s_end),
+                daemon=True
+            )
+            process.start()
+            worker_conn.close()
+
+            self.assignments.append(assigned)
+            self.conns.append(conn)
+            self.processes.append(process)
+
+    def run(self, i, current_pkts, gt_data, sampled_pkts_n_1, sampled_pkts_n_2):
+        """ Runs one iteration of all cases, same as CaseRunner.run
+
+        gt_data is computed by the workers themselves (argument is ignored)
+        """
+
+        src, routers = get_pkt_arrays(current_pkts)
+        n_pkts = len(current_pkts)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, 6*n_pkts))
+        try:
+            np.ndarray((n_pkts,), dtype=np.uint32, buffer=shm.buf)[:] = src
+            np.ndarray((n_pkts,), dtype=np.uint16, buffer=shm.buf, offset=4*n_pkts)[:] = routers
+
+            for conn in self.conns:
+                conn.send((i, shm.name, n_pkts, sampled_pkts_n_1, sampled_pkts_n_2))
+
+            # all replies are received before raising, otherwise the replies of the
+            # other workers would be read as answers to the next message
+            replies = [conn.recv() for conn in self.conns]
+            errors = [reply for reply in replies if isinstance(reply, str)]
+            if errors:
+                raise RuntimeError('case worker failed:\n{}'.format('\n'.join(errors)))
+
+            results = [None] * self.n_cases
+            for worker_results, assigned in zip(replies, self.assignments):
+                # profile rows measured in the worker
+                worker_results, worker_rows = worker_results
+                self.profile_rows.extend(worker_rows)
+
+                for c, case_results in zip(assigned, worker_results):
+                    results[c] = case_results
+
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return results
+
+    def pop_profile(self):
+        """ Returns and removes the profile rows measured by all workers, see CaseRunner.pop_profile """
+
+        rows = self.profile_rows
+        self.profile_rows = list()
+        return rows
+
+    def get_state(self):
+        """ Collects the state of all cases from the workers, see CaseRunner.get_state """
+
+        for conn in self.conns:
+            conn.send(('get_state',))
+
+        cases = [None] * self.n_cases
+        for conn, assigned in zip(self.conns, self.assignments):
+            state = conn.recv()
+            for c, case in zip(assigned, state['cases']):
+                cases[c] = case
+
+        # all workers keep the same sampled window
+        return {'sampled_window': state['sampled_window'], 'cases': cases}
+
+    def set_state(self, state):
+        """ Moves the state of all cases to the workers, see CaseRunner.set_state """
+
+        for conn, assigned in zip(self.conns, self.assignments):
+            conn.send(('set_state', {
+                'sampled_window': state['sampled_window'],
+                'cases': [state['cases'][c] for c in assigned],
+            }))
+
+    def close(self):
+        """ stops all worker processes """
+
+        for conn in self.conns:
+            conn.send(None)
+            conn.close()
+
+        for process in self.processes:
+            process.join()
@@ -2,7 +2,10 @@
 """
 
 import pytricia
-from sim_util import get_sentinels, order_sentinels, enhance_sentinels
+import numpy as np
+from sim_util import get_sentinels, order_sentinels, enhance_sentinels, enhance_sentinels_counts, get_merged_window_sentinels
+from sim_util import get_pkts_key, get_prefix_counts, is_pkt_array
+from common.ip_conversion import ipv4_to_int_array
 import random
 
 
@@ -45,21 +48,219 @@ def get_mirroring_rules(pkts, sentinel_start, sentinel_end, order, top):
         return (rules, sentinels)
 
 
+def get_shared_sentinels(sampled_window, sampled_counts, mirrored_window, mirrored_pkts, order, top, cache):
+    """ Computes the deployed sentinels of a top k case
+    Same sentinels as get_mirroring_rules on the sampled and mirrored packets
+
+    The sampled packets are shared between all top k cases of an iteration,
+    only the (few) mirrored packets are merged on top of them. Results are
+    cached such that cases with the same mirrored packets are computed once.
+
+    sampled_window (SentinelWindow):
+        sentinel window with the sampled packets
+    sampled_counts (Counter):
+        number of sampled packets per /24 prefix (see get_prefix_counts)
+    mirrored_window (SentinelWindow):
+        sentinel window with the mirrored packets of this case
+    mirrored_pkts (list or array):
+        mirrored packets of this case
+    order (str):
+        ordering criteria
+    top (int):
+        number of deployed sentinels, set to None to use all of them
+    cache (dict):
+        results of other cases, should be emptied whenever the sampled packets change
+
+    returns: list of sentinels (prefix, router)
+    """
+
+    key = get_pkts_key(mirrored_pkts)
+
+    if key not in cache:
+        cache[key] = (get_merged_window_sentinels(sampled_window, mirrored_window), dict())
+    sentinels, ordered_sentinels = cache[key]
+
+    # enhance and order based on top criteria
+    if top is not None:
+        if order not in ordered_sentinels:
+            prefix_counts = get_prefix_counts(mirrored_pkts)
+
+            sentinel_dict = enhance_sentinels_counts(sentinels, [sampled_counts, prefix_counts])
+            ordered_sentinels[order] = order_sentinels(sentinel_dict, order)
+
+        return ordered_sentinels[order][0:top]
+
+    else:
+        return sentinels
+
+
+def get_rule_intervals(prefixes):
+    """ Returns the integer IP intervals of given prefixes
+
+    prefixes (list): prefixes in dot notation (e.g., 1.2.0.0/16)
+
+    returns: (starts, ends)
+        starts: first IP of each prefix
+        ends: end IP (exclusive) of each prefix
+    """
+
+    ips = list()
+    sizes = list()
+    for prefix in prefixes:
+        ip, size = prefix.split('/')
+        ips.append(ip)
+        sizes.append(int(size))
+
+    starts = ipv4_to_int_array(ips).astype(np.int64)
+    ends = starts + (np.int64(1) << (32 - np.array(sizes, dtype=np.int64)))
+
+    return (starts, ends)
+
+
+class RuleTable:
+    """ Mirroring rules which are deployed over several iterations
+
+    Like rules on real routers, the table is updated with the difference to
+    the newly computed sentinels (added and removed rules) instead of being
+    rebuilt every iteration. The compiled intervals (see compile_mirroring_rules)
+    are kept up to date with each update.
+    """
+
+    def __init__(self):
+        """ constructor """
+
+        # deployed rules (prefix: router)
+        self.rules = dict()
+
+        # compiled rules, sorted by start IP
+        self.starts = np.empty(0, dtype=np.int64)
+        self.ends = np.empty(0, dtype=np.int64)
+        self.routers = np.empty(0, dtype=np.int64)
+        self.prefixes = np.empty(0, dtype=object)
+
+        # size of the last update
+        self.n_added = 0
+        self.n_removed = 0
+
+    def __len__(self):
+        return len(self.rules)
+
+    def update(self, sentinels):
+        """ Deploys a new set of sentinels, only changed rules are updated
+
+        sentinels (list): sentinels (prefix, router) to deploy
+
+        returns: (n_added, n_removed) number of added and removed rules
+            a rule with a changed router is removed and added
+        """
+
+        new_rules = dict(sentinels)
+
+        removed = [prefix for prefix, router in self.rules.items() if new_rules.get(prefix) != router]
+        added = [prefix for prefix, router in new_rules.items() if self.rules.get(prefix) != router]
+
+        self.remove(removed)
+
+        if added:
+            for prefix in added:
+                self.rules[prefix] = new_rules[prefix]
+
+            starts, ends = get_rule_intervals(added)
+            starts = np.concatenate([self.starts, starts])
+            order = np.argsort(starts, kind='stable')
+
+            self.starts = starts[order]
+            self.ends = np.concatenate([self.ends, ends])[order]
+            self.routers = np.concatenate([self.routers, np.array([new_rules[prefix] for prefix in added], dtype=np.int64)])[order]
+            self.prefixes = np.concatenate([self.prefixes, np.array(added, dtype=object)])[order]
+
+        self.n_added = len(added)
+        self.n_removed = len(removed)
+
+        return (self.n_added, self.n_removed)
+
+    def remove(self, prefixes):
+        """ Removes deployed rules
+
+        prefixes (iterable): prefixes of the removed rules
+        """
+
+        prefixes = set(prefixes)
+        if not prefixes:
+            return
+
+        for prefix in prefixes:
+            del self.rules[prefix]
+
+        keep = np.array([prefix not in prefixes for prefix in self.prefixes.tolist()], dtype=bool)
+        self.starts = self.starts[keep]
+        self.ends = self.ends[keep]
+        self.routers = self.routers[keep]
+        self.prefixes = self.prefixes[keep]
+
+    def get_tree(self):
+        """ Returns the deployed rules as prefix tree
+
+        returns: pytricia prefix tree matching mirroring rules (value == ingress router)
+        """
+
+        rules = pytricia.PyTricia()
+        for prefix, router in self.rules.items():
+            rules[prefix] = router
+
+        return rules
+
+    def is_overlapping(self):
+        """ Checks if deployed rules overlap (nested prefixes)
+
+        returns: True if a single interval lookup is not enough
+        """
+        return len(self.starts) > 1 and bool(np.any(self.starts[1:] < self.ends[:-1]))
+
+    def get_mirrored_packets(self, pkts, remove_rules):
+        """ Same as get_mirrored_packets on the deployed rules
+        Rules which mirrored packets are removed from the table if remove_rules is set
+
+        pkts (list or array):
+            list of packets or packet array
+        remove_rules (bool):
+            remove mirroring rules once they have mirrored first packet
+
+        returns: (mirrored_pkts, removed_sentinels), see get_mirrored_packets
+        """
+
+        if not is_pkt_array(pkts) or self.is_overlapping():
+            mirrored_pkts, removed_sentinels = get_mirrored_packets(self.get_tree(), pkts, remove_rules)
+            self.remove(removed_sentinels)
+            return (mirrored_pkts, removed_sentinels)
+
+        compiled = (self.starts, self.ends, self.routers, self.prefixes)
+        mirrored_pkts, removed = get_mirrored_packets_compiled(compiled, pkts, remove_rules)
+
+        removed_sentinels = set(self.prefixes[removed].tolist())
+        self.remove(removed_sentinels)
+
+        return (mirrored_pkts, removed_sentinels)
+
+
 def get_mirrored_packets(rules, pkts, remove_rules):
     """ Returns all mirrored packets given some mirroring rules
 
     rules (prefix tree): 
         pytricia prefix tree matching mirroring rules (value == ingress router)
-    pkts (list): 
-        list of packets
+    pkts (list or array): 
+        list of packets or packet array
     remove_rules (bool):
         remove mirroring rules once they have mirrored first packet
 
     returns: (mirrored_pkts, removed_sentinels) 
-        mirrored_pkts: list (IP, /24 prefix, router) of all mirrored packets
+        mirrored_pkts: list (IP, /24 prefix, router) of all mirrored packets (packet array for packet arrays)
         removed_sentinels: set of removed sentinels
     """
 
+    if is_pkt_array(pkts):
+        return get_mirrored_packets_array(rules, pkts, remove_rules)
+
     mirrored_pkts = list()
     removed_sentinels = set()
 
@@ -80,28 +281,155 @@ def get_mirrored_packets(rules, pkts, remove_rules):
     return (mirrored_pkts, removed_sentinels)
 
 
+def compile_mirroring_rules(rules):
+    """ Compiles mirroring rules into sorted integer IP intervals
+
+    rules (prefix tree):
+        pytricia prefix tree matching mirroring rules (value == ingress router)
+
+    returns: (starts, ends, routers, prefixes), None if rules overlap
+        starts: first IP of each rule (sorted)
+        ends: end IP (exclusive) of each rule
+        routers: ingress router of each rule
+        prefixes: prefix (key in rules) of each rule
+    """
+
+    prefixes = list(rules.keys())
+    starts, ends = get_rule_intervals(prefixes)
+
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    ends = ends[order]
+    routers = np.array([rules[prefixes[i]] for i in order.tolist()], dtype=np.int64)
+    prefixes = [prefixes[i] for i in order.tolist()]
+
+    # longest prefix matching is not a single lookup for nested rules
+    if len(prefixes) > 1 and np.any(starts[1:] < ends[:-1]):
+        return None
+
+    return (starts, ends, routers, prefixes)
+
+
+def get_mirrored_packets_array(rules, pkts, remove_rules):
+    """ Same as get_mirrored_packets for packet arrays
+
+    Non-overlapping rules are matched for all packets at once. If rules are
+    removed, each rule mirrors only its first mismatching packet (afterwards
+    no other rule can match its packets).
+
+    rules (prefix tree): 
+        pytricia prefix tree matching mirroring rules (value == ingress router)
+    pkts (array): 
+        packet array
+    remove_rules (bool):
+        remove mirroring rules once they have mirrored first packet
+
+    returns: (mirrored_pkts, removed_sentinels)
+        mirrored_pkts: packet array of all mirrored packets
+        removed_sentinels: set of removed sentinels
+    """
+
+    compiled = compile_mirroring_rules(rules)
+    if compiled is None:
+        return get_mirrored_packets_array_tree(rules, pkts, remove_rules)
+
+    mirrored_pkts, removed = get_mirrored_packets_compiled(compiled, pkts, remove_rules)
+
+    prefixes = compiled[3]
+    removed_sentinels = set()
+    for r in removed.tolist():
+        removed_sentinels.add(prefixes[r])
+        del rules[prefixes[r]]
+
+    return (mirrored_pkts, removed_sentinels)
+
+
+def get_mirrored_packets_compiled(compiled, pkts, remove_rules):
+    """ Matches a packet array with compiled (non-overlapping) mirroring rules
+
+    compiled (tuple):
+        (starts, ends, routers, prefixes), see compile_mirroring_rules
+    pkts (array):
+        packet array
+    remove_rules (bool):
+        each rule only mirrors its first packet (it is removed afterwards)
+
+    returns: (mirrored_pkts, removed)
+        mirrored_pkts: packet array of all mirrored packets
+        removed: positions (in compiled) of the rules which mirrored packets if remove_rules
+    """
+
+    starts, ends, routers, _ = compiled
+    if len(starts) == 0:
+        return (pkts[:0], np.empty(0, dtype=np.int64))
+
+    src = pkts['src'].astype(np.int64)
+    rule = np.searchsorted(starts, src, side='right') - 1
+
+    # packets which match a rule of another ingress router
+    matched = (rule >= 0) & (src < ends[np.maximum(rule, 0)])
+    mirrored = np.flatnonzero(matched & (routers[np.maximum(rule, 0)] != pkts['router']))
+
+    removed = np.empty(0, dtype=np.int64)
+    if remove_rules and len(mirrored) > 0:
+        # np.unique returns the first occurrence of each rule
+        removed, first = np.unique(rule[mirrored], return_index=True)
+        mirrored = np.sort(mirrored[first])
+
+    return (pkts[mirrored], removed)
+
+
+def get_mirrored_packets_array_tree(rules, pkts, remove_rules):
+    """ Same as get_mirrored_packets_array, matches packets one by one in the prefix tree
+    Needed if rules overlap
+
+    rules (prefix tree): 
+        pytricia prefix tree matching mirroring rules (value == ingress router)
+    pkts (array): 
+        packet array
+    remove_rules (bool):
+        remove mirroring rules once they have mirrored first packet
+
+    returns: (mirrored_pkts, removed_sentinels)
+        mirrored_pkts: packet array of all mirrored packets
+        removed_sentinels: set of removed sentinels
+    """
+
+    mirrored = list()
+    removed_sentinels = set()
+
+    for i, (src_ip, router) in enumerate(zip(pkts['src'].tolist(), pkts['router'].tolist())):
+        # if packet belongs to correct sentinel ingress router, it will *not* be mirrored
+        if src_ip in rules and rules[src_ip] != router:
+            mirrored.append(i)
+
+            if remove_rules:
+                sentinel = rules.get_key(src_ip)
+                removed_sentinels.add(sentinel)
+                del rules[sentinel]
+
+    return (pkts[mirrored], removed_sentinels)
+
+
 def get_mirrored_packets_everflow(pkts, frequency, flags):
     """ Get sampled packets for everflow
 
-    pkts (list): list of packets
+    pkts (list or array): list of packets (or packet array)
     frequency (int): n for sampling frequency 1/n
-    flags (list): list of booleans if packet has flags set 
+    flags (list or array): list of booleans if packet has flags set 
 
     returns: list with sampled packets (every nth and TCP SYN,FIN and RST)
+        (packet array for packet arrays)
     """
 
-    sampled_pkts = list()
-
     # add all packets with flags
-    for i, flag in enumerate(flags):
-        if flag:
-            sampled_pkts.append(pkts[i])
+    flag_idx = np.flatnonzero(flags)
 
     # add randomly sampled packets but only if not already covered by flags
-    start = random.randrange(0, frequency)
-    while start < len(pkts):
-        if not flags[start]:
-            sampled_pkts.append(pkts[start])
-        start += frequency
+    random_idx = np.arange(random.randrange(0, frequency), len(pkts), frequency)
+    random_idx = random_idx[~np.asarray(flags, dtype=bool)[random_idx]]
+
+    if is_pkt_array(pkts):
+        return pkts[np.concatenate([flag_idx, random_idx])]
 
-    return sampled_pkts
+    return [pkts[i] for i in flag_idx.tolist() + random_idx.tolist()]
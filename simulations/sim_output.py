@@ -0,0 +1,144 @@
+""" Streaming output of simulation results
+
+Results are written while a simulation runs, one row per iteration and variant
+(results shared by all top k cases or a single top k case, e.g., full or
+top_100_activity) and one column per result name:
+
+iteration,variant,n_total_packets,...,prefix_correct_mirroring,...
+3,shared,1000,...,,...
+3,full,,...,12,...
+
+Cells of results which do not belong to a variant are empty. Each iteration is
+flushed at once, running simulations can be watched and an interrupted
+simulation keeps all complete iterations. Use results/prepare_plot_data.py
+(read_data) to read result files.
+"""
+
+import os.path
+
+from sim_profile import SHARED
+
+
+# columns before the results
+INDEX_COLUMNS = ['iteration', 'variant']
+
+# results with float values, all others are integers
+FLOAT_RESULTS = ['iteration_end_ts']
+
+
+def get_result_name(variant, column):
+    """ Returns the name of a result in the previous row-per-result layout
+
+    variant (str): SHARED or top k variant (e.g., full or top_100_activity)
+    column (str): result column (e.g., prefix_correct_mirroring)
+
+    returns: result name (e.g., full_prefix_correct_mirroring)
+    """
+
+    if variant == SHARED:
+        return column
+    return '{}_{}'.format(variant, column)
+
+
+class ResultWriter:
+    """ Appends the results of each iteration to a csv file
+
+    The file is created with the first results, simulations without any
+    results do not write a file.
+    """
+
+    def __init__(self, out_file, results):
+        """ constructor
+
+        out_file (str): name of file with results
+        results (list): (variant, column) of all results in the order of the columns
+        """
+
+        self.out_file = out_file
+        self.data_out = None
+
+        # result name -> (variant, column)
+        self.results = {get_result_name(variant, column): (variant, column) for variant, column in results}
+        self.variants = list(dict.fromkeys(variant for variant, _ in results))
+        self.columns = list(dict.fromkeys(column for _, column in results))
+        self.column_idx = {column: n for n, column in enumerate(self.columns)}
+
+        # bytes written (complete iterations) and timestamp all end timestamps refer to
+        self.offset = 0
+        self.first_ts = None
+
+    def write(self, i, results):
+        """ Writes the results of an iteration and flushes the file
+
+        i (int): iteration
+        results (dict): result name (see get_result_name): value, may be empty
+        """
+
+        if not results:
+            return
+
+        # adjust iteration end times to end timestamp of first iteration
+        if 'iteration_end_ts' in results:
+            if self.first_ts is None:
+                self.first_ts = results['iteration_end_ts']
+            results = dict(results)
+            results['iteration_end_ts'] -= self.first_ts
+
+        rows = {variant: [''] * len(self.columns) for variant in self.variants}
+        for name, value in results.items():
+            variant, column = self.results[name]
+            rows[variant][self.column_idx[column]] = str(value)
+
+        if self.data_out is None:
+            self.open()
+
+        for variant in self.variants:
+            if any(rows[variant]):
+                self.data_out.write('{},{},{}\n'.format(i, variant, ','.join(rows[variant])))
+
+        self.data_out.flush()
+        self.offset = self.data_out.tell()
+
+    def open(self):
+        """ Opens the result file, a new file (offset 0) starts with the header line """
+
+        if self.offset == 0:
+            self.data_out = open(self.out_file, 'w')
+            self.data_out.write(','.join(INDEX_COLUMNS + self.columns) + '\n')
+            return
+
+        # continue after the last complete iteration (see set_state)
+        self.data_out = open(self.out_file, 'r+')
+        self.data_out.seek(self.offset)
+        self.data_out.truncate()
+
+    def get_state(self):
+        """ Returns the state after an iteration (e.g., to write a checkpoint)
+
+        returns: dict with the offset after the last iteration and the first end timestamp
+        """
+        return {'offset': self.offset, 'first_ts': self.first_ts}
+
+    def set_state(self, state):
+        """ Continues with a state returned by get_state
+
+        Iterations written after the state was taken are removed from the file.
+
+        state (dict): state of a writer of the same file
+        """
+
+        self.close()
+        self.offset = state['offset']
+        self.first_ts = state['first_ts']
+
+        if self.offset > 0:
+            if not os.path.isfile(self.out_file) or os.path.getsize(self.out_file) < self.offset:
+                raise ValueError('results in {} are shorter than expected'.format(self.out_file))
+            self.open()
+
+    def close(self):
+        """ Closes the result file """
+
+        if self.data_out is not None:
+            self.data_out.close()
+            self.data_out = None
@@ -1,53 +1,140 @@
 """ Simulation functions related to packets
 """
 
-from sim_util import get_router_n
-from common.ip_conversion import ipv4_to_str, ipv4_to_int
+from sim_util import get_router_n, is_pkt_array
+from common.ip_conversion import ipv4_to_str, ipv4_to_int, ipv4_to_int_array, ipv4_to_str_array
+from common.pkt_store import router_column, COLUMNS, CSV_COLUMNS
+import hashlib
+import os
+import pickle
+import numpy as np
 import random
+from itertools import compress
 
 
-def prepare_permutations(percentage, prefix_file, n_routers):
+# see get_sample_positions
+SAMPLING_MODES = ['systematic', 'bernoulli', 'random_skip']
+
+
+def get_permutation_key(percentage, prefix_file, n_routers, rng):
+    """ Returns the cache key of a permutation mapping
+
+    The key covers everything the mapping depends on: the content of the prefix
+    file, the percentage, the number of routers and the state of the random
+    number generator before the prefixes are selected.
+
+    percentage (int):
+        percentage of changes between 0 and 100
+    prefix_file (str):
+        file which contains all /24 source prefixes in the CAIDA trace
+    n_routers (int):
+        number of border routers to consider
+    rng (random.Random):
+        random number generator to select the prefixes
+
+    returns: hex digest
+    """
+
+    key = hashlib.sha256()
+    with open(prefix_file, 'rb') as data_in:
+        key.update(hashlib.sha256(data_in.read()).digest())
+    key.update('{},{}'.format(percentage, n_routers).encode())
+    key.update(pickle.dumps(rng.getstate(), protocol=4))
+
+    return key.hexdigest()
+
+
+def prepare_permutations(percentage, prefix_file, n_routers, rng=random, cache_dir=None):
     """ Prepares prefix permutations
 
+    The mapping is a dense array with one entry per /24 prefix (0 for prefixes
+    which are not in the prefix file). If a cache folder is given, mappings are
+    stored there and memory-mapped when the same mapping is requested again.
+    The random number generator then continues in the same state as if the
+    prefixes were selected again.
+
     percentage (int):
         percentage of changes between 0 and 100
     prefix_file (str):
         file which contains all /24 source prefixes in the CAIDA trace
     n_routers (int):
         number of border routers to consider
+    rng (random.Random):
+        random number generator to select the prefixes (default: module random)
+    cache_dir (str):
+        folder with cached mappings, None to not cache (default)
 
-    returns: {prefix: router}
-        dict which maps prefix to router
+    returns: np.array (uint8 or uint16) of size 2**24
+        maps /24 prefix (src >> 8) to router
     """
 
-    mapping = dict()
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, get_permutation_key(percentage, prefix_file, n_routers, rng))
+        if os.path.isfile(cache_file + '.state'):
+            with open(cache_file + '.state', 'rb') as data_in:
+                rng.setstate(pickle.load(data_in))
+            return np.load(cache_file + '.npy', mmap_mode='r')
+
     slice_size = 2**32 / n_routers
 
     with open(prefix_file, 'r') as data_in:
-        for line in data_in:
-            prefix = line.strip()
-            a, _, _, _ = prefix.split('.')
+        names = [line.strip() for line in data_in]
 
-            # routers are from 0 ... n-1
-            router = int(int(a) / slice_size + 1)
-            mapping[prefix] = router
+    # prefixes in the order of the file, each only once
+    prefixes = ipv4_to_int_array([name.split('/')[0] for name in names]) >> 8
+    _, first = np.unique(prefixes, return_index=True)
+    prefixes = prefixes[np.sort(first)]
 
-    amount = len(mapping)
+    # routers are from 0 ... n-1
+    routers = (np.floor((prefixes >> 16) / slice_size + 1)).astype(np.int64)
+
+    amount = len(prefixes)
     to_change = int(amount / 100 * percentage)
 
-    # get random prefixes to change
-    selected_prefixes = random.sample(list(mapping.items()), to_change)
+    # get random prefixes to change (same draws as sampling the prefixes themselves)
+    selected = np.array(rng.sample(range(amount), to_change), dtype=np.int64)
+
+    # change router for selected prefixes
+    # we add in order 0...(n_routers-1) to it
+    n = np.arange(to_change)
+    routers[selected] = (routers[selected] + n % (n_routers - 1)) % n_routers + 1
+
+    mapping = np.zeros(2**24, dtype=np.uint8 if n_routers < 2**8 else np.uint16)
+    mapping[prefixes] = routers
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
 
-    n = 0
-    for prefix, router in selected_prefixes:
-        # change router for selected prefixes
-        # we add in order 0...(n_routers-1) to it
-        mapping[prefix] = int((router + n % (n_routers - 1)) % n_routers + 1)
-        n += 1
+        # the state is written last, a mapping is only used if both files are complete
+        np.save(cache_file + '.tmp.npy', mapping)
+        os.replace(cache_file + '.tmp.npy', cache_file + '.npy')
+        with open(cache_file + '.state.tmp', 'wb') as data_out:
+            pickle.dump(rng.getstate(), data_out, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_file + '.state.tmp', cache_file + '.state')
 
     return mapping
 
 
+def get_mapping_routers(mapping, src):
+    """ Returns the routers of packets based on a permutation mapping
+
+    mapping (array):
+        router of each /24 prefix (see prepare_permutations)
+    src (array):
+        src IPs as int
+
+    returns: np.array (uint16) with the router of each packet
+    """
+
+    routers = mapping[src >> 8].astype(np.uint16)
+
+    if len(routers) > 0 and routers.min() == 0:
+        prefix = int(src[np.argmin(routers)]) >> 8
+        raise KeyError(ipv4_to_str(prefix << 8)+'/24')
+
+    return routers
+
+
 def get_preprocessed_pkts_mapping(data_in, start, end, replay_real_speed, n_border, mapping, time_persistent=False):
     """ More efficient way to only get required packets for current iteration
     This function supports both, PPS and real time speed
@@ -62,8 +149,8 @@ def get_preprocessed_pkts_mapping(data_in, start, end, replay_real_speed, n_bord
         to distinguish between PPS and real time speed
     n_border (int):
         number of border routers
-    mapping (dict):
-        maps /24 prefix to border router
+    mapping (array):
+        maps /24 prefix to border router (see prepare_permutations)
     time_persistent (bool):
         set to true to use persistent source 24 prefix to ingress router mapping (default false)
 
@@ -104,8 +191,10 @@ def get_preprocessed_pkts_mapping(data_in, start, end, replay_real_speed, n_bord
 
         timestamps.append(float(ts))
 
-        # router assignment based on permuted mapping
-        router = mapping[prefix_24]
+        # router assignment based on permuted mapping (0 for prefixes without router)
+        router = int(mapping[int(src_ip_int) >> 8])
+        if router == 0:
+            raise KeyError(prefix_24)
 
         if flag == '1':
             flags.append(True)
@@ -228,6 +317,346 @@ def get_preprocessed_pkts(data_in, start, end, replay_real_speed, n_border, time
     return (pkts, timestamps, flags, data_in, border_pkts, border_flags)
 
 
+def get_store_stop(ts, position, slice_duration, replay_real_speed):
+    """ Returns the end (exclusive) of the iteration which starts at a given row
+
+    ts (array):
+        timestamp column of a packet store
+    position (int):
+        first row of the iteration
+    slice_duration (int):
+        number of packets or seconds of one iteration
+    replay_real_speed (bool):
+        to distinguish between PPS and real time speed
+
+    returns: first row of the next iteration
+    """
+
+    n_pkts = len(ts)
+
+    if position >= n_pkts:
+        return position
+    elif not replay_real_speed:
+        return min(position + slice_duration, n_pkts)
+
+    # the first packet with int(ts) - start_ts >= slice_duration
+    # is still part of the current iteration
+    start_ts = int(ts[position])
+    stop = position + int(np.searchsorted(ts[position:], start_ts + slice_duration, side='left')) + 1
+
+    return min(stop, n_pkts)
+
+
+def get_store_pkts(store, position, start, end, replay_real_speed, n_border, time_persistent=False, mapping=None):
+    """ Returns views on all packets of the current iteration in a packet store
+    This function supports both, PPS and real time speed
+
+    Iteration boundaries are found with index arithmetic (PPS) or with a binary
+    search on the timestamp column (real time speed). The returned columns are
+    views on the memory-mapped store, nothing is parsed or copied (except the
+    router column if a permutation mapping is used).
+
+    store (dict):
+        packet store columns (see common.pkt_store.load_pkt_store)
+    position (int):
+        first row of the current iteration (end of last iteration)
+    start (int):
+        start pkt number or time
+    end (int):
+        end pkt number or time
+    replay_real_speed (bool):
+        to distinguish between PPS and real time speed
+    n_border (int):
+        number of border routers
+    time_persistent (bool):
+        set to true to use persistent source 24 prefix to ingress router mapping (default false)
+    mapping (array):
+        maps /24 prefix to border router (see prepare_permutations), set to None to use the
+        precomputed assignment (default)
+
+    returns: (src, timestamps, routers, flags, position, border_idx)
+        src:
+            array of src IPs as int
+        timestamps:
+            array of pkt timestamps
+        routers:
+            array of ingress routers (1 ... n_border)
+        flags:
+            array which is 1 if at least one everflow TCP flag is set
+        position:
+            first row of the next iteration
+        border_idx:
+            packet indices (into the iteration arrays) separated by border router
+            in chronological order
+    """
+
+    stop = get_store_stop(store['ts'], position, end - start, replay_real_speed)
+
+    src = store['src'][position:stop]
+    timestamps = store['ts'][position:stop]
+    flags = store['flag'][position:stop]
+
+    if mapping is None:
+        routers = store[router_column(n_border, time_persistent)][position:stop]
+    else:
+        # router assignment based on permuted mapping, one gather for all packets
+        routers = get_mapping_routers(mapping, src)
+
+    # group packets by router without copying them,
+    # the stable sort keeps the chronological order per router
+    order = np.argsort(routers, kind='stable')
+    bounds = np.cumsum(np.bincount(routers, minlength=n_border+1))
+    border_idx = [order[bounds[i]:bounds[i+1]] for i in range(n_border)]
+
+    return (src, timestamps, routers, flags, stop, border_idx)
+
+
+def get_store_columns(store, position, start, end, replay_real_speed):
+    """ Returns views on all columns of the current iteration in a packet store
+
+    store (dict):
+        packet store columns (see common.pkt_store.load_pkt_store)
+    position (int):
+        first row of the current iteration (end of last iteration)
+    start (int):
+        start pkt number or time
+    end (int):
+        end pkt number or time
+    replay_real_speed (bool):
+        to distinguish between PPS and real time speed
+
+    returns: (columns, position)
+        columns:
+            dict (column name: array) with all packets of the current iteration
+        position:
+            first row of the next iteration
+    """
+
+    stop = get_store_stop(store['ts'], position, end - start, replay_real_speed)
+
+    return ({name: values[position:stop] for name, values in store.items()}, stop)
+
+
+def get_preprocessed_columns(data_in, start, end, replay_real_speed):
+    """ Reads all packets of the current iteration from a preprocessed csv file
+    into the same columns as in a packet store (the /24 prefix is not kept)
+    This function supports both, PPS and real time speed
+
+    data_in (open file):
+        input file open at end of last iteration
+    start (int):
+        start pkt number or time
+    end (int):
+        end pkt number or time
+    replay_real_speed (bool):
+        to distinguish between PPS and real time speed
+
+    returns: (columns, file_ptr)
+        columns:
+            dict (column name: array) with all packets of the current iteration
+        file_ptr:
+            open file at end of current iteration
+    """
+
+    slice_duration = end - start
+
+    rows = list()
+    for line in data_in:
+        row = line.strip().split(',')
+        second = int(float(row[0]))
+
+        if not rows:
+            start_ts = second
+
+        rows.append(row)
+
+        if not replay_real_speed:
+            if len(rows) == slice_duration:
+                break
+        else:
+            if second - start_ts >= slice_duration:
+                break
+
+    values = list(zip(*rows)) or [()] * len(CSV_COLUMNS)
+
+    columns = dict()
+    for name, dtype in COLUMNS:
+        column = values[CSV_COLUMNS.index(name)]
+        if name == 'ts':
+            columns[name] = np.array([float(value) for value in column], dtype=dtype)
+        else:
+            columns[name] = np.array([int(value) for value in column], dtype=dtype)
+
+    return (columns, data_in)
+
+
+def get_column_pkts(columns, n_border, time_persistent=False, mapping=None):
+    """ Same as get_store_pkts but for the columns of a single iteration
+    (see get_store_columns and get_preprocessed_columns)
+
+    columns (dict):
+        column name: array with all packets of the current iteration
+    n_border (int):
+        number of border routers
+    time_persistent (bool):
+        set to true to use persistent source 24 prefix to ingress router mapping (default false)
+    mapping (array):
+        maps /24 prefix to border router (see prepare_permutations), set to None to use the
+        precomputed assignment (default)
+
+    returns: (src, timestamps, routers, flags, border_idx), see get_store_pkts
+    """
+
+    src, timestamps, routers, flags, _, border_idx = get_store_pkts(
+        columns,
+        0,
+        0,
+        len(columns['ts']),
+        False,
+        n_border,
+        time_persistent,
+        mapping
+    )
+
+    return (src, timestamps, routers, flags, border_idx)
+
+
+def get_flag_index(columns):
+    """ Returns the packets of the current iteration with at least one everflow TCP flag
+    The flags do not depend on the border router assignment, the index is shared by all simulations
+
+    columns (dict):
+        column name: array with all packets of the current iteration
+
+    returns: array with the indices of all packets with flags (chronological order)
+    """
+    return np.flatnonzero(columns['flag'])
+
+
+def get_flag_packets(pkts, flag_idx, n_border):
+    """ Returns all packets with flags and how many of them each border router sees
+
+    pkts (array):
+        packet array with all packets of the current iteration
+    flag_idx (array):
+        indices of all packets with flags (see get_flag_index)
+    n_border (int):
+        number of border routers
+
+    returns: (flag_pkts, router_counts)
+        flag_pkts: packet array with all packets with flags
+        router_counts: number of packets with flags per border router (router 1 first)
+    """
+
+    flag_pkts = pkts[flag_idx]
+    router_counts = np.bincount(flag_pkts['router'], minlength=n_border+1)[1:]
+
+    return (flag_pkts, router_counts)
+
+
+def get_iteration_row(index, iteration, duration, pps):
+    """ Returns the first packet (row) of a given iteration using the boundary index
+
+    Iterations follow the same boundaries as the sequential packet loaders
+    (e.g., get_preprocessed_pkts) when they start at the beginning of the trace.
+
+    index (dict):
+        iteration boundary index (see common.pkt_store.load_index)
+    iteration (int):
+        iteration to seek to (starting at 0)
+    duration (int):
+        how long one iteration takes in seconds
+    pps (int):
+        number of replayed packets per second (-1 == real replay speed)
+
+    returns:
+        row number of the first packet in the iteration (number of packets if
+        the iteration lies beyond the end of the trace)
+    """
+
+    n_pkts = index['n_pkts']
+
+    if pps != -1:
+        return min(iteration * duration * pps, n_pkts)
+
+    first_second = index['first_second']
+    second_rows = index['second_rows']
+
+    row = 0
+    for _ in range(iteration):
+        if row >= n_pkts:
+            break
+
+        # second of the first packet in the current iteration
+        second = int(np.searchsorted(second_rows, row, side='right')) - 1
+
+        # the first packet with int(ts) - start_ts >= duration is
+        # the last packet of the current iteration
+        if second + duration >= len(second_rows):
+            return n_pkts
+        row = int(second_rows[second + duration]) + 1
+
+    return min(row, n_pkts)
+
+
+def seek_row(data_in, index, row):
+    """ Moves an open preprocessed csv file to a given row using the boundary index
+
+    data_in (open file):
+        preprocessed csv input file
+    index (dict):
+        iteration boundary index (see common.pkt_store.load_index)
+    row (int):
+        row to seek to
+
+    returns:
+        open file at the given row
+    """
+
+    # closest known row before the one we are looking for
+    j = int(np.searchsorted(index['second_rows'], row, side='right')) - 1
+    base_row = int(index['second_rows'][j])
+    offset = int(index['second_offsets'][j])
+
+    k = row // index['step']
+    if k < len(index['step_offsets']) and k * index['step'] > base_row:
+        base_row = k * index['step']
+        offset = int(index['step_offsets'][k])
+
+    data_in.seek(offset)
+    for _ in range(row - base_row):
+        data_in.readline()
+
+    return data_in
+
+
+def seek_iteration(data_in, index, iteration, duration, pps):
+    """ Moves a simulation input directly to the start of a given iteration
+
+    data_in (open file or dict):
+        preprocessed csv input file or packet store columns
+    index (dict):
+        iteration boundary index (see common.pkt_store.load_index)
+    iteration (int):
+        iteration to seek to (starting at 0)
+    duration (int):
+        how long one iteration takes in seconds
+    pps (int):
+        number of replayed packets per second (-1 == real replay speed)
+
+    returns:
+        open file at the start of the iteration or, for packet stores, the
+        row (position) to use with get_store_pkts
+    """
+
+    row = get_iteration_row(index, iteration, duration, pps)
+
+    if isinstance(data_in, dict):
+        return row
+    else:
+        return seek_row(data_in, index, row)
+
+
 def get_pkts_efficient(data_in, start, end, ip_slice, replay_real_speed, n_border, time_persistent=False, border_dict=None):
     """ More efficient way to only get required packets for current iteration
     This function supports both, PPS and real time speed
@@ -264,18 +693,16 @@ def get_pkts_efficient(data_in, start, end, ip_slice, replay_real_speed, n_borde
             flags separated by border router
     """
 
-    # initialization outputs
-    pkts = list()
     timestamps = list()
+    src_ips = list()
+    dst_ips = list()
     flags = list()
 
-    border_pkts = [[] for i in range(n_border)]
-    border_flags = [[] for i in range(n_border)]
-
     slice_duration = end - start
 
     i = 0
 
+    # only split the lines here, IPs are converted at once afterwards
     for line in data_in:
         ts, src_ip, dst_ip, ip_id, _, _, syn, fin, rst = line.strip().split(',')[:9]
         if not dst_ip:
@@ -287,30 +714,9 @@ def get_pkts_efficient(data_in, start, end, ip_slice, replay_real_speed, n_borde
         i += 1
 
         timestamps.append(float(ts))
-        src_ip_int = ipv4_to_int(src_ip)
-        temp = (src_ip_int >> 8) << 8
-        prefix_24 = ipv4_to_str(temp)+'/24'
-
-        if time_persistent:
-            if prefix_24 not in border_dict:
-                # if we do not yet know the border router we use the existing
-                # random assignment based on the dst IP
-                router = int(ipv4_to_int(dst_ip) / ip_slice) + 1
-                border_dict[prefix_24] = router
-            else:
-                router = border_dict[prefix_24]
-        else:
-            router = int(ipv4_to_int(dst_ip) / ip_slice) + 1
-
-        if syn == '1' or fin == '1' or rst == '1':
-            flags.append(True)
-            border_flags[router - 1].append(True)
-        else:
-            flags.append(False)
-            border_flags[router - 1].append(False)
-
-        pkts.append((src_ip_int, prefix_24, router))
-        border_pkts[router - 1].append((src_ip_int, prefix_24, router))
+        src_ips.append(src_ip)
+        dst_ips.append(dst_ip)
+        flags.append(syn == '1' or fin == '1' or rst == '1')
 
         if not replay_real_speed:
             if i == slice_duration:
@@ -319,6 +725,33 @@ def get_pkts_efficient(data_in, start, end, ip_slice, replay_real_speed, n_borde
             if int(float(ts)) - start_ts >= slice_duration:
                 break
 
+    src = ipv4_to_int_array(src_ips).astype(np.int64)
+    routers = (ipv4_to_int_array(dst_ips).astype(np.float64) / ip_slice).astype(np.int64) + 1
+
+    # create each /24 prefix string only once
+    prefixes, first, inverse = np.unique(src >> 8, return_index=True, return_inverse=True)
+    names = (ipv4_to_str_array(prefixes << 8) + '/24').tolist()
+
+    if time_persistent:
+        # if we do not yet know the border router of a prefix we use the existing
+        # random assignment based on the dst IP of its first packet
+        # (prefixes are added in the order of their first packet)
+        prefix_routers = np.empty(len(prefixes), dtype=np.int64)
+        for p in np.argsort(first, kind='stable').tolist():
+            name = names[p]
+            if name not in border_dict:
+                border_dict[name] = int(routers[first[p]])
+            prefix_routers[p] = border_dict[name]
+        routers = prefix_routers[inverse]
+
+    pkts = list(zip(src.tolist(), [names[p] for p in inverse.tolist()], routers.tolist()))
+
+    border_pkts = [[] for i in range(n_border)]
+    border_flags = [[] for i in range(n_border)]
+    for pkt, flag in zip(pkts, flags):
+        border_pkts[pkt[2] - 1].append(pkt)
+        border_flags[pkt[2] - 1].append(flag)
+
     return (pkts, timestamps, flags, data_in, border_pkts, border_flags)
 
 
@@ -480,8 +913,8 @@ def get_sampled_packets(pkts, frequency):
 def get_sampled_packets_per_router(border_pkts, border_flags, check_flag, frequency, to_sample):
     """ Get sampled packets for each border router individually
 
-    border_pkts (list of lists): packets separated by border routers
-    border_flags (list of lists): flags separated by border routers
+    border_pkts (list of lists or arrays): packets separated by border routers
+    border_flags (list of lists or arrays): flags separated by border routers
     check_flag (bool): consider flags, yes or no
     frequency (int): n for sampling frequency 1/n
     to_sample (list of ints): sampling progress for each border router
@@ -493,6 +926,9 @@ def get_sampled_packets_per_router(border_pkts, border_flags, check_flag, freque
         progress: current sampling progress for next iteration
     """
 
+    if border_pkts and is_pkt_array(border_pkts[0]):
+        return get_sampled_packets_per_router_array(border_pkts, border_flags, check_flag, frequency, to_sample)
+
     sampled_pkts = list()
     for i, location in enumerate(to_sample):
         # get all sampled packets for the current iteration
@@ -508,13 +944,124 @@ def get_sampled_packets_per_router(border_pkts, border_flags, check_flag, freque
     return (sampled_pkts, to_sample)
 
 
+def get_sampled_packets_per_router_array(border_pkts, border_flags, check_flag, frequency, to_sample):
+    """ Same as get_sampled_packets_per_router for packet arrays
+
+    border_pkts (list of arrays): packet arrays separated by border routers
+    border_flags (list of arrays): boolean flag arrays separated by border routers
+    check_flag (bool): consider flags, yes or no
+    frequency (int): n for sampling frequency 1/n
+    to_sample (list of ints): sampling progress for each border router
+
+    returns: (pkts, progress)
+        pkts: packet array with the sampled packets (router by router)
+        progress: current sampling progress for next iteration
+    """
+
+    sampled_pkts = list()
+    for i, location in enumerate(to_sample):
+        # get all sampled packets for the current iteration
+        positions, to_sample[i] = get_sample_positions(len(border_pkts[i]), frequency, location)
+
+        # only add sample if we do not care about flags or it does not have one
+        if check_flag:
+            sampled_pkts.append(border_pkts[i][positions[~border_flags[i][positions]]])
+        else:
+            sampled_pkts.append(border_pkts[i][positions])
+
+    return (np.concatenate(sampled_pkts), to_sample)
+
+
+def get_sample_positions(n_pkts, frequency, location, mode='systematic', rng=None):
+    """ Returns the positions of the sampled packets of one border router
+
+    Sampling modes:
+    - systematic: every n-th packet, starting at the carried over progress
+    - bernoulli: each packet is sampled independently with probability 1/n
+    - random_skip: random gaps between samples (geometric with mean n) as in sFlow,
+        the remaining gap is carried over to the next iteration
+
+    n_pkts (int): number of packets of the border router in the current iteration
+    frequency (int): n for sampling frequency 1/n
+    location (int): position of the next sample (progress of the last iteration)
+    mode (str): sampling mode (see SAMPLING_MODES)
+    rng (np.random.Generator): random number generator, only needed for random modes
+
+    returns: (positions, progress)
+        positions: array with the positions of all sampled packets
+        progress: sampling progress for the next iteration
+    """
+
+    if mode == 'systematic':
+        positions = np.arange(location, n_pkts, frequency)
+
+    elif mode == 'bernoulli':
+        # the decision of each packet is independent, nothing to carry over
+        return (np.flatnonzero(rng.random(n_pkts) < 1 / frequency), 0)
+
+    elif mode == 'random_skip':
+        # draw slightly more gaps than expected such that one draw is usually enough
+        positions = [np.array([location], dtype=np.int64)]
+        while positions[-1][-1] < n_pkts:
+            gaps = rng.geometric(1 / frequency, (n_pkts - positions[-1][-1]) // frequency + 16)
+            positions.append(positions[-1][-1] + np.cumsum(gaps))
+
+        positions = np.concatenate(positions)
+
+        # first position after the current iteration
+        stop = np.searchsorted(positions, n_pkts)
+        return (positions[:stop], int(positions[stop]) - n_pkts)
+
+    else:
+        raise ValueError('unknown sampling mode {}'.format(mode))
+
+    # take over progress to the next iteration
+    if len(positions) > 0:
+        location = int(positions[-1]) + frequency
+
+    return (positions, location - n_pkts)
+
+
+def get_sampled_indices_per_router(border_idx, flags, frequency, to_sample, mode='systematic', rng=None):
+    """ Get sampled packets for each border router individually
+    Same as get_sampled_packets_per_router but on the packet indices of each router
+
+    border_idx (list of arrays): packet indices separated by border routers (see get_store_pkts)
+    flags (array): boolean flag of each packet, sampled packets with flags are skipped
+        (set to None to not consider flags)
+    frequency (int): n for sampling frequency 1/n
+    to_sample (list of ints): sampling progress for each border router
+    mode (str): sampling mode (see get_sample_positions)
+    rng (np.random.Generator): random number generator, only needed for random modes
+
+    returns: (indices, progress)
+        indices: packet indices of the sampled packets (router by router)
+        progress: current sampling progress for next iteration
+    """
+
+    sampled_idx = list()
+    for i, idx in enumerate(border_idx):
+        positions, to_sample[i] = get_sample_positions(len(idx), frequency, to_sample[i], mode, rng)
+
+        if flags is None:
+            sampled_idx.append(idx[positions])
+        else:
+            sampled = idx[positions]
+            sampled_idx.append(sampled[~flags[sampled]])
+
+    if not sampled_idx:
+        return (np.empty(0, dtype=np.int64), to_sample)
+
+    return (np.concatenate(sampled_idx), to_sample)
+
+
 def get_sampled_packets_everflow(pkts, flags, border_pkts, border_flags, frequency, to_sample):
     """ Get sampled packets for everflow (flags + random)
 
-    pkts (list): list of all packets
-    flags (list): list of booleans if packet has flags set 
-    border_pkts (list of lists): packets separated by border routers
-    border_flags (list of lists): flags separated by border routers
+    pkts (list or array): list of all packets (or packet array)
+    flags (list or array): list of booleans if packet has flags set 
+    border_pkts (list of lists or arrays): packets separated by border routers
+    border_flags (list of lists or arrays): flags separated by border routers
     frequency (int): n for sampling frequency 1/n
     to_sample (list of ints): sampling progress for each border router
 
@@ -528,12 +1075,23 @@ def get_sampled_packets_everflow(pkts, flags, border_pkts, border_flags, frequen
             -> n_random does not count random samples with flags
     """
 
-    sampled_pkts = list()
+    if is_pkt_array(pkts):
+        # add all packets with flags
+        sampled_pkts = pkts[np.flatnonzero(flags)]
+
+        # add randomly sampled packets which have no flags
+        sampled_pkts_random, to_sample = get_sampled_packets_per_router(
+                border_pkts,
+                border_flags,
+                True,
+                frequency,
+                to_sample
+            )
+
+        return (np.concatenate([sampled_pkts, sampled_pkts_random]), to_sample, len(sampled_pkts), len(sampled_pkts_random))
 
     # add all packets with flags
-    for i, flag in enumerate(flags):
-        if flag:
-            sampled_pkts.append(pkts[i])
+    sampled_pkts = list(compress(pkts, flags))
 
     # add randomly sampled packets which have no flags
     sampled_pkts_random, to_sample = get_sampled_packets_per_router(
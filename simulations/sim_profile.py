@@ -0,0 +1,152 @@
+""" Optional per-stage profiling of simulations
+
+A profiler records wall time, CPU time and RSS of each stage of each iteration
+(and top k variant). The rows are written into a separate csv file next to the
+results of a simulation.
+"""
+
+import os.path
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+
+# columns of the profile file
+PROFILE_COLUMNS = ['iteration', 'variant', 'stage', 'wall_s', 'cpu_s', 'rss_mb', 'rss_delta_mb']
+
+# variant of stages which are shared by all top k cases
+SHARED = 'shared'
+
+PAGE_SIZE = resource.getpagesize()
+
+
+def get_rss():
+    """ Returns the current resident set size of this process
+
+    Falls back to the peak RSS if the current one is not available (no /proc)
+
+    returns: RSS in MB
+    """
+
+    try:
+        with open('/proc/self/statm', 'r') as data_in:
+            return int(data_in.read().split()[1]) * PAGE_SIZE / 2**20
+    except OSError:
+        return get_peak_rss()
+
+
+def get_peak_rss():
+    """ Returns the peak resident set size of this process
+
+    returns: peak RSS in MB
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, KB on linux
+    if sys.platform == 'darwin':
+        return peak / 2**20
+    return peak / 2**10
+
+
+def get_usage():
+    """ Returns the current wall time, CPU time and RSS
+
+    returns: (wall, cpu, rss) in seconds and MB
+    """
+    return (time.perf_counter(), time.process_time(), get_rss())
+
+
+def profile_file(out_file):
+    """ Returns the name of the profile file of a simulation
+
+    out_file (str): name of file with results (e.g., b_4_l_1.csv)
+
+    returns: file name of the profile (e.g., b_4_l_1_profile.csv)
+    """
+
+    base, _ = os.path.splitext(out_file)
+    return base + '_profile.csv'
+
+
+class StageProfiler:
+    """ Collects the resource usage of simulation stages
+
+    A disabled profiler does not measure anything, stages run without overhead.
+    """
+
+    def __init__(self, enabled=True):
+        """ constructor
+
+        enabled (bool): measure stages (True) or only run them (False)
+        """
+
+        self.enabled = enabled
+        self.rows = list()
+
+    @contextmanager
+    def stage(self, i, variant, name):
+        """ Context manager which measures the enclosed stage
+
+        i (int): iteration
+        variant (str): top k variant (e.g., top_100_activity or full) or SHARED
+        name (str): stage name
+        """
+
+        if not self.enabled:
+            yield
+            return
+
+        start = get_usage()
+        yield
+        self.add(i, variant, name, [(start, get_usage())])
+
+    def add(self, i, variant, name, intervals):
+        """ Adds a stage which was measured outside of the profiler
+
+        i (int): iteration
+        variant (str): top k variant or SHARED
+        name (str): stage name
+        intervals (list): (start, end) usages (see get_usage), the stage takes all of them together
+        """
+
+        if not self.enabled:
+            return
+
+        wall = sum(end[0] - start[0] for start, end in intervals)
+        cpu = sum(end[1] - start[1] for start, end in intervals)
+        rss_delta = sum(end[2] - start[2] for start, end in intervals)
+
+        self.rows.append((i, variant, name, wall, cpu, intervals[-1][1][2], rss_delta))
+
+    def extend(self, rows):
+        """ Adds rows measured by another profiler (e.g., in a worker process)
+
+        rows (list): profile rows (see PROFILE_COLUMNS)
+        """
+        self.rows.extend(rows)
+
+    def pop_rows(self):
+        """ Returns and removes all rows measured so far
+
+        returns: list of profile rows (see PROFILE_COLUMNS)
+        """
+
+        rows = self.rows
+        self.rows = list()
+        return rows
+
+    def write(self, out_file):
+        """ Writes all rows into the profile file of a simulation
+
+        out_file (str): name of file with results (see profile_file)
+        """
+
+        if not self.enabled:
+            return
+
+        with open(profile_file(out_file), 'w') as data_out:
+            data_out.write(','.join(PROFILE_COLUMNS) + '\n')
+            for i, variant, name, wall, cpu, rss, rss_delta in self.rows:
+                data_out.write('{},{},{},{:.6f},{:.6f},{:.1f},{:.1f}\n'.format(i, variant, name, wall, cpu, rss, rss_delta))
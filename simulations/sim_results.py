@@ -2,7 +2,9 @@
 """
 
 import pytricia
-from sim_util import get_24_prefixes
+import numpy as np
+from sim_util import get_24_prefixes, get_pkt_arrays, GroundTruth
+from common.ip_conversion import ipv4_to_int, ipv4_to_int_array
 from collections import defaultdict
 
 
@@ -208,10 +210,80 @@ def get_results_sentinel_mirroring(sentinels, mirrored_pkts, n_multi, n_24, fina
     return (correct, 0, uncertain, no_traffic, unknown)
 
 
+def get_gt_columns(gt_data):
+    """ Returns ground truth data as GroundTruth object
+
+    gt_data (dict or GroundTruth): ground truth data (dicts as returned by get_ground_truth)
+
+    returns: GroundTruth
+    """
+
+    if isinstance(gt_data, GroundTruth):
+        return gt_data
+
+    # one entry per (prefix, router), all packets are counted with the first router
+    src = list()
+    routers = list()
+    counts = list()
+    for prefix, value in gt_data.items():
+        key = ipv4_to_int(prefix.split('/')[0])
+        for i, router in enumerate(sorted(value['ingress_router'])):
+            src.append(key)
+            routers.append(router)
+            counts.append(value['pkt_count'] if i == 0 else 0)
+
+    return GroundTruth(np.array(src, dtype=np.int64), np.array(routers, dtype=np.int64), np.array(counts, dtype=np.int64))
+
+
+def get_prefix_ranges(prefixes):
+    """ Returns the /24 prefixes contained in given prefixes as integer ranges
+
+    prefixes (iterable): prefixes in dot notation (e.g., 1.2.0.0/16)
+
+    returns: (lo, hi)
+        lo: first /24 key (IP >> 8) of each prefix
+        hi: end (exclusive) /24 key of each prefix
+    """
+
+    ips = list()
+    sizes = list()
+    for prefix in prefixes:
+        ip, size = prefix.split('/')
+        ips.append(ip)
+        sizes.append(int(size))
+
+    lo = ipv4_to_int_array(ips).astype(np.int64) >> 8
+    hi = lo + (np.int64(1) << (24 - np.array(sizes, dtype=np.int64)))
+
+    return (lo, hi)
+
+
+def get_range_positions(gt_data, lo, hi):
+    """ Intersects /24 ranges with the active /24 prefixes of the ground truth
+
+    gt_data (GroundTruth): current ground truth data
+    lo (array): first /24 key of each range
+    hi (array): end (exclusive) /24 key of each range
+
+    returns: (positions, lengths)
+        positions: positions in gt_data.keys of all active /24 prefixes, range by range
+        lengths: number of active /24 prefixes in each range
+    """
+
+    starts = np.searchsorted(gt_data.keys, lo)
+    lengths = np.searchsorted(gt_data.keys, hi) - starts
+
+    # concatenated aranges from each start
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    positions = np.arange(int(lengths.sum()), dtype=np.int64) + offsets
+
+    return (positions, lengths)
+
+
 def get_results_ground_truth(gt_data, sentinels, remove_invalid=False):
     """ Simulation results based on current ground truth data
 
-    gt_data (dict of sets): 
+    gt_data (dict or GroundTruth): 
         current ground truth data
     sentinels (list): 
         list of found sentinels
@@ -234,87 +306,63 @@ def get_results_ground_truth(gt_data, sentinels, remove_invalid=False):
         - pkt count for all packets belonging to unique /24 in gt data
     """
 
-    covered_correct = 0
-    pkt_count_correct = 0
-    covered_wrong = 0
-    covered_not_active = 0
-    covered_not_unique = 0
-    not_covered = 0
-    not_covered_not_unique = 0
-    covered_correct_count = 0
-    covered_wrong_count = 0
-    covered_not_unique_count = 0
-    not_covered_count = 0
-    not_covered_not_unique_count = 0
-    count_all_unique_pkts = 0
-
-    # to keep track of /24 already covered by sentinels
-    checked = set()
-
-    if not remove_invalid:
-        sentinels_to_analyze = sentinels.copy()
-    else:
-        sentinels_to_analyze = list()
-        for prefix, router in sentinels:
-            is_valid = True
-            for prefix_24 in get_24_prefixes(prefix):
-                if prefix_24 in gt_data:
-                    # either the inference is completely wrong
-                    # or we have a non unique /24 prefix
-                    # -> remove the sentinel completely
-                    if router not in gt_data[prefix_24]['ingress_router'] or len(gt_data[prefix_24]['ingress_router']) > 1:
-                        is_valid = False
-                        break
-
-            if is_valid:
-                sentinels_to_analyze.append((prefix, router))
-
-    for prefix, router in sentinels_to_analyze:
+    gt_data = get_gt_columns(gt_data)
 
-        for prefix_24 in get_24_prefixes(prefix):
-            checked.add(prefix_24)
-
-            if prefix_24 in gt_data:
-                # correctly identified ingress
-                if router in gt_data[prefix_24]['ingress_router']:
-                    covered_correct += 1
-                    covered_correct_count += gt_data[prefix_24]['pkt_count']
-                    pkt_count_correct += gt_data[prefix_24]['pkt_count']
-
-                    # but was actually not unique
-                    if len(gt_data[prefix_24]['ingress_router']) > 1:
-                        covered_not_unique += 1
-                        covered_not_unique_count += gt_data[prefix_24]['pkt_count']
-                    else:
-                        count_all_unique_pkts += gt_data[prefix_24]['pkt_count']
-
-                # wrong inference
-                else:
-                    covered_wrong += 1
-                    covered_wrong_count += gt_data[prefix_24]['pkt_count']
+    sentinels = list(sentinels)
+    lo, hi = get_prefix_ranges(prefix for prefix, router in sentinels)
+    routers = np.array([router for prefix, router in sentinels], dtype=np.int64)
 
-                    if len(gt_data[prefix_24]['ingress_router']) == 1:
-                        count_all_unique_pkts += gt_data[prefix_24]['pkt_count']
+    # all active /24 prefixes covered by each sentinel
+    positions, lengths = get_range_positions(gt_data, lo, hi)
+    correct = gt_data.has_router(positions, np.repeat(routers, lengths))
+    unique = gt_data.unique[positions]
+    counts = gt_data.pkt_counts[positions]
 
-            # covered by sentinel but not in ground truth data
-            else:
-                covered_not_active += 1
-
-    for key, value in gt_data.items():
-        if key not in checked:
-            # not covered by sentinel but active in ground truth data
-            not_covered += 1
-            not_covered_count += value['pkt_count']
-
-            # not covered by sentinel but difficult to find as not unique
-            if len(value['ingress_router']) > 1:
-                not_covered_not_unique += 1
-                not_covered_not_unique_count += value['pkt_count']
-            else:
-                count_all_unique_pkts += value['pkt_count']
+    if remove_invalid:
+        # either the inference is completely wrong
+        # or we have a non unique /24 prefix
+        # -> remove the sentinel completely
+        sentinel_idx = np.repeat(np.arange(len(sentinels)), lengths)
+        invalid = np.bincount(sentinel_idx, weights=~(correct & unique), minlength=len(sentinels)) > 0
+
+        lo = lo[~invalid]
+        hi = hi[~invalid]
+        lengths = lengths[~invalid]
+
+        keep = ~invalid[sentinel_idx]
+        positions = positions[keep]
+        correct = correct[keep]
+        unique = unique[keep]
+        counts = counts[keep]
+
+    wrong = ~correct
 
-    # if we do not need "checked", we can compute not covered as:
-    # not_covered = len(gt_data) - correct - wrong
+    covered_correct = int(correct.sum())
+    covered_correct_count = int(counts[correct].sum())
+    pkt_count_correct = covered_correct_count
+    covered_wrong = int(wrong.sum())
+    covered_wrong_count = int(counts[wrong].sum())
+    covered_not_unique = int((correct & ~unique).sum())
+    covered_not_unique_count = int(counts[correct & ~unique].sum())
+
+    # covered by sentinel but not in ground truth data
+    covered_not_active = int((hi - lo).sum() - lengths.sum())
+
+    # /24 already covered by sentinels
+    checked = np.zeros(len(gt_data), dtype=bool)
+    checked[positions] = True
+    not_checked = ~checked
+
+    # not covered by sentinel but active in ground truth data
+    not_covered = int(not_checked.sum())
+    not_covered_count = int(gt_data.pkt_counts[not_checked].sum())
+
+    # not covered by sentinel but difficult to find as not unique
+    not_covered_not_unique = int((not_checked & ~gt_data.unique).sum())
+    not_covered_not_unique_count = int(gt_data.pkt_counts[not_checked & ~gt_data.unique].sum())
+
+    # covered (correct or wrong) and not covered packets of unique /24 prefixes
+    count_all_unique_pkts = int(counts[unique].sum()) + int(gt_data.pkt_counts[not_checked & gt_data.unique].sum())
 
     return (
         covered_correct,
@@ -337,10 +385,10 @@ def get_results_ground_truth_sampling(gt_data, samples):
     """ Simulation results based on current ground truth data
         if we consider sampling only
 
-    gt_data (dict of sets): 
+    gt_data (dict or GroundTruth): 
         current ground truth data
-    samples (list): 
-        list of sampled packets
+    samples (list or array): 
+        sampled packets
 
     returns: simulation results:
         - number /24 prefixes covered
@@ -354,60 +402,34 @@ def get_results_ground_truth_sampling(gt_data, samples):
         - number /24 prefixes which are no longer active in ground truth data
     """
 
-    set_covered = set()
-    set_not_active = set()
-    pkt_counter_covered = 0
-    counter_not_unique = 0
-    pkt_counter_not_unique = 0
-    counter_not_covered = 0
-    counter_not_covered_not_unique = 0
-    pkt_counter_not_covered = 0
-    pkt_counter_not_covered_not_unique = 0
-    counter_not_active = 0
-
-    for sample in samples:
-        # get sample's prefix
-        prefix = sample[1]
-
-        # Given that ground truth and sampled packets are based on the same
-        # input data, we do not have to compare the actual ingress router.
-        # The sampled packet will always enter over one of the ingress routers
-        # assigned to the corresponding /24 prefix in the ground truth data.
-        if prefix not in set_covered and prefix not in set_not_active:
-            # check if prefix is still active in current ground truth data
-            if prefix in gt_data:
-                # add the sample's prefix to the covered set
-                set_covered.add(prefix)
-                # count the corresponding packets
-                pkt_counter_covered += gt_data[prefix]['pkt_count']
-            else:
-                # make sure we count it only once as not active
-                set_not_active.add(prefix)
-                counter_not_active += 1
+    gt_data = get_gt_columns(gt_data)
 
-    for prefix in set_covered:
-        if prefix in gt_data and len(gt_data[prefix]['ingress_router']) > 1:
-            counter_not_unique += 1
-            pkt_counter_not_unique += gt_data[prefix]['pkt_count']
+    # Given that ground truth and sampled packets are based on the same
+    # input data, we do not have to compare the actual ingress router.
+    # The sampled packet will always enter over one of the ingress routers
+    # assigned to the corresponding /24 prefix in the ground truth data.
+    sampled_keys = np.unique(get_pkt_arrays(samples)[0] >> 8)
 
-    for prefix, value in gt_data.items():
-        if prefix not in set_covered:
-            counter_not_covered += 1
-            pkt_counter_not_covered += value['pkt_count']
-            if len(value['ingress_router']) > 1:
-                counter_not_covered_not_unique += 1
-                pkt_counter_not_covered_not_unique += value['pkt_count']
+    # check if prefixes are still active in current ground truth data
+    positions = np.searchsorted(gt_data.keys, sampled_keys)
+    active = positions < len(gt_data)
+    active[active] = gt_data.keys[positions[active]] == sampled_keys[active]
+
+    covered = np.zeros(len(gt_data), dtype=bool)
+    covered[positions[active]] = True
+    not_unique = ~gt_data.unique
+    counts = gt_data.pkt_counts
 
     return (
-        len(set_covered),                    # nb. of prefixes covered
-        counter_not_unique,                  # nb. of these prefixes that have more than one ingress point
-        counter_not_covered,                 # nb. of prefixes not covered
-        counter_not_covered_not_unique,      # nb. of prefixes not covered which are not unique
-        pkt_counter_covered,                 # nb. of packets covered
-        pkt_counter_not_unique,              # nb. of packets covered with non-unique ingress point
-        pkt_counter_not_covered,             # nb. of packets not covered
-        pkt_counter_not_covered_not_unique,  # nb. of packets not covered which non-unique ingress point
-        counter_not_active,                  # nb. of prefixes which are no longer active in gt data
+        int(covered.sum()),                                # nb. of prefixes covered
+        int((covered & not_unique).sum()),                 # nb. of these prefixes that have more than one ingress point
+        int((~covered).sum()),                             # nb. of prefixes not covered
+        int((~covered & not_unique).sum()),                # nb. of prefixes not covered which are not unique
+        int(counts[covered].sum()),                        # nb. of packets covered
+        int(counts[covered & not_unique].sum()),           # nb. of packets covered with non-unique ingress point
+        int(counts[~covered].sum()),                       # nb. of packets not covered
+        int(counts[~covered & not_unique].sum()),          # nb. of packets not covered which non-unique ingress point
+        int((~active).sum()),                              # nb. of prefixes which are no longer active in gt data
     )
 
 
@@ -419,7 +441,7 @@ def get_results_ground_truth_invalidated_sentinels(sentinels, removed_sentinels,
         list of current sentinels
     removed_sentinels (set):
         set of removed sentinels due to mirroring
-    gt_data (dict of sets):
+    gt_data (dict or GroundTruth):
         current ground truth data
 
     returns: (sentinels, results)
@@ -432,26 +454,21 @@ def get_results_ground_truth_invalidated_sentinels(sentinels, removed_sentinels,
             - number pkts lost due to invalid sentinels which are not unique
     """
 
-    prefix_lost = 0
-    prefix_lost_not_unique = 0
-    prefix_lost_not_active = 0
-    pkt_lost = 0
-    pkt_lost_not_unique = 0
+    gt_data = get_gt_columns(gt_data)
 
-    for prefix in removed_sentinels:
-        # given that sentinels do not overlap, we do not need
-        # to check if we already covered this case
-        for prefix_24 in get_24_prefixes(prefix):
-            if prefix_24 in gt_data:
-                prefix_lost += 1
-                pkt_lost += gt_data[prefix_24]['pkt_count']
+    # given that sentinels do not overlap, we do not need
+    # to check if we already covered this case
+    lo, hi = get_prefix_ranges(removed_sentinels)
+    positions, lengths = get_range_positions(gt_data, lo, hi)
 
-                if len(gt_data[prefix_24]['ingress_router']) > 1:
-                    prefix_lost_not_unique += 1
-                    pkt_lost_not_unique += gt_data[prefix_24]['pkt_count']
+    not_unique = ~gt_data.unique[positions]
+    counts = gt_data.pkt_counts[positions]
 
-            else:
-                prefix_lost_not_active += 1
+    prefix_lost = len(positions)
+    prefix_lost_not_unique = int(not_unique.sum())
+    prefix_lost_not_active = int((hi - lo).sum() - lengths.sum())
+    pkt_lost = int(counts.sum())
+    pkt_lost_not_unique = int(counts[not_unique].sum())
 
     still_valid_sentinels = list()
     for prefix, router in sentinels:
@@ -1,13 +1,52 @@
 import unittest
-from sim_util import get_ground_truth, get_sentinels, prepare_ingress_routers, gt_init, export_sentinels, enhance_sentinels, order_sentinels
-from common.ip_conversion import ipv4_to_int
-from sim_mirroring import get_mirroring_rules, get_mirrored_packets
+import random
+import pytricia
+from sim_util import get_result_string, get_24_prefixes, get_ground_truth, get_ground_truth_data, GroundTruth, PKT_DTYPE, make_pkt_array, to_pkt_array, concat_pkts, get_pkts_key, get_sentinels, get_table, get_sentinel_window, update_sentinel_window, get_window_sentinels, get_prefix_counts, enhance_sentinels_counts, prepare_ingress_routers, gt_init, export_sentinels, enhance_sentinels, order_sentinels
+from common.ip_conversion import ipv4_to_int, ipv4_to_int_array, ipv4_to_str_array
+from common.find_sentinels import Sentinel, search_sentinels
+from sim_cases import MirroringCase, CaseRunner, CaseWorkers
+from runner import run_simulations, prepare_single_run, prepare_sweeps, MEMORY_BASE
+from simulation import make_sim_magnifier, make_sim_everflow, make_sim_sweep, checkpoint_file, MagnifierSimulation, EverflowSimulation
+from sim_output import ResultWriter, INDEX_COLUMNS
+from results.prepare_plot_data import read_data, load_results, get_plot_values, get_average, get_unique_coverage_average, get_prefix_space_average, RESULT_COLUMNS
+from sim_benchmark import benchmark, compare_results, generate_trace, STAGES
+from sim_profile import StageProfiler, profile_file, PROFILE_COLUMNS
+from datetime import datetime
+from sim_mirroring import get_mirroring_rules, get_shared_sentinels, get_mirrored_packets, compile_mirroring_rules, RuleTable, get_mirrored_packets_everflow
 from sim_results import get_results_ground_truth, get_results_ground_truth_sampling, get_results_ground_truth_invalidated_sentinels
-from sim_pkts import get_pkts, get_pkts_time_slice, get_pkts_efficient, get_sampled_packets_per_router, get_sampled_packets_everflow, get_preprocessed_pkts
-# from preprocess_pkt_csv import preprocess
+from sim_pkts import prepare_permutations, get_mapping_routers, get_pkts, get_pkts_time_slice, get_pkts_efficient, get_sampled_packets_per_router, get_sampled_packets_everflow, get_sampled_indices_per_router, get_sample_positions, get_flag_index, get_flag_packets, get_preprocessed_pkts, get_preprocessed_pkts_mapping, get_store_pkts, seek_iteration, get_iteration_row, get_store_columns, get_preprocessed_columns, get_column_pkts
+from common.pkt_store import load_pkt_store, convert_csv, router_column, build_csv_index, build_store_index, load_index, index_file
 from collections import defaultdict
+import numpy as np
 import os.path
+import sys
 import io
+import shutil
+import tempfile
+import json
+import gzip
+from unittest import mock
+import struct
+import subprocess
+from pathlib import Path
+
+# preprocessing scripts are located in the input_data folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_data'))
+from preprocess_pkt_csv import preprocess, preprocess_binary, preprocess_parallel, get_chunk_offsets
+from preprocess_pcap import preprocess_pcap
+
+
+def write_result_rows(out_file, result_dict):
+    """ Writes results in the previous layout (one row per result name) """
+
+    # iteration end times relative to the first iteration
+    first_ts = result_dict['iteration_end_ts'][0]
+
+    with open(out_file, 'w') as data_out:
+        for key, values in result_dict.items():
+            if key == 'iteration_end_ts':
+                values = [ts - first_ts for ts in values]
+            data_out.write('{},{}\n'.format(key, get_result_string(values)))
 
 
 class TestSentinelSearch(unittest.TestCase):
@@ -50,6 +89,76 @@ class TestSentinelSearch(unittest.TestCase):
         self.assertCountEqual(get_sentinels(self.packets, 0, 24),
                               self.expected_big)
 
+    def test_class_s_search(self):
+        search = Sentinel()
+        search.t_in = get_table(self.packets)
+        search.aggregate(['src_ip', 'router_ip'], {'pkts': 'sum'})
+        found_sentinels = search.sentinel_search(True, 'src_ip', 'check', 'router_ip', start=16, end=8)
+
+        self.assertSetEqual(found_sentinels, set([(ipv4_to_int('10.0.0.0'), 24, 1),
+                                                  (ipv4_to_int('10.0.1.0'), 24, 2),
+                                                  (ipv4_to_int('20.0.0.0'), 17, 1),
+                                                  (ipv4_to_int('128.0.0.0'), 17, 3)]))
+
+        # rows covered by a sentinel are marked in the result column
+        self.assertListEqual(search.t_in['check'].tolist(), [False, False, True, True, True, True, True])
+
+    def test_num_stop_s_search(self):
+        ips = [src_ip for src_ip, _, _ in self.packets]
+        routers = [router for _, _, router in self.packets]
+        found_sentinels, _, found = search_sentinels(ips, routers, start=16, end=8, num_stop=2)
+
+        # router of a sentinel is the one of the last (IP, router) pair
+        self.assertDictEqual(found_sentinels, {ipv4_to_int('1.2.0.0'): (17, 2),
+                                               ipv4_to_int('10.0.0.0'): (17, 2),
+                                               ipv4_to_int('20.0.0.0'): (17, 1),
+                                               ipv4_to_int('128.0.0.0'): (17, 3)})
+        self.assertTrue(found.all())
+
+    def test_empty_s_search(self):
+        self.assertCountEqual(get_sentinels(list(), 16, 24), set())
+
+
+class TestSentinelWindow(unittest.TestCase):
+    def setUp(self):
+        self.batches = [[(ipv4_to_int('1.2.3.0'), '1.2.3.0/24', 1),
+                         (ipv4_to_int('10.0.0.1'), '10.0.0.0/24', 1),
+                         (ipv4_to_int('20.0.0.1'), '20.0.0.0/24', 1)],
+                        [(ipv4_to_int('1.2.3.1'), '1.2.3.0/24', 2),
+                         (ipv4_to_int('10.0.1.1'), '10.0.1.0/24', 2),
+                         (ipv4_to_int('20.0.0.2'), '20.0.0.0/24', 1)],
+                        [(ipv4_to_int('128.0.0.1'), '128.0.0.0/24', 3),
+                         (ipv4_to_int('10.0.1.1'), '10.0.1.0/24', 2)],
+                        [],
+                        [(ipv4_to_int('1.2.3.0'), '1.2.3.0/24', 1),
+                         (ipv4_to_int('1.2.4.0'), '1.2.4.0/24', 2)]]
+
+    def test_window(self):
+        for size in [1, 2, 3]:
+            for start, end in [(16, 24), (16, 32), (0, 24)]:
+                window = get_sentinel_window(size, start, end)
+
+                for i, batch in enumerate(self.batches):
+                    update_sentinel_window(window, batch)
+
+                    pkts = sum(self.batches[max(0, i-size+1):i+1], [])
+                    self.assertSetEqual(get_window_sentinels(window), get_sentinels(pkts, start, end))
+
+    def test_expiry(self):
+        window = get_sentinel_window(2, 16, 24)
+
+        update_sentinel_window(window, self.batches[0])
+        update_sentinel_window(window, self.batches[1])
+        self.assertSetEqual(get_window_sentinels(window), set([('10.0.0.0/24', 1),
+                                                               ('10.0.1.0/24', 2),
+                                                               ('20.0.0.0/17', 1)]))
+
+        # first batch expires, 1.2.3.0/24 was only seen with router 2 afterwards
+        update_sentinel_window(window, self.batches[3])
+        self.assertSetEqual(get_window_sentinels(window), set([('1.2.0.0/17', 2),
+                                                               ('10.0.0.0/17', 2),
+                                                               ('20.0.0.0/17', 1)]))
+
 
 class TestGroundTruthData(unittest.TestCase):
     def setUp(self):
@@ -79,6 +188,27 @@ class TestGroundTruthData(unittest.TestCase):
         self.assertDictEqual(get_ground_truth(self.packets),
                              self.expected_gt)
 
+    def test_ground_truth_data(self):
+        gt_data = get_ground_truth_data(self.packets)
+
+        self.assertEqual(len(gt_data), len(self.expected_gt))
+        self.assertDictEqual(dict(gt_data.items()), self.expected_gt)
+        self.assertListEqual(gt_data.n_routers.tolist(), [2, 1, 1, 1, 1])
+        self.assertListEqual(gt_data.unique.tolist(), [False, True, True, True, True])
+
+        self.assertIn('10.0.1.0/24', gt_data)
+        self.assertNotIn('10.0.2.0/24', gt_data)
+        self.assertSetEqual(gt_data['1.2.3.0/24']['ingress_router'], set([1, 2]))
+        with self.assertRaises(KeyError):
+            gt_data['10.0.2.0/24']
+
+        self.assertListEqual(gt_data.has_router(np.array([0, 0, 0, 4]), np.array([1, 2, 3, 3])).tolist(),
+                             [True, True, False, True])
+
+        empty = GroundTruth(np.array([], dtype=np.uint32), np.array([], dtype=np.uint16))
+        self.assertEqual(len(empty), 0)
+        self.assertNotIn('1.2.3.0/24', empty)
+
 
 class TestMirroring(unittest.TestCase):
     def setUp(self):
@@ -143,6 +273,731 @@ class TestMirroring(unittest.TestCase):
         self.assertListEqual(mirrored_pkts, self.expected_remove)
         self.assertListEqual(removed_sentinels, self.removed_sentinels_do_remove)
 
+    def test_shared_mirroring(self):
+        sampled_window = get_sentinel_window(2, 16, 24)
+        update_sentinel_window(sampled_window, self.pkts_sentinel)
+        sampled_counts = get_prefix_counts(self.pkts_sentinel)
+
+        cache = dict()
+        for mirrored_pkts in [list(), self.expected_no_remove[:2], self.expected_remove]:
+            mirrored_window = get_sentinel_window(2, 16, 24)
+            update_sentinel_window(mirrored_window, mirrored_pkts)
+
+            for order, top in [('activity', 2), ('size', 1), (None, None)]:
+                # deployed as in MirroringCase.run
+                sentinels = get_shared_sentinels(sampled_window, sampled_counts, mirrored_window,
+                                                 mirrored_pkts, order, top, cache)
+                table = RuleTable()
+                table.update(sentinels)
+
+                expected_rules, expected_sentinels = get_mirroring_rules(self.pkts_sentinel + mirrored_pkts,
+                                                                         16, 24, order, top)
+
+                self.assertEqual(sentinels, expected_sentinels)
+                self.assertDictEqual(table.rules, {prefix: expected_rules[prefix] for prefix in expected_rules})
+
+        # one cache entry per set of mirrored packets
+        self.assertEqual(len(cache), 3)
+
+    def test_mirroring_array(self):
+        for remove, expected, expected_removed in [(False, self.expected_no_remove, self.removed_sentinels_no_remove),
+                                                   (True, self.expected_remove, self.removed_sentinels_do_remove)]:
+            rules, _ = get_mirroring_rules(to_pkt_array(self.pkts_sentinel), 16, 24, None, None)
+
+            mirrored_pkts, removed_sentinels = get_mirrored_packets(rules, to_pkt_array(self.pkts_mirror), remove)
+            self.assertListEqual(mirrored_pkts.tolist(), to_pkt_array(expected).tolist())
+            self.assertListEqual(sorted(removed_sentinels), expected_removed)
+
+    def test_mirroring_array_overlapping(self):
+        for remove in [False, True]:
+            # nested rules are matched in the prefix tree, packets in 1.2.4.0/24 match the longer prefix
+            rules = pytricia.PyTricia()
+            rules['1.2.0.0/22'] = 1
+            rules['1.2.4.0/24'] = 2
+            rules['1.2.0.0/16'] = 3
+            self.assertIsNone(compile_mirroring_rules(rules))
+
+            expected_rules = pytricia.PyTricia()
+            for prefix in rules:
+                expected_rules[prefix] = rules[prefix]
+
+            mirrored_pkts, removed_sentinels = get_mirrored_packets(rules, to_pkt_array(self.pkts_mirror), remove)
+            expected_pkts, expected_removed = get_mirrored_packets(expected_rules, self.pkts_mirror, remove)
+
+            self.assertListEqual(mirrored_pkts.tolist(), to_pkt_array(expected_pkts).tolist())
+            self.assertSetEqual(removed_sentinels, expected_removed)
+            self.assertListEqual(sorted(rules), sorted(expected_rules))
+
+    def test_mirroring_array_compiled(self):
+        rules, _ = get_mirroring_rules(self.pkts_sentinel, 16, 24, None, None)
+        starts, ends, routers, prefixes = compile_mirroring_rules(rules)
+
+        self.assertListEqual(prefixes, ['1.2.0.0/22', '1.2.4.0/24', '1.2.5.0/24'])
+        self.assertListEqual(starts.tolist(), [ipv4_to_int('1.2.0.0'), ipv4_to_int('1.2.4.0'), ipv4_to_int('1.2.5.0')])
+        self.assertListEqual(ends.tolist(), [ipv4_to_int('1.2.4.0'), ipv4_to_int('1.2.5.0'), ipv4_to_int('1.2.6.0')])
+        self.assertListEqual(routers.tolist(), [1, 2, 3])
+
+        # removed rules are also removed from the prefix tree
+        _, removed_sentinels = get_mirrored_packets(rules, to_pkt_array(self.pkts_mirror), True)
+        self.assertEqual(len(rules), 0)
+
+        # no rules, nothing is mirrored
+        mirrored_pkts, removed_sentinels = get_mirrored_packets(rules, to_pkt_array(self.pkts_mirror), True)
+        self.assertEqual(len(mirrored_pkts), 0)
+        self.assertSetEqual(removed_sentinels, set())
+
+    def test_rule_table(self):
+        table = RuleTable()
+
+        # first deployment adds all rules
+        self.assertTupleEqual(table.update(self.expected_sentinels), (3, 0))
+        self.assertListEqual(table.prefixes.tolist(), ['1.2.0.0/22', '1.2.4.0/24', '1.2.5.0/24'])
+
+        # only the difference is applied, a changed router counts as removed and added
+        self.assertTupleEqual(table.update([('1.2.0.0/22', 1), ('1.2.4.0/24', 3), ('10.0.0.0/8', 2)]), (2, 2))
+        self.assertTupleEqual((table.n_added, table.n_removed), (2, 2))
+        self.assertListEqual(table.prefixes.tolist(), ['1.2.0.0/22', '1.2.4.0/24', '10.0.0.0/8'])
+        self.assertListEqual(table.routers.tolist(), [1, 3, 2])
+        self.assertTupleEqual(table.update([('1.2.0.0/22', 1), ('1.2.4.0/24', 3), ('10.0.0.0/8', 2)]), (0, 0))
+
+        for remove, expected, expected_removed in [(False, self.expected_no_remove, self.removed_sentinels_no_remove),
+                                                   (True, self.expected_remove, self.removed_sentinels_do_remove)]:
+            for pkts in [self.pkts_mirror, to_pkt_array(self.pkts_mirror)]:
+                table = RuleTable()
+                table.update(self.expected_sentinels)
+
+                mirrored_pkts, removed_sentinels = table.get_mirrored_packets(pkts, remove)
+                self.assertListEqual(to_pkt_array(mirrored_pkts).tolist(), to_pkt_array(expected).tolist())
+                self.assertListEqual(sorted(removed_sentinels), expected_removed)
+
+                # mirroring rules are removed from the table
+                self.assertEqual(len(table), 3 - len(expected_removed))
+                self.assertEqual(len(table.prefixes), 3 - len(expected_removed))
+
+                # removed rules are deployed again
+                self.assertTupleEqual(table.update(self.expected_sentinels), (len(expected_removed), 0))
+
+        # nested rules
+        table = RuleTable()
+        table.update([('1.2.0.0/22', 1), ('1.2.4.0/24', 2), ('1.2.0.0/16', 3)])
+        self.assertTrue(table.is_overlapping())
+
+        expected_pkts, expected_removed = get_mirrored_packets(table.get_tree(), self.pkts_mirror, True)
+        mirrored_pkts, removed_sentinels = table.get_mirrored_packets(to_pkt_array(self.pkts_mirror), True)
+        self.assertListEqual(mirrored_pkts.tolist(), to_pkt_array(expected_pkts).tolist())
+        self.assertSetEqual(removed_sentinels, expected_removed)
+        self.assertEqual(len(table), 3 - len(expected_removed))
+
+    def test_shared_mirroring_array(self):
+        sampled_window = get_sentinel_window(2, 16, 24)
+        update_sentinel_window(sampled_window, to_pkt_array(self.pkts_sentinel))
+        sampled_counts = get_prefix_counts(to_pkt_array(self.pkts_sentinel))
+        self.assertEqual(sampled_counts, get_prefix_counts(self.pkts_sentinel))
+
+        cache = dict()
+        for mirrored_pkts in [list(), self.expected_no_remove[:2], self.expected_remove]:
+            mirrored_window = get_sentinel_window(2, 16, 24)
+            update_sentinel_window(mirrored_window, to_pkt_array(mirrored_pkts))
+
+            for order, top in [('activity', 2), ('size', 1), (None, None)]:
+                # deployed as in MirroringCase.run
+                sentinels = get_shared_sentinels(sampled_window, sampled_counts, mirrored_window,
+                                                 to_pkt_array(mirrored_pkts), order, top, cache)
+                table = RuleTable()
+                table.update(sentinels)
+
+                expected_rules, expected_sentinels = get_mirroring_rules(self.pkts_sentinel + mirrored_pkts,
+                                                                         16, 24, order, top)
+
+                self.assertEqual(sentinels, expected_sentinels)
+                self.assertDictEqual(table.rules, {prefix: expected_rules[prefix] for prefix in expected_rules})
+
+        self.assertEqual(len(cache), 3)
+
+
+class TestPktArrays(unittest.TestCase):
+    def setUp(self):
+        self.pkts = [(ipv4_to_int('1.2.3.1'), '1.2.3.0/24', 1),
+                     (ipv4_to_int('1.2.3.2'), '1.2.3.0/24', 2),
+                     (ipv4_to_int('1.2.4.1'), '1.2.4.0/24', 2),
+                     (ipv4_to_int('10.0.0.1'), '10.0.0.0/24', 3)]
+        self.sentinels = [('1.2.0.0/16', 2), ('10.0.0.0/24', 3)]
+
+    def test_conversion(self):
+        pkts = to_pkt_array(self.pkts)
+
+        self.assertEqual(pkts.dtype, PKT_DTYPE)
+        self.assertListEqual(pkts.tolist(), [(ip, router) for ip, _, router in self.pkts])
+        self.assertIs(to_pkt_array(pkts), pkts)
+
+        self.assertListEqual(concat_pkts([self.pkts[:1], self.pkts[1:]]), self.pkts)
+        self.assertListEqual(concat_pkts([self.pkts[:1], pkts[1:]]).tolist(), pkts.tolist())
+        self.assertEqual(get_pkts_key(pkts[::-1]), get_pkts_key(self.pkts))
+
+    def test_consumers(self):
+        pkts = to_pkt_array(self.pkts)
+
+        self.assertEqual(get_prefix_counts(pkts), get_prefix_counts(self.pkts))
+        self.assertDictEqual(get_ground_truth(pkts), get_ground_truth(self.pkts))
+        self.assertDictEqual(enhance_sentinels(self.sentinels, pkts), enhance_sentinels(self.sentinels, self.pkts))
+        self.assertTrue(get_table(pkts).equals(get_table(self.pkts)))
+
+
+class TestCases(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+
+        # packets from a few /16 prefixes, routers depend on the /20 prefix
+        self.iterations = list()
+        for i in range(6):
+            src = (rng.choice([10, 20, 30], 500) << 24) + rng.integers(0, 2**20, 500)
+            routers = (src >> 12) % 3 + 1
+            pkts = [(int(ip), '{}.{}.{}.0/24'.format(ip >> 24, (ip >> 16) & 255, (ip >> 8) & 255), int(router))
+                    for ip, router in zip(src, routers)]
+            self.iterations.append((pkts, pkts[::10]))
+
+    def get_cases(self):
+        return [MirroringCase('top_5_activity_', 'activity', 5, 16, 24),
+                MirroringCase('top_5_size_', 'size', 5, 16, 24),
+                MirroringCase('full_', None, None, 16, 24)]
+
+    def run_cases(self, runner):
+        results = list()
+        sampled_pkts_n_1 = list()
+        sampled_pkts_n_2 = list()
+
+        for i, (pkts, sampled_pkts) in enumerate(self.iterations):
+            if i > 0:
+                gt_data = get_ground_truth(pkts) if i >= 3 else None
+                results.append(runner.run(i, pkts, gt_data, sampled_pkts_n_1, sampled_pkts_n_2))
+
+            sampled_pkts_n_2 = sampled_pkts_n_1
+            sampled_pkts_n_1 = sampled_pkts
+
+        runner.close()
+
+        return results
+
+    def test_workers(self):
+        expected = self.run_cases(CaseRunner(self.get_cases(), 16, 24))
+
+        # results are only available from iteration 3 onwards
+        self.assertListEqual([len(results) for results in expected], [3] * 5)
+        self.assertDictEqual(expected[0][0], dict())
+        self.assertEqual(len(expected[2][2]), 23)
+
+        for workers in [2, 3]:
+            self.assertListEqual(self.run_cases(CaseWorkers(self.get_cases(), workers, 16, 24)), expected)
+
+    def test_worker_failure(self):
+        original = MirroringCase.run
+
+        def run(case, *args):
+            if case.order == 'size':
+                raise ValueError('failed case')
+            return original(case, *args)
+
+        # the (forked) workers keep the patched method
+        with mock.patch.object(MirroringCase, 'run', run):
+            workers = CaseWorkers(self.get_cases(), 3, 16, 24)
+
+        pkts, sampled_pkts = self.iterations[0]
+        with self.assertRaisesRegex(RuntimeError, 'failed case'):
+            workers.run(1, pkts, None, sampled_pkts, list())
+
+        # the replies of the other workers are not left in the pipes
+        state = workers.get_state()
+        self.assertListEqual([case.suffix for case in state['cases']], ['top_5_activity_', 'top_5_size_', 'full_'])
+        workers.close()
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmp_dir.name, 'input.csv')
+
+        # preprocessed packets from a few /16 prefixes
+        rng = np.random.default_rng(2)
+        with open(self.input, 'w') as data_out:
+            for i in range(3000):
+                src = int(rng.choice([10, 20, 30]) << 24) + int(rng.integers(0, 2**20))
+                rnd = [int(rng.integers(1, n+1)) for n in [4, 8, 16, 32, 64]]
+                per = [(src >> 12) % n + 1 for n in [4, 8, 16, 32, 64]]
+                data_out.write('{:.3f},{},{}.{}.{}.0/24,{},{},{},{},{},{},{},{},{},{},{}\n'.format(
+                    1521119300 + i / 250, src, src >> 24, (src >> 16) & 255, (src >> 8) & 255,
+                    *rnd, *per, int(rng.random() < 0.1)))
+
+        self.configs = [
+            {'magnifier': 1, 'frequency': 16, 'border': 4, 'traffic': 1, 'amount': -1},
+            {'magnifier': 1, 'frequency': 32, 'border': 8, 'traffic': 0, 'amount': -1},
+            {'magnifier': 0, 'frequency': 16, 'border': 8, 'traffic': 1, 'amount': -1},
+        ]
+        for n, config in enumerate(self.configs):
+            config['outfile'] = os.path.join(self.tmp_dir.name, 'sweep_{}.csv'.format(n))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_sweep(self, pps, duration):
+        make_sim_sweep(self.input, self.configs, duration, pps, 16, 24, 6)
+
+        for n, config in enumerate(self.configs):
+            single_file = os.path.join(self.tmp_dir.name, 'single_{}.csv'.format(n))
+            if config['magnifier'] == 1:
+                make_sim_magnifier(self.input, single_file, config['frequency'], duration, pps, 16, 24, 6,
+                                   config['border'], config['traffic'] == 1, config['amount'],
+                                   sampling=config.get('sampling', 'systematic'))
+            else:
+                make_sim_everflow(self.input, single_file, config['frequency'], duration, pps, 16, 24, 6,
+                                  config['border'], config['traffic'] == 1, config['amount'],
+                                  sampling=config.get('sampling', 'systematic'))
+
+            with open(config['outfile'], 'r') as sweep_in, open(single_file, 'r') as single_in:
+                self.assertEqual(sweep_in.read(), single_in.read())
+
+    def test_sweep_real(self):
+        self.run_sweep(-1, 2)
+
+    def test_sweep_pps(self):
+        self.run_sweep(100, 4)
+
+    def test_sweep_random_sampling(self):
+        # each simulation has its own random number generator
+        for config, sampling in zip(self.configs, ['random_skip', 'bernoulli', 'random_skip']):
+            config['sampling'] = sampling
+        self.run_sweep(-1, 2)
+
+    def test_profile(self):
+        for config in self.configs:
+            config['profile'] = True
+        self.run_sweep(-1, 2)
+
+        # profiling does not change the results
+        expected = os.path.join(self.tmp_dir.name, 'expected.csv')
+        make_sim_magnifier(self.input, expected, 16, 2, -1, 16, 24, 6, 4, True, -1)
+        with open(expected, 'r') as expected_in, open(self.configs[0]['outfile'], 'r') as profiled_in:
+            self.assertEqual(expected_in.read(), profiled_in.read())
+        self.assertFalse(os.path.isfile(profile_file(expected)))
+
+        for config in self.configs:
+            with open(profile_file(config['outfile']), 'r') as data_in:
+                self.assertEqual(data_in.readline().strip(), ','.join(PROFILE_COLUMNS))
+                rows = [line.strip().split(',') for line in data_in]
+
+            stages = {(variant, stage) for _, variant, stage, _, _, _, _ in rows}
+            for stage in ['load', 'sample', 'ground_truth', 'sentinel', 'scoring']:
+                self.assertIn(('shared', stage), stages)
+
+            if config['magnifier'] == 1:
+                for stage in ['sentinel', 'rules', 'mirroring', 'scoring']:
+                    self.assertIn(('top_100_activity', stage), stages)
+                    self.assertIn(('full', stage), stages)
+            else:
+                self.assertEqual({variant for variant, _ in stages}, {'shared'})
+
+            # one load per iteration, scoring starts at i == 3
+            self.assertEqual(sum(1 for row in rows if row[2] == 'load'), 6)
+            self.assertEqual({row[0] for row in rows if row[1] == 'shared' and row[2] == 'scoring'}, {'3', '4', '5'})
+
+    def run_interrupted(self, run, crash):
+        """ runs a simulation which crashes at iteration crash, afterwards it is resumed """
+
+        def step(simulation, i, *args):
+            if i == crash:
+                raise RuntimeError('crash')
+            return original[type(simulation)](simulation, i, *args)
+
+        original = {cls: cls.step for cls in [MagnifierSimulation, EverflowSimulation]}
+        with mock.patch.object(MagnifierSimulation, 'step', step), mock.patch.object(EverflowSimulation, 'step', step):
+            with self.assertRaises(RuntimeError):
+                run(False)
+
+        run(True)
+
+    def test_resume(self):
+        # resuming a csv input requires the index
+        build_csv_index(self.input)
+
+        for workers in [1, 2]:
+            expected = os.path.join(self.tmp_dir.name, 'expected.csv')
+            make_sim_magnifier(self.input, expected, 16, 2, -1, 16, 24, 8, 4, True, -1)
+
+            outfile = os.path.join(self.tmp_dir.name, 'resumed.csv')
+
+            def run(resume):
+                # results are written after each iteration, the ones after the last checkpoint
+                # before the crash (after i == 3) are removed when resuming
+                if resume:
+                    with open(outfile, 'r') as data_in:
+                        self.assertSetEqual({line.split(',')[0] for line in list(data_in)[1:]}, {'3', '4'})
+                    self.assertTrue(os.path.isfile(checkpoint_file(outfile)))
+
+                make_sim_magnifier(self.input, outfile, 16, 2, -1, 16, 24, 8, 4, True, -1, workers=workers,
+                                   checkpoint=2, resume=resume)
+
+            self.run_interrupted(run, 5)
+
+            with open(expected, 'r') as expected_in, open(outfile, 'r') as resumed_in:
+                self.assertEqual(expected_in.read(), resumed_in.read())
+
+            # finished simulations remove their checkpoint
+            self.assertFalse(os.path.isfile(checkpoint_file(outfile)))
+
+    def test_resume_without_index(self):
+        # checkpoints of a csv input without index could not be resumed
+        outfile = os.path.join(self.tmp_dir.name, 'resumed.csv')
+        with self.assertRaisesRegex(FileNotFoundError, 'preprocess_pkt_csv.py -x'):
+            make_sim_magnifier(self.input, outfile, 16, 2, -1, 16, 24, 8, 4, True, -1, checkpoint=2)
+
+        self.assertFalse(os.path.isfile(outfile))
+        self.assertFalse(os.path.isfile(checkpoint_file(outfile)))
+
+    def test_resume_hash_seed(self):
+        # the top k sentinels must not depend on the hash seed of the process which resumes
+        build_csv_index(self.input)
+
+        def run_seed(outfile, seed, resume):
+            code = 'from simulation import make_sim_magnifier; make_sim_magnifier({!r}, {!r}, 16, 2, -1, 16, 24, 8, 4, True, -1, checkpoint=2, resume={})'
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            subprocess.run([sys.executable, '-c', code.format(self.input, outfile, resume)], env=env,
+                           cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+        expected = os.path.join(self.tmp_dir.name, 'expected.csv')
+        run_seed(expected, '1', False)
+
+        outfile = os.path.join(self.tmp_dir.name, 'resumed.csv')
+        self.run_interrupted(lambda resume: run_seed(outfile, '2', True) if resume else make_sim_magnifier(
+            self.input, outfile, 16, 2, -1, 16, 24, 8, 4, True, -1, checkpoint=2), 5)
+
+        with open(expected, 'r') as expected_in, open(outfile, 'r') as resumed_in:
+            self.assertEqual(expected_in.read(), resumed_in.read())
+
+    def test_resume_sweep(self):
+        for config, sampling in zip(self.configs, ['random_skip', 'systematic', 'bernoulli']):
+            config['sampling'] = sampling
+        make_sim_sweep(self.input, self.configs, 4, 100, 16, 24, 6)
+
+        expected = list()
+        for config in self.configs:
+            with open(config['outfile'], 'r') as data_in:
+                expected.append(data_in.read())
+
+        with tempfile.TemporaryDirectory() as store:
+            convert_csv(self.input, store)
+            build_store_index(store)
+
+            self.run_interrupted(lambda resume: make_sim_sweep(store, self.configs, 4, 100, 16, 24, 6,
+                                                               checkpoint=1, resume=resume), 4)
+
+        for config, results in zip(self.configs, expected):
+            with open(config['outfile'], 'r') as data_in:
+                self.assertEqual(data_in.read(), results)
+
+    def test_profile_workers(self):
+        # rows measured in the worker processes are collected by the main process
+        outfile = os.path.join(self.tmp_dir.name, 'workers.csv')
+        make_sim_magnifier(self.input, outfile, 16, 2, -1, 16, 24, 6, 4, True, -1, workers=2, profile=True)
+
+        with open(profile_file(outfile), 'r') as data_in:
+            variants = {line.split(',')[1] for line in list(data_in)[1:]}
+        self.assertEqual(len(variants), 1 + 8 + 1)
+
+    def test_profiler_disabled(self):
+        profiler = StageProfiler(False)
+        with profiler.stage(0, 'shared', 'load'):
+            pass
+        self.assertListEqual(profiler.pop_rows(), [])
+
+        profiler = StageProfiler()
+        with profiler.stage(0, 'shared', 'load'):
+            pass
+        rows = profiler.pop_rows()
+        self.assertEqual(len(rows), 1)
+        self.assertListEqual(list(rows[0][:3]), [0, 'shared', 'load'])
+        self.assertListEqual(profiler.pop_rows(), [])
+
+
+class TestResultWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.out_file = os.path.join(self.tmp_dir.name, 'results.csv')
+
+        self.results = [('shared', 'n_total_packets'), ('shared', 'iteration_end_ts'),
+                        ('full', 'prefix_correct_sampling'), ('full', 'prefix_correct_mirroring'),
+                        ('top_100_activity', 'prefix_correct_mirroring')]
+
+        self.iterations = [
+            {'n_total_packets': 100, 'iteration_end_ts': 1521119300.5, 'full_prefix_correct_sampling': 7,
+             'full_prefix_correct_mirroring': 9, 'top_100_activity_prefix_correct_mirroring': 5},
+            {'n_total_packets': 120, 'iteration_end_ts': 1521119302.75, 'full_prefix_correct_sampling': 8,
+             'full_prefix_correct_mirroring': 10, 'top_100_activity_prefix_correct_mirroring': 6},
+        ]
+
+        # same results in the previous layout
+        self.expected = {
+            'n_total_packets': [100, 120],
+            'iteration_end_ts': [0.0, 2.25],
+            'full_prefix_correct_sampling': [7, 8],
+            'full_prefix_correct_mirroring': [9, 10],
+            'top_100_activity_prefix_correct_mirroring': [5, 6],
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, writer, first=0):
+        for i, results in enumerate(self.iterations[first:], 3 + first):
+            writer.write(i, results)
+
+    def test_layout(self):
+        writer = ResultWriter(self.out_file, self.results)
+        writer.write(2, dict())
+        self.assertFalse(os.path.isfile(self.out_file))
+
+        self.write(writer)
+
+        # rows are flushed after each iteration
+        with open(self.out_file, 'r') as data_in:
+            lines = [line.strip() for line in data_in]
+        writer.close()
+
+        self.assertEqual(lines[0], ','.join(INDEX_COLUMNS + ['n_total_packets', 'iteration_end_ts',
+                                                             'prefix_correct_sampling', 'prefix_correct_mirroring']))
+        self.assertListEqual(lines[1:4], ['3,shared,100,0.0,,', '3,full,,,7,9', '3,top_100_activity,,,,5'])
+        self.assertEqual(len(lines), 7)
+
+    def test_read(self):
+        writer = ResultWriter(self.out_file, self.results)
+        self.write(writer)
+        writer.close()
+
+        self.assertDictEqual(read_data(self.out_file), self.expected)
+
+        # only the requested columns are read
+        self.assertDictEqual(read_data(self.out_file, ['prefix_correct_mirroring', 'unknown']), {
+            'full_prefix_correct_mirroring': [9, 10],
+            'top_100_activity_prefix_correct_mirroring': [5, 6],
+        })
+
+    def test_read_rows(self):
+        # files of older simulations have one row per result
+        rows_file = os.path.join(self.tmp_dir.name, 'rows.csv')
+        write_result_rows(rows_file, {name: [results[name] for results in self.iterations] for name in self.expected})
+
+        self.assertDictEqual(read_data(rows_file), self.expected)
+        self.assertDictEqual(read_data(rows_file, ['n_total_packets', 'prefix_correct_sampling']), {
+            'n_total_packets': [100, 120],
+            'full_prefix_correct_sampling': [7, 8],
+        })
+
+    def test_state(self):
+        writer = ResultWriter(self.out_file, self.results)
+        self.write(writer)
+        writer.close()
+        with open(self.out_file, 'r') as data_in:
+            expected = data_in.read()
+
+        writer = ResultWriter(self.out_file, self.results)
+        writer.write(3, self.iterations[0])
+        state = writer.get_state()
+        writer.write(4, {'n_total_packets': 1, 'iteration_end_ts': 1521119301.0})
+        writer.close()
+
+        # iterations written after the state are replaced
+        writer = ResultWriter(self.out_file, self.results)
+        writer.set_state(state)
+        self.write(writer, 1)
+        writer.close()
+
+        with open(self.out_file, 'r') as data_in:
+            self.assertEqual(data_in.read(), expected)
+
+
+class TestPlotData(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmp_dir.name, 'input.csv')
+
+        rng = np.random.default_rng(3)
+        with open(self.input, 'w') as data_out:
+            for i in range(2000):
+                src = int(rng.choice([10, 20, 30]) << 24) + int(rng.integers(0, 2**20))
+                rnd = [int(rng.integers(1, n+1)) for n in [4, 8, 16, 32, 64]]
+                data_out.write('{:.3f},{},{}.{}.{}.0/24,{},{},{},{},{},{},{},{},{},{},{}\n'.format(
+                    1521119300 + i / 200, src, src >> 24, (src >> 16) & 255, (src >> 8) & 255,
+                    *rnd, *rnd, int(rng.random() < 0.1)))
+
+        self.results = os.path.join(self.tmp_dir.name, 'results')
+        os.mkdir(self.results)
+        self.magnifier = os.path.join(self.results, 'b_4_l_1_d_2_f_16_m_1_t_0.csv')
+        self.everflow = os.path.join(self.results, 'b_4_l_1_d_2_f_16_m_0_t_0.csv')
+        make_sim_magnifier(self.input, self.magnifier, 16, 2, -1, 16, 24, 5, 4, False, -1)
+        make_sim_everflow(self.input, self.everflow, 16, 2, -1, 16, 24, 5, 4, False, -1)
+
+        # other files in the result folders are skipped
+        with open(os.path.join(self.results, 'b_4_l_1_d_2_f_16_m_1_t_0_profile.csv'), 'w') as data_out:
+            data_out.write(','.join(PROFILE_COLUMNS) + '\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_load_results(self):
+        results = load_results([self.results], 2)
+
+        self.assertListEqual(results.index.names, ['experiment', 'border', 'load', 'duration', 'frequency',
+                                                   'magnifier', 'traffic', 'variant', 'iteration'])
+        self.assertListEqual(list(results.columns), RESULT_COLUMNS)
+
+        magnifier = results.loc['b_4_l_1_d_2_f_16_m_1_t_0', 4, 1, 2, 16, 1, 0]
+        self.assertEqual(len(magnifier.index.unique('variant')), 1 + 8 + 1)
+        self.assertListEqual(magnifier.loc['shared', 'n_prefixes'].tolist(),
+                             read_data(self.magnifier)['n_prefixes'])
+
+        # results of older simulations with one row per result
+        rows = os.path.join(self.tmp_dir.name, 'rows')
+        os.mkdir(rows)
+        write_result_rows(os.path.join(rows, os.path.basename(self.magnifier)), read_data(self.magnifier))
+
+        rows_results = load_results([rows], 1)
+        self.assertTrue(rows_results.sort_index().equals(results.loc[['b_4_l_1_d_2_f_16_m_1_t_0']].sort_index()))
+
+    def test_plot_values(self):
+        values = get_plot_values(load_results([self.results], 1))
+        magnifier = read_data(self.magnifier)
+        everflow = read_data(self.everflow)
+
+        def get_value(name, variant, value):
+            return values.loc[(name, 4, 1, 2, 16, int(name[-5]), 0, variant), value]
+
+        # same averages as computed from the lists of each result
+        for name, data in [('b_4_l_1_d_2_f_16_m_1_t_0', magnifier), ('b_4_l_1_d_2_f_16_m_0_t_0', everflow)]:
+            self.assertAlmostEqual(get_value(name, 'full', 'coverage_sampling_prefix'), get_unique_coverage_average(
+                data['full_prefix_correct_sampling'], data['full_prefix_covered_not_unique_sampling'], data['n_prefixes']))
+            self.assertAlmostEqual(get_value(name, 'full', 'coverage_sentinel_sampling_packet'), get_unique_coverage_average(
+                data['full_pkt_covered_correct_sentinel'], data['full_pkt_covered_not_unique_sentinel'], data['n_total_packets']))
+
+        self.assertAlmostEqual(get_value('b_4_l_1_d_2_f_16_m_0_t_0', 'shared', 'mirrored_traffic_everflow'),
+                               get_average(everflow['n_mirrored_packets'], everflow['n_total_packets']))
+
+        name = 'b_4_l_1_d_2_f_16_m_1_t_0'
+        self.assertAlmostEqual(get_value(name, 'shared', 'active_prefix_space'), get_average(magnifier['n_prefixes']))
+        for suffix in ['full', 'top_100_activity', 'top_5000_size']:
+            self.assertAlmostEqual(get_value(name, suffix, 'mirrored_traffic_magnifier'), get_average(
+                magnifier[suffix + '_n_mirrored_packets_mirroring'], magnifier['n_total_packets']))
+            self.assertAlmostEqual(get_value(name, suffix, 'sentinels_added_mirroring'), get_average(
+                magnifier[suffix + '_n_sentinels_added_mirroring']))
+            self.assertAlmostEqual(get_value(name, suffix, 'verified_prefix_space'), get_prefix_space_average(
+                magnifier[suffix + '_prefix_correct_mirroring'], magnifier[suffix + '_prefix_covered_not_unique_mirroring'],
+                magnifier[suffix + '_prefix_not_active_mirroring']))
+
+    def test_duplicates(self):
+        # results available twice, the newer values are used
+        newer = os.path.join(self.tmp_dir.name, 'newer')
+        os.mkdir(newer)
+        shutil.copy(self.everflow, os.path.join(newer, os.path.basename(self.magnifier)))
+
+        with mock.patch('builtins.print'):
+            results = load_results([self.results, newer], 1)
+        merged = results.loc['b_4_l_1_d_2_f_16_m_1_t_0', 4, 1, 2, 16, 1, 0]
+
+        everflow = read_data(self.everflow)
+        self.assertListEqual(merged.loc['shared', 'n_mirrored_packets'].tolist(), everflow['n_mirrored_packets'])
+        self.assertListEqual(merged.loc['full', 'prefix_correct_sampling'].tolist(),
+                             everflow['full_prefix_correct_sampling'])
+
+        # results which are not in the newer file are kept
+        self.assertListEqual(merged.loc['top_100_activity', 'prefix_correct_mirroring'].tolist(),
+                             read_data(self.magnifier)['top_100_activity_prefix_correct_mirroring'])
+
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.config = {'frequency': 16, 'border': 4, 'persistent': True, 'duration': 1, 'pps': 5000,
+                       'start': 16, 'end': 24, 'top': 100, 'iteration': 5, 'prefixes': 1000, 'skew': 1.0,
+                       'multi': 0.1, 'flags': 0.05, 'seed': 1}
+
+    def test_generate_trace(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'trace')
+            generate_trace(path, 10000, n_prefixes=100, multi=0.5, csv_file=path + '.csv', seed=1)
+
+            store = load_pkt_store(path)
+            self.assertEqual(len(store['ts']), 10000)
+            self.assertTrue(np.all(np.diff(store['ts']) >= 0))
+            self.assertLessEqual(len(np.unique(store['src'] >> 8)), 100)
+
+            # persistent routers are the same for all packets of a prefix, random ones are not
+            n_per = len(np.unique((store['src'] >> 8).astype(np.int64) << 8 | store['per_4']))
+            n_rnd = len(np.unique((store['src'] >> 8).astype(np.int64) << 8 | store['rnd_4']))
+            self.assertEqual(n_per, len(np.unique(store['src'] >> 8)))
+            self.assertGreater(n_rnd, n_per)
+
+            with tempfile.TemporaryDirectory() as converted:
+                convert_csv(path + '.csv', converted)
+                for name, values in load_pkt_store(converted).items():
+                    self.assertListEqual(values.tolist(), store[name].tolist())
+
+    def test_benchmark(self):
+        results = benchmark([20000], self.config)
+
+        self.assertEqual(len(results['runs']), 1)
+        run = results['runs'][0]
+        self.assertEqual(run['n_pkts'], 20000)
+        self.assertEqual(run['iterations'], 4)
+        self.assertListEqual(list(run['stages']), STAGES)
+        self.assertGreater(run['peak_rss_mb'], 0)
+        for timing in run['stages'].values():
+            self.assertGreaterEqual(timing['ns_per_pkt'], 0)
+
+        # results are json serializable
+        results = json.loads(json.dumps(results))
+        self.assertListEqual(compare_results(results, results, 0.2), [])
+
+        slower = json.loads(json.dumps(results))
+        slower['runs'][0]['stages']['sample']['ns_per_pkt'] *= 2
+        self.assertListEqual([name for _, name, _, _ in compare_results(slower, results, 0.2)], ['sample'])
+
+
+class TestRunner(unittest.TestCase):
+    def setUp(self):
+        self.runs = [{'name': 'run_{}'.format(i), 'command': 'sleep 0.5', 'memory': 1} for i in range(3)]
+
+    def get_runtime(self, jobs, memory_limit):
+        start = datetime.now()
+        self.assertEqual(run_simulations(self.runs, jobs, memory_limit, start), 0)
+        return (datetime.now() - start).total_seconds()
+
+    def test_failed(self):
+        self.runs[1]['command'] = 'exit 3'
+        with self.assertLogs('runner', level='ERROR') as logs:
+            self.assertEqual(run_simulations(self.runs, 3, None, datetime.now()), 1)
+        self.assertIn('run_1 failed with exit code 3', logs.output[0])
+
+    def test_parallel(self):
+        self.assertLess(self.get_runtime(3, None), 1.0)
+
+    def test_memory_limit(self):
+        # only two runs fit at the same time
+        self.assertGreaterEqual(self.get_runtime(3, 2), 1.0)
+
+    def test_too_big(self):
+        # runs which do not fit at all run one after the other
+        self.assertGreaterEqual(self.get_runtime(3, 0), 1.5)
+
+    def test_sweeps(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result_path = Path(tmp_dir)
+            runs = [prepare_single_run(border, 1, pps, 1024, result_path, 1, 1)
+                    for pps in [100, 200] for border in [4, 8]]
+            sweeps = prepare_sweeps(runs, result_path)
+
+            # one sweep per pps value
+            self.assertEqual(len(sweeps), 2)
+            self.assertEqual(sweeps[0]['memory'], runs[0]['memory'] + runs[1]['memory'] - MEMORY_BASE)
+
+            with open(result_path / sweeps[1]['name'], 'r') as data_in:
+                self.assertListEqual(json.load(data_in), [runs[2]['config'], runs[3]['config']])
+
 
 class TestGtResults(unittest.TestCase):
     def setUp(self):
@@ -238,6 +1093,32 @@ class TestGtResults(unittest.TestCase):
         self.assertListEqual(list(lost_results),
                              self.expected_gt_mirroring_lost_result)
 
+    def test_gt_results_columns(self):
+        gt_data = get_ground_truth_data(self.pkts_gt)
+
+        self.assertListEqual(list(get_results_ground_truth(gt_data, self.sentinels)),
+                             self.expected_gt_result)
+        self.assertListEqual(list(get_results_ground_truth(gt_data, self.sentinels, True)),
+                             self.expected_gt_result_remove_invalid)
+        self.assertListEqual(list(get_results_ground_truth_sampling(gt_data, self.sampled)),
+                             self.expected_gt_sampling_result)
+
+        _, lost_results = get_results_ground_truth_invalidated_sentinels(self.sentinels, self.removed_sentinels, gt_data)
+        self.assertListEqual(list(lost_results), self.expected_gt_mirroring_lost_result)
+
+    def test_gt_results_large_sentinel(self):
+        gt_data = get_ground_truth_data(self.pkts_gt)
+
+        # the /8 covers 10.0.0.0/24 (wrong), all other 2**16 - 1 /24 prefixes are not active
+        results = get_results_ground_truth(gt_data, [('10.0.0.0/8', 1)])
+        self.assertListEqual(list(results[:4]), [0, 1, 2**16 - 1, 6])
+
+        # no sentinels and no samples at all
+        self.assertListEqual(list(get_results_ground_truth(gt_data, [])),
+                             [0, 0, 0, 7, 0, 3, 0, 0, 0, 0, 10, 6, 4])
+        self.assertListEqual(list(get_results_ground_truth_sampling(gt_data, [])),
+                             [0, 0, 7, 3, 0, 0, 10, 6, 0])
+
 
 class TestGetPkts(unittest.TestCase):
     def setUp(self):
@@ -673,6 +1554,360 @@ class TestGetPkts(unittest.TestCase):
         self.assertListEqual(pkts, self.expected_pps_pkts_persistent)
         self.assertListEqual(flags, self.expected_pps_flags_persistent)
 
+    def test_get_pkts_pps_preprocessed_mapping(self):
+        # mapping with the persistent assignment of the preprocessed file (per_8)
+        mapping = np.zeros(2**24, dtype=np.uint8)
+        with open(self.preprocessed_input_persistent, 'r') as f:
+            for line in f:
+                values = line.strip().split(',')
+                mapping[int(values[1]) >> 8] = int(values[9])
+
+        file_ptr = open(self.preprocessed_input_persistent, 'r')
+
+        pkts = list()
+        flags = list()
+        router_pkts = [[] for i in range(self.border)]
+
+        for i in range(self.pps_iterations_persistent):
+            start = i * self.duration_pps * self.pps
+            end = (i+1) * self.duration_pps * self.pps
+
+            current_pkts, _, current_flags, file_ptr, per_router, _ = get_preprocessed_pkts_mapping(file_ptr, start, end, False, self.border, mapping)
+            pkts.append(current_pkts)
+            flags.append(current_flags)
+            for j in range(self.border):
+                router_pkts[j].extend(per_router[j])
+
+        file_ptr.close()
+
+        self.assertListEqual(pkts, self.expected_pps_pkts_persistent)
+        self.assertListEqual(flags, self.expected_pps_flags_persistent)
+        for j in range(self.border):
+            self.assertListEqual(router_pkts[j], [pkt for current in pkts for pkt in current if pkt[2] == j + 1])
+
+        # prefixes which are not in the mapping are not assigned to any router
+        mapping[ipv4_to_int('10.10.10.0') >> 8] = 0
+        with open(self.preprocessed_input_persistent, 'r') as file_ptr:
+            with self.assertRaisesRegex(KeyError, '10.10.10.0/24'):
+                get_preprocessed_pkts_mapping(file_ptr, 0, 4, False, self.border, mapping)
+
+    def get_lists(self, src, timestamps, routers, flags, border_idx):
+        """ converts the packet arrays of an iteration to the lists of the expected results """
+
+        pkts = list(zip(src.tolist(), (ipv4_to_str_array((src >> 8) << 8) + '/24').tolist(), routers.tolist()))
+        flags = flags.astype(bool).tolist()
+
+        per_router = [[pkts[i] for i in idx.tolist()] for idx in border_idx]
+        per_router_flags = [[flags[i] for i in idx.tolist()] for idx in border_idx]
+
+        return (pkts, timestamps.tolist(), flags, per_router, per_router_flags)
+
+    def get_pkts_store(self, file_name, iterations, replay_real_speed, persistent):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            convert_csv(file_name, tmp_dir)
+            store = load_pkt_store(tmp_dir)
+            position = 0
+
+            router_pkts = [[] for i in range(self.border)]
+            pkts = list()
+            timestamps = list()
+            flags = list()
+            router_flags = [[] for i in range(self.border)]
+
+            for i in range(iterations):
+                if replay_real_speed:
+                    start = i * self.duration_real
+                    end = (i+1) * self.duration_real
+                else:
+                    start = i * self.duration_pps * self.pps
+                    end = (i+1) * self.duration_pps * self.pps
+
+                src, current_timestamps, routers, current_flags, position, border_idx = get_store_pkts(store, position, start, end, replay_real_speed, self.border, persistent)
+                current_pkts, current_timestamps, current_flags, per_router, per_router_flags = self.get_lists(src, current_timestamps, routers, current_flags, border_idx)
+                pkts.append(current_pkts)
+                for i in range(self.border):
+                    router_pkts[i].append(per_router[i])
+                    router_flags[i].append(per_router_flags[i])
+                timestamps.append(current_timestamps)
+                flags.append(current_flags)
+
+            del store
+
+        return (pkts, timestamps, flags, router_pkts, router_flags)
+
+    def test_get_pkts_real_store(self):
+        pkts, timestamps, flags, router_pkts, router_flags = self.get_pkts_store(self.preprocessed_input, self.real_iterations, True, False)
+
+        self.assertListEqual(pkts, self.expected_real_pkts_new)
+        self.assertListEqual(timestamps, self.expected_real_timestamps_new)
+        self.assertListEqual(flags, self.expected_real_flags_new)
+        self.assertListEqual(router_pkts, self.expected_real_per_router)
+        self.assertListEqual(router_flags, self.expected_real_per_router_flags)
+
+    def test_get_pkts_pps_store(self):
+        pkts, timestamps, flags, router_pkts, router_flags = self.get_pkts_store(self.preprocessed_input, self.pps_iterations, False, False)
+
+        self.assertListEqual(pkts, self.expected_pps_pkts_new)
+        self.assertListEqual(timestamps, self.expected_pps_timestamps_new)
+        self.assertListEqual(flags, self.expected_pps_flags_new)
+        self.assertListEqual(router_pkts, self.expected_pps_per_router)
+        self.assertListEqual(router_flags, self.expected_pps_per_router_flags)
+
+    def test_get_pkts_pps_store_persistent(self):
+        pkts, _, flags, _, _ = self.get_pkts_store(self.preprocessed_input_persistent, self.pps_iterations_persistent, False, True)
+
+        self.assertListEqual(pkts, self.expected_pps_pkts_persistent)
+        self.assertListEqual(flags, self.expected_pps_flags_persistent)
+
+    def get_pkts_columns(self, file_name, iterations, replay_real_speed, persistent):
+        router_pkts = [[] for i in range(self.border)]
+        pkts = list()
+        timestamps = list()
+        flags = list()
+        router_flags = [[] for i in range(self.border)]
+
+        file_ptr = open(file_name, 'r')
+
+        for i in range(iterations):
+            if replay_real_speed:
+                start = i * self.duration_real
+                end = (i+1) * self.duration_real
+            else:
+                start = i * self.duration_pps * self.pps
+                end = (i+1) * self.duration_pps * self.pps
+
+            columns, file_ptr = get_preprocessed_columns(file_ptr, start, end, replay_real_speed)
+            current_pkts, current_timestamps, current_flags, per_router, per_router_flags = self.get_lists(*get_column_pkts(columns, self.border, persistent))
+            pkts.append(current_pkts)
+            for i in range(self.border):
+                router_pkts[i].append(per_router[i])
+                router_flags[i].append(per_router_flags[i])
+            timestamps.append(current_timestamps)
+            flags.append(current_flags)
+
+        file_ptr.close()
+
+        return (pkts, timestamps, flags, router_pkts, router_flags)
+
+    def test_get_pkts_real_columns(self):
+        pkts, timestamps, flags, router_pkts, router_flags = self.get_pkts_columns(self.preprocessed_input, self.real_iterations, True, False)
+
+        self.assertListEqual(pkts, self.expected_real_pkts_new)
+        self.assertListEqual(timestamps, self.expected_real_timestamps_new)
+        self.assertListEqual(flags, self.expected_real_flags_new)
+        self.assertListEqual(router_pkts, self.expected_real_per_router)
+        self.assertListEqual(router_flags, self.expected_real_per_router_flags)
+
+    def test_get_pkts_pps_columns(self):
+        pkts, timestamps, flags, router_pkts, router_flags = self.get_pkts_columns(self.preprocessed_input, self.pps_iterations, False, False)
+
+        self.assertListEqual(pkts, self.expected_pps_pkts_new)
+        self.assertListEqual(timestamps, self.expected_pps_timestamps_new)
+        self.assertListEqual(flags, self.expected_pps_flags_new)
+        self.assertListEqual(router_pkts, self.expected_pps_per_router)
+        self.assertListEqual(router_flags, self.expected_pps_per_router_flags)
+
+    def test_get_pkts_store_columns(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            convert_csv(self.preprocessed_input, tmp_dir)
+            store = load_pkt_store(tmp_dir)
+
+            columns, position = get_store_columns(store, 0, 0, self.duration_real, True)
+            self.assertEqual(position, self.expected_real_timing_old[1])
+            self.assertTrue(np.shares_memory(columns['src'], store['src']))
+
+            pkts, timestamps, flags, router_pkts, router_flags = self.get_lists(*get_column_pkts(columns, self.border))
+            self.assertListEqual(pkts, self.expected_real_pkts_new[0])
+            self.assertListEqual(router_pkts, [per_router[0] for per_router in self.expected_real_per_router])
+
+            del store, columns
+
+    def test_get_pkts_store_views(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            convert_csv(self.preprocessed_input, tmp_dir)
+            store = load_pkt_store(tmp_dir)
+
+            src, timestamps, routers, flags, position, border_idx = get_store_pkts(store, 0, 0, self.duration_real, True, self.border)
+
+            # iteration columns are views on the store
+            self.assertTrue(np.shares_memory(src, store['src']))
+            self.assertEqual(position, self.expected_real_timing_old[1])
+            self.assertListEqual([src[idx].tolist() for idx in border_idx],
+                                 [[pkt[0] for pkt in per_router[0]] for per_router in self.expected_real_per_router])
+
+            # reading beyond the end of the trace returns no packets
+            src, _, _, _, position, border_idx = get_store_pkts(store, len(store['ts']), 0, self.duration_real, True, self.border)
+            self.assertEqual(len(src), 0)
+            self.assertEqual(position, len(store['ts']))
+
+            del store, src, timestamps, routers, flags, border_idx
+
+
+class TestPermutations(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.prefix_file = os.path.join(self.tmp_dir.name, 'prefixes.txt')
+
+        rng = np.random.default_rng(4)
+        self.prefixes = ['{}.{}.{}.0/24'.format(*rng.integers(0, 256, 3)) for _ in range(500)]
+        with open(self.prefix_file, 'w') as data_out:
+            data_out.write('\n'.join(self.prefixes + self.prefixes[:10]) + '\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_expected(self, percentage, n_routers, rng):
+        """ prefix: router mapping as a dict (one entry per prefix string) """
+
+        mapping = dict()
+        for prefix in self.prefixes:
+            mapping[prefix] = int(int(prefix.split('.')[0]) / (2**32 / n_routers) + 1)
+
+        selected_prefixes = rng.sample(list(mapping.items()), int(len(mapping) / 100 * percentage))
+        for n, (prefix, router) in enumerate(selected_prefixes):
+            mapping[prefix] = int((router + n % (n_routers - 1)) % n_routers + 1)
+
+        return mapping
+
+    def test_mapping(self):
+        for percentage, n_routers in [(0, 4), (10, 8), (60, 64)]:
+            expected_rng = random.Random('perm')
+            expected = self.get_expected(percentage, n_routers, expected_rng)
+
+            rng = random.Random('perm')
+            mapping = prepare_permutations(percentage, self.prefix_file, n_routers, rng)
+            self.assertEqual(len(mapping), 2**24)
+            self.assertEqual(np.count_nonzero(mapping), len(expected))
+
+            src = ipv4_to_int_array([prefix.split('/')[0] for prefix in expected]) + 7
+            self.assertListEqual(get_mapping_routers(mapping, src).tolist(), list(expected.values()))
+
+            # the generator continues the same way
+            self.assertEqual(rng.random(), expected_rng.random())
+
+    def test_cache(self):
+        cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        rng = random.Random('perm')
+        expected = prepare_permutations(10, self.prefix_file, 8, rng)
+        expected_next = rng.random()
+
+        for _ in range(2):
+            rng = random.Random('perm')
+            mapping = prepare_permutations(10, self.prefix_file, 8, rng, cache_dir)
+            self.assertTrue(np.array_equal(mapping, expected))
+            self.assertEqual(rng.random(), expected_next)
+        self.assertIsInstance(mapping, np.memmap)
+
+        # other percentages, routers or generator states are cached separately
+        prepare_permutations(20, self.prefix_file, 8, random.Random('perm'), cache_dir)
+        prepare_permutations(10, self.prefix_file, 4, random.Random('perm'), cache_dir)
+        prepare_permutations(10, self.prefix_file, 8, random.Random('other'), cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 2 * 4)
+
+        # ... and so are other prefix files
+        with open(self.prefix_file, 'a') as data_out:
+            data_out.write('1.2.3.0/24\n')
+        mapping = prepare_permutations(10, self.prefix_file, 8, random.Random('perm'), cache_dir)
+        self.assertEqual(mapping[ipv4_to_int('1.2.3.0') >> 8], 1)
+        self.assertEqual(len(os.listdir(cache_dir)), 2 * 5)
+
+    def test_unknown_prefix(self):
+        mapping = prepare_permutations(10, self.prefix_file, 8, random.Random('perm'))
+        unknown = [prefix for prefix in ['1.2.3.0/24', '4.5.6.0/24'] if prefix not in self.prefixes][0]
+
+        with self.assertRaises(KeyError):
+            get_mapping_routers(mapping, ipv4_to_int_array([self.prefixes[0].split('/')[0], unknown.split('/')[0]]))
+
+
+class TestIterationIndex(unittest.TestCase):
+    def setUp(self):
+        self.preprocessed_input = 'files_for_unittests/expected_preprocessed.csv'
+        self.border = 8
+        self.step = 5
+
+        # (duration, pps, number of iterations)
+        self.configurations = [(2, -1, 5), (1, -1, 8), (1, 4, 7), (2, 3, 5)]
+
+    def get_iterations_sequential(self, duration, pps, iterations):
+        file_ptr = open(self.preprocessed_input, 'r')
+
+        pkts = list()
+        for i in range(iterations):
+            if pps == -1:
+                start, end = i * duration, (i+1) * duration
+            else:
+                start, end = i * duration * pps, (i+1) * duration * pps
+
+            current_pkts, _, _, file_ptr, _, _ = get_preprocessed_pkts(file_ptr, start, end, pps == -1, self.border)
+            pkts.append(current_pkts)
+
+        file_ptr.close()
+
+        return pkts
+
+    def test_seek_csv(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'input.csv')
+            shutil.copy(self.preprocessed_input, file_name)
+            build_csv_index(file_name, self.step)
+            index = load_index(file_name)
+
+            for duration, pps, iterations in self.configurations:
+                expected = self.get_iterations_sequential(duration, pps, iterations)
+
+                for i in range(iterations):
+                    start, end = (0, duration) if pps == -1 else (0, duration * pps)
+
+                    with open(file_name, 'r') as file_ptr:
+                        file_ptr = seek_iteration(file_ptr, index, i, duration, pps)
+                        current_pkts, _, _, _, _, _ = get_preprocessed_pkts(file_ptr, start, end, pps == -1, self.border)
+
+                    self.assertListEqual(current_pkts, expected[i])
+
+    def test_seek_store(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            convert_csv(self.preprocessed_input, tmp_dir)
+            build_store_index(tmp_dir, self.step)
+            index = load_index(tmp_dir)
+            store = load_pkt_store(tmp_dir)
+
+            for duration, pps, iterations in self.configurations:
+                expected = self.get_iterations_sequential(duration, pps, iterations)
+
+                for i in range(iterations):
+                    start, end = (0, duration) if pps == -1 else (0, duration * pps)
+
+                    position = seek_iteration(store, index, i, duration, pps)
+                    src, _, routers, _, _, _ = get_store_pkts(store, position, start, end, pps == -1, self.border)
+
+                    self.assertListEqual(src.tolist(), [pkt[0] for pkt in expected[i]])
+                    self.assertListEqual(routers.tolist(), [pkt[2] for pkt in expected[i]])
+
+            del store
+
+    def test_csv_and_store_index(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'input.csv')
+            shutil.copy(self.preprocessed_input, file_name)
+            build_csv_index(file_name, self.step)
+
+            store_name = os.path.join(tmp_dir, 'store')
+            convert_csv(self.preprocessed_input, store_name)
+            build_store_index(store_name, self.step)
+
+            index_csv = load_index(file_name)
+            index_store = load_index(store_name)
+
+            self.assertEqual(index_csv['n_pkts'], 23)
+            self.assertEqual(index_csv['first_second'], 1521119300)
+            self.assertListEqual(index_csv['second_rows'].tolist(), [0, 4, 8, 16, 18, 20, 22, 23])
+            self.assertListEqual(index_csv['second_rows'].tolist(), index_store['second_rows'].tolist())
+
+            for duration, pps, iterations in self.configurations:
+                for i in range(iterations):
+                    self.assertEqual(get_iteration_row(index_csv, i, duration, pps),
+                                     get_iteration_row(index_store, i, duration, pps))
+
 
 class TestPktSampling(unittest.TestCase):
     def setUp(self):
@@ -750,6 +1985,120 @@ class TestPktSampling(unittest.TestCase):
         self.assertListEqual(sampled_pkts, self.expected_sampled_pkts)
         self.assertListEqual(all_to_sample, self.expected_to_sample)
 
+    def test_get_sampled_arrays(self):
+        file_ptr = open(self.file_name, 'r')
+        IP_SLICE = int(2**32 / self.border)
+
+        to_sample = list(self.to_sample)
+        for i in range(self.real_iterations):
+            start = i * self.duration_real
+            end = (i+1) * self.duration_real
+
+            current_pkts, _, current_flags, file_ptr, per_router, per_router_flags = get_pkts_efficient(file_ptr, start, end, IP_SLICE, True, self.border)
+            per_router = [to_pkt_array(pkts) for pkts in per_router]
+            per_router_flags = [np.array(flags, dtype=bool) for flags in per_router_flags]
+
+            sampled, to_sample = get_sampled_packets_per_router(per_router, per_router_flags, False, self.frequency, to_sample)
+            self.assertListEqual(sampled.tolist(), to_pkt_array(self.expected_sampled_pkts[i]).tolist())
+            self.assertListEqual(to_sample, [values[i] for values in self.expected_to_sample])
+
+        file_ptr.close()
+
+    def test_get_sampled_everflow_arrays(self):
+        file_ptr = open(self.file_name, 'r')
+        IP_SLICE = int(2**32 / self.border)
+
+        to_sample = list(self.to_sample)
+        for i in range(self.real_iterations):
+            start = i * self.duration_real
+            end = (i+1) * self.duration_real
+
+            current_pkts, _, current_flags, file_ptr, per_router, per_router_flags = get_pkts_efficient(file_ptr, start, end, IP_SLICE, True, self.border)
+            per_router = [to_pkt_array(pkts) for pkts in per_router]
+            per_router_flags = [np.array(flags, dtype=bool) for flags in per_router_flags]
+
+            sampled, to_sample, n_flags, n_random = get_sampled_packets_everflow(to_pkt_array(current_pkts), np.array(current_flags, dtype=bool),
+                                                                                 per_router, per_router_flags, self.frequency, to_sample)
+            self.assertListEqual(sampled.tolist(), to_pkt_array(self.expected_sampled_pkts_everflow[i]).tolist())
+            self.assertEqual(n_flags, self.expected_n_flags[i])
+            self.assertEqual(n_random, self.expected_n_random[i])
+
+        file_ptr.close()
+
+    def test_get_sampled_indices(self):
+        file_ptr = open(self.file_name, 'r')
+        IP_SLICE = int(2**32 / self.border)
+
+        to_sample = list(self.to_sample)
+        to_sample_everflow = list(self.to_sample)
+        for i in range(self.real_iterations):
+            start = i * self.duration_real
+            end = (i+1) * self.duration_real
+
+            current_pkts, _, current_flags, file_ptr, per_router, per_router_flags = get_pkts_efficient(file_ptr, start, end, IP_SLICE, True, self.border)
+            pkts = to_pkt_array(current_pkts)
+            flags = np.array(current_flags, dtype=bool)
+            border_idx = [np.flatnonzero(pkts['router'] == router) for router in range(1, self.border+1)]
+
+            sampled_idx, to_sample = get_sampled_indices_per_router(border_idx, None, self.frequency, to_sample)
+            self.assertListEqual(pkts[sampled_idx].tolist(), to_pkt_array(self.expected_sampled_pkts[i]).tolist())
+            self.assertListEqual(to_sample, [values[i] for values in self.expected_to_sample])
+
+            # flags are skipped (everflow)
+            random_idx, to_sample_everflow = get_sampled_indices_per_router(border_idx, flags, self.frequency, to_sample_everflow)
+            sampled = np.concatenate([pkts[flags], pkts[random_idx]])
+            self.assertListEqual(sampled.tolist(), to_pkt_array(self.expected_sampled_pkts_everflow[i]).tolist())
+            self.assertEqual(len(random_idx), self.expected_n_random[i])
+
+        file_ptr.close()
+
+    def test_flag_packets(self):
+        columns = {'flag': np.array([0, 1, 1, 0, 1, 0], dtype=np.uint8)}
+        flag_idx = get_flag_index(columns)
+        self.assertListEqual(flag_idx.tolist(), [1, 2, 4])
+
+        pkts = make_pkt_array(np.arange(6, dtype=np.uint32), np.array([1, 2, 2, 3, 4, 4], dtype=np.uint16))
+        flag_pkts, router_counts = get_flag_packets(pkts, flag_idx, 4)
+        self.assertListEqual(flag_pkts.tolist(), [(1, 2), (2, 2), (4, 4)])
+        self.assertListEqual(router_counts.tolist(), [0, 2, 0, 1])
+
+        # everflow mirroring, same packets for lists and packet arrays
+        pkt_list = [(ip, None, router) for ip, router in pkts.tolist()]
+        flags = columns['flag'].astype(bool)
+        for frequency in [1, 2, 4]:
+            random.seed(frequency)
+            expected = get_mirrored_packets_everflow(pkt_list, frequency, flags.tolist())
+            random.seed(frequency)
+            mirrored = get_mirrored_packets_everflow(pkts, frequency, flags)
+
+            self.assertListEqual(mirrored.tolist(), [(ip, router) for ip, _, router in expected])
+            self.assertListEqual([ip for ip, _, _ in expected[:3]], [1, 2, 4])
+
+    def test_sample_positions_random(self):
+        rng = np.random.default_rng(5)
+
+        for mode in ['bernoulli', 'random_skip']:
+            n_sampled = 0
+            location = 3
+            for n_pkts in [0, 1, 1000, 100000]:
+                positions, location = get_sample_positions(n_pkts, 64, location, mode, rng)
+
+                self.assertTrue(np.all(np.diff(positions) > 0))
+                self.assertTrue(np.all((positions >= 0) & (positions < n_pkts)))
+                self.assertGreaterEqual(location, 0)
+                n_sampled += len(positions)
+
+            # on average one in 64 packets is sampled
+            self.assertAlmostEqual(n_sampled / 101001, 1 / 64, delta=0.002)
+
+        # the remaining gap is carried over
+        positions, location = get_sample_positions(10, 64, 30, 'random_skip', rng)
+        self.assertEqual(len(positions), 0)
+        self.assertEqual(location, 20)
+
+        with self.assertRaises(ValueError):
+            get_sample_positions(10, 64, 0, 'unknown', rng)
+
     def test_get_sampled_everflow(self):
         file_ptr = open(self.file_name, 'r')
         IP_SLICE = int(2**32 / self.border)
@@ -825,20 +2174,189 @@ class TestSentinelExport(unittest.TestCase):
             os.remove(self.out_file)
 
 
-# class TestPktPreprocessing(unittest.TestCase):
-#     def setUp(self):
-#         self.expected = 'files_for_unittests/expected_preprocessed.csv'
-#         self.raw = 'files_for_unittests/default.csv'
-#         self.output = 'test_preprocess.csv'
+class TestPktPreprocessing(unittest.TestCase):
+    def setUp(self):
+        self.expected = 'files_for_unittests/expected_preprocessed.csv'
+        self.raw = 'files_for_unittests/default.csv'
+        self.output = 'test_preprocess.csv'
+
+    def test_preprocess(self):
+        preprocess(self.raw, self.output)
+
+        with io.open(self.expected) as f_expected, io.open(self.output) as f_out:
+            self.assertListEqual(list(f_expected), list(f_out))
+
+        for file_name in [self.output, index_file(self.output)]:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+    def test_preprocess_parallel(self):
+        # small chunks -> the first packet of most prefixes is in another chunk
+        for chunk_bytes in [1, 200, 10**6]:
+            preprocess_parallel(self.raw, self.output, processes=2, chunk_bytes=chunk_bytes)
+
+            with io.open(self.expected) as f_expected, io.open(self.output) as f_out:
+                self.assertListEqual(list(f_expected), list(f_out))
+
+            self.assertEqual(load_index(self.output)['n_pkts'], 23)
+
+            for file_name in [self.output, index_file(self.output)]:
+                if os.path.isfile(file_name):
+                    os.remove(file_name)
+
+    def test_chunk_offsets(self):
+        size = os.path.getsize(self.raw)
+        for chunk_bytes in [1, 100, size, 2 * size]:
+            chunks = get_chunk_offsets(self.raw, chunk_bytes)
+
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], size)
+
+            with open(self.raw, 'rb') as data_in:
+                data = data_in.read()
+
+            lines = 0
+            for start, end in chunks:
+                self.assertTrue(data[start:end].endswith(b'\n'))
+                lines += data[start:end].count(b'\n')
+            self.assertEqual(lines, data.count(b'\n'))
 
-#     def test_sentinel_export(self):
-#         preprocess(self.raw, self.output)
 
-#         with io.open(self.expected) as f_expected, io.open(self.output) as f_out:
-#             self.assertListEqual(list(f_expected), list(f_out))
+class TestIpConversion(unittest.TestCase):
+    def test_ipv4_to_int_array(self):
+        ips = ['1.2.3.4', '255.255.255.255', '0.0.0.0', '10.200.3.17', '192.168.1.1']
 
-#         if os.path.isfile(self.output):
-#             os.remove(self.output)
+        self.assertListEqual(ipv4_to_int_array(ips).tolist(), [ipv4_to_int(ip) for ip in ips])
+        self.assertListEqual(ipv4_to_int_array([ip.encode() for ip in ips]).tolist(), [ipv4_to_int(ip) for ip in ips])
+        self.assertEqual(ipv4_to_int_array(np.array(ips, dtype=object)).dtype, np.uint32)
+        self.assertEqual(len(ipv4_to_int_array([])), 0)
+
+        for invalid in ['1.2.3', '1.2.3.4.5', '1.2.3.256', 'a.b.c.d', '', '1..3.4', '1.2.3.', '1.2.3.-4', '1.2.3.4444444444']:
+            with self.assertRaises(ValueError):
+                ipv4_to_int_array(['1.2.3.4', invalid])
+
+
+    def test_ipv4_to_str_array(self):
+        ips = [ipv4_to_int(ip) for ip in ['1.2.3.4', '255.255.255.255', '0.0.0.0', '10.200.3.17']]
+
+        self.assertListEqual(ipv4_to_str_array(ips).tolist(), ['1.2.3.4', '255.255.255.255', '0.0.0.0', '10.200.3.17'])
+        self.assertListEqual((ipv4_to_str_array(np.array([ips[0] >> 8]) << 8) + '/24').tolist(), ['1.2.3.0/24'])
+        self.assertEqual(len(ipv4_to_str_array([])), 0)
+
+    def test_get_24_prefixes(self):
+        self.assertListEqual(get_24_prefixes('1.2.0.0/22'), ['1.2.0.0/24', '1.2.1.0/24', '1.2.2.0/24', '1.2.3.0/24'])
+        self.assertListEqual(get_24_prefixes('1.2.3.0/24'), ['1.2.3.0/24'])
+        self.assertEqual(len(get_24_prefixes('10.0.0.0/8')), 2**16)
+        self.assertEqual(get_24_prefixes('10.0.0.0/8')[-1], '10.255.255.0/24')
+
+
+class TestPktStore(unittest.TestCase):
+    def setUp(self):
+        self.expected = 'files_for_unittests/expected_preprocessed.csv'
+        self.raw = 'files_for_unittests/default.csv'
+        self.border = 8
+
+        self.expected_columns = {'ts': [], 'src': [], 'rnd_8': [], 'per_8': [], 'flag': []}
+        with open(self.expected, 'r') as data_in:
+            for line in data_in:
+                cells = line.strip().split(',')
+                self.expected_columns['ts'].append(float(cells[0]))
+                self.expected_columns['src'].append(int(cells[1]))
+                self.expected_columns['rnd_8'].append(int(cells[4]))
+                self.expected_columns['per_8'].append(int(cells[9]))
+                self.expected_columns['flag'].append(int(cells[13]))
+
+    def check_store(self, path):
+        store = load_pkt_store(path)
+        for name, values in self.expected_columns.items():
+            self.assertListEqual(store[name].tolist(), values)
+
+        self.assertListEqual(store[router_column(self.border, False)].tolist(), self.expected_columns['rnd_8'])
+        self.assertListEqual(store[router_column(self.border, True)].tolist(), self.expected_columns['per_8'])
+
+    def test_preprocess_binary(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            preprocess_binary(self.raw, tmp_dir, chunk_size=5)
+            self.check_store(tmp_dir)
+
+    def test_preprocess_parallel_binary(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            preprocess_parallel(self.raw, tmp_dir, binary=True, processes=2, chunk_bytes=200)
+            self.check_store(tmp_dir)
+
+    def test_convert_csv(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            convert_csv(self.expected, tmp_dir, chunk_size=5)
+            self.check_store(tmp_dir)
+
+    def write_pcap(self, outfile, byte_order='<', nanoseconds=False, linktype=1, vlan=False):
+        """ writes the packets of the raw tshark csv file as pcap trace """
+
+        magic = 0xa1b23c4d if nanoseconds else 0xa1b2c3d4
+        records = [struct.pack(byte_order + 'IHHiIII', magic, 2, 4, 0, 0, 65535, linktype)]
+
+        with open(self.raw, 'r') as data_in:
+            for line in data_in:
+                ts, src, dst, _, sport, dport, syn, fin, rst = line.strip().split(',')[:9]
+                sec, ms = ts.split('.')
+
+                if dst:
+                    flags = int(syn) << 1 | int(fin) | int(rst) << 2
+                    # ipv4 header with options (ihl 6) and tcp header without payload
+                    ip = struct.pack('>BBHHHBBHII4x', 0x46, 0, 48, 0, 0, 64, 6, 0, ipv4_to_int(src), ipv4_to_int(dst))
+                    ip += struct.pack('>HHIIBBHHH', int(sport), int(dport), 0, 0, 0x50, flags, 0, 0, 0)
+                    ethertype = 0x0800
+                else:
+                    # packets without IPv4 header are skipped (e.g., IPv6)
+                    ip = struct.pack('>IHBB16s16s', 0x60000000, 0, 59, 64, bytes(16), bytes(16))
+                    ethertype = 0x86dd
+
+                if linktype == 1:
+                    frame = bytes(12)
+                    if vlan:
+                        frame += struct.pack('>HH', 0x8100, 100)
+                    frame += struct.pack('>H', ethertype) + ip
+                else:
+                    frame = ip
+
+                frac = int(ms) * 10**6 if nanoseconds else int(ms) * 10**3
+                records.append(struct.pack(byte_order + 'IIII', int(sec), frac, len(frame), len(frame)) + frame)
+
+        # truncated last record
+        records.append(records[-1][:30])
+
+        opener = gzip.open if outfile.endswith('.gz') else open
+        with opener(outfile, 'wb') as data_out:
+            data_out.write(b''.join(records))
+
+    def test_preprocess_pcap(self):
+        formats = [
+            ('trace.pcap', {}),
+            ('trace.pcap.gz', {}),
+            ('trace.pcap', {'byte_order': '>', 'nanoseconds': True}),
+            ('trace.pcap.gz', {'linktype': 101}),
+            ('trace.pcap', {'vlan': True}),
+        ]
+
+        for name, options in formats:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                trace = os.path.join(tmp_dir, name)
+                self.write_pcap(trace, **options)
+
+                for block_size in [100, 10**6]:
+                    store = os.path.join(tmp_dir, 'store_{}'.format(block_size))
+                    preprocess_pcap(trace, store, block_size=block_size)
+                    self.check_store(store)
+                    self.assertEqual(load_index(store)['n_pkts'], 23)
+
+    def test_preprocess_pcap_invalid(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            trace = os.path.join(tmp_dir, 'trace.pcapng')
+            with open(trace, 'wb') as data_out:
+                data_out.write(struct.pack('<IIIHHq', 0x0a0d0d0a, 28, 0x1a2b3c4d, 1, 0, -1))
+
+            with self.assertRaises(ValueError):
+                preprocess_pcap(trace, os.path.join(tmp_dir, 'store'))
 
 
 class TestEnhanceSentinels(unittest.TestCase):
@@ -872,6 +2390,11 @@ class TestEnhanceSentinels(unittest.TestCase):
         sentinel_dict = enhance_sentinels(self.sentinel, self.pkt)
         self.assertDictEqual(sentinel_dict, self.expected)
 
+    def test_enhance_sentinel_counts(self):
+        prefix_counts = [get_prefix_counts(self.pkt[:5]), get_prefix_counts(self.pkt[5:])]
+        sentinel_dict = enhance_sentinels_counts(self.sentinel, prefix_counts)
+        self.assertDictEqual(sentinel_dict, self.expected)
+
 
 class TestOrderSentinels(unittest.TestCase):
     def setUp(self):
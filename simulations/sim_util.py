@@ -1,14 +1,19 @@
 """ Utility functions for simulations
 """
 
-from common.ip_conversion import ipv4_to_str, ipv4_to_int
-from common.find_sentinels import Sentinel
+from common.ip_conversion import ipv4_to_str, ipv4_to_int, ipv4_to_int_array, ipv4_to_str_array
+from common.find_sentinels import search_sentinels, SentinelWindow
 import numpy as np
 import pandas as pd
-from collections import defaultdict
+from collections import defaultdict, Counter
 import pytricia
 
 
+# compact packet record (the /24 prefix is src >> 8)
+# used instead of lists of (src IP as int, /24 prefix, router) tuples
+PKT_DTYPE = np.dtype([('src', '<u4'), ('router', '<u2')])
+
+
 # no longer used
 def prepare_ingress_routers(n):
     """ Prepare values to figure out over which ingress a packet would enter our network
@@ -57,31 +62,35 @@ def get_24_prefixes(prefix):
     # iterate current INT value + 256 up to ...
     ip, size = prefix.split('/')
     ip_int = ipv4_to_int(ip)
-    prefixes_24 = list()
-    for i in range(2**(24-int(size))):
-        new_ip = ip_int + i*256
-        prefixes_24.append(ipv4_to_str(new_ip)+'/24')
+    new_ips = ip_int + 256 * np.arange(2**(24-int(size)), dtype=np.int64)
 
-    return prefixes_24
+    return (ipv4_to_str_array(new_ips) + '/24').tolist()
 
 
+# no longer used
 def get_table(pkts):
     """ Returns table useable by sentinel search
 
-    pkts (list):
-        list of packets to convert to table
+    pkts (list or array):
+        list of packets (or packet array) to convert to table
 
     returns:
         table as pandas dataframe
     """
-    new_list = list()
-    for src_ip, prefix, router in pkts:
-        new_list.append((router, src_ip, 1))
-
     column_type = [('router_ip', 'uint32'), ('src_ip', 'uint32'),
                    ('pkts', 'uint32')]
 
-    arr = np.array(new_list, dtype=column_type)
+    if is_pkt_array(pkts):
+        arr = np.ones(len(pkts), dtype=column_type)
+        arr['router_ip'] = pkts['router']
+        arr['src_ip'] = pkts['src']
+    else:
+        new_list = list()
+        for src_ip, prefix, router in pkts:
+            new_list.append((router, src_ip, 1))
+
+        arr = np.array(new_list, dtype=column_type)
+
     table = pd.DataFrame.from_records(arr)
 
     return table
@@ -91,12 +100,15 @@ def enhance_sentinels(sentinels, pkts):
     """ Enhances sentinels with size and activity counter
 
     sentinels (list): current sentinels
-    pkts (list): pkts of current iteration
+    pkts (list or array): pkts of current iteration
 
     returns
         dict {sentinel: (router, pkt count, size)}
     """
 
+    if is_pkt_array(pkts):
+        return enhance_sentinels_counts(sentinels, [get_prefix_counts(pkts)])
+
     sentinel_dict = dict()
     tree = pytricia.PyTricia()
 
@@ -113,6 +125,50 @@ def enhance_sentinels(sentinels, pkts):
     return sentinel_dict
 
 
+def get_prefix_counts(pkts):
+    """ Counts packets per /24 prefix
+
+    pkts (list or array): list of packets or packet array
+
+    returns
+        Counter {/24 prefix: pkt count}
+    """
+
+    if is_pkt_array(pkts):
+        keys, counts = np.unique(pkts['src'] >> 8, return_counts=True)
+        return Counter({ipv4_to_str(int(key) << 8)+'/24': int(count) for key, count in zip(keys, counts)})
+
+    return Counter(prefix for _, prefix, _ in pkts)
+
+
+def enhance_sentinels_counts(sentinels, prefix_counts):
+    """ Enhances sentinels with size and activity counter
+    Same result as enhance_sentinels but based on already counted packets
+
+    sentinels (list): current sentinels
+    prefix_counts (list): Counters from get_prefix_counts, all of them are considered
+
+    returns
+        dict {sentinel: (router, pkt count, size)}
+    """
+
+    sentinel_dict = dict()
+    tree = pytricia.PyTricia()
+
+    for prefix, router in sentinels:
+        _, size = prefix.split('/')
+        sentinel_dict[prefix] = [router, 0, int(size)]
+        tree[prefix] = router
+
+    for counts in prefix_counts:
+        for prefix, count in counts.items():
+            match = tree.get_key(prefix)
+            if match:
+                sentinel_dict[match][1] += count
+
+    return sentinel_dict
+
+
 def order_sentinels(sentinels, criteria):
     """ Orders sentinels based on a criteria
 
@@ -128,20 +184,135 @@ def order_sentinels(sentinels, criteria):
     for key, value in sentinels.items():
         temp.append((key, value[0], value[1], value[2]))
 
+    # ties are broken by the prefix IP (the order of the sentinel dict depends on set
+    # iteration, i.e., on the hash seed, and a resumed run has to cut the same top k)
+    ips = ipv4_to_int_array([key.split('/')[0] for key, _, _, _ in temp]).tolist()
+    temp = [sentinel + (ip,) for sentinel, ip in zip(temp, ips)]
+
     if criteria == 'activity':
-        temp.sort(key=lambda X: X[2], reverse=True)
+        temp.sort(key=lambda X: (-X[2], X[4]))
     elif criteria == 'size':
-        temp.sort(key=lambda X: X[3])
+        temp.sort(key=lambda X: (X[3], X[4]))
+    else:
+        temp.sort(key=lambda X: X[4])
 
-    ordered = [(sentinel, router) for sentinel, router, _, _ in temp]
+    ordered = [(sentinel, router) for sentinel, router, _, _, _ in temp]
     return ordered
 
 
+def get_sentinel_set(found_sentinels):
+    """ Converts found sentinels to prefixes
+
+    found_sentinels (dict):
+        sentinel IP -> (size, router), as returned by search_sentinels
+
+    returns:
+        set (prefix, router) of found sentinels with corresponding router
+    """
+
+    # same intermediate set as returned by Sentinel.sentinel_search
+    found_sentinels = {(ip, size, router) for ip, (size, router) in found_sentinels.items()}
+
+    # sentinels = list()
+    sentinels = set()
+    for ip, size, router in found_sentinels:
+        prefix = ipv4_to_str(ip)+'/'+str(size)
+        sentinels.add((prefix, router))
+
+    return sentinels
+
+
+def make_pkt_array(src, routers):
+    """ Creates a packet array (see PKT_DTYPE)
+
+    src (array): src IPs as int
+    routers (array): ingress routers
+
+    returns: structured array with one record per packet
+    """
+
+    pkts = np.empty(len(src), dtype=PKT_DTYPE)
+    pkts['src'] = src
+    pkts['router'] = routers
+
+    return pkts
+
+
+def is_pkt_array(pkts):
+    """ Checks if packets are given as packet array (or as list of tuples)
+
+    pkts (list or array): packets
+
+    returns: True for packet arrays
+    """
+
+    return isinstance(pkts, np.ndarray)
+
+
+def to_pkt_array(pkts):
+    """ Converts packets to a packet array
+
+    pkts (list or array): packets, either a packet array or a list of (src IP as int, /24 prefix, router)
+
+    returns: packet array (the same object if it is one already)
+    """
+
+    if is_pkt_array(pkts):
+        return pkts
+
+    return make_pkt_array(*get_pkt_arrays(pkts))
+
+
+def concat_pkts(pkts_list):
+    """ Concatenates packets of several iterations (same as + for lists)
+
+    pkts_list (list): packets (lists or packet arrays)
+
+    returns: packet array if at least one of them is a packet array, list otherwise
+    """
+
+    if not any(is_pkt_array(pkts) for pkts in pkts_list):
+        return [pkt for pkts in pkts_list for pkt in pkts]
+
+    return np.concatenate([to_pkt_array(pkts) for pkts in pkts_list])
+
+
+def get_pkt_arrays(pkts):
+    """ Returns source IPs and routers of packets as arrays
+
+    pkts (list or array):
+        list of packets or packet array
+
+    returns: (ips, routers)
+    """
+
+    if is_pkt_array(pkts):
+        return pkts['src'].astype(np.int64), pkts['router'].astype(np.int64)
+
+    ips = np.fromiter((src_ip for src_ip, _, _ in pkts), dtype=np.int64, count=len(pkts))
+    routers = np.fromiter((router for _, _, router in pkts), dtype=np.int64, count=len(pkts))
+
+    return ips, routers
+
+
+def get_pkts_key(pkts):
+    """ Returns a hashable key which is equal for the same packets (in any order)
+
+    pkts (list or array): packets
+
+    returns: bytes
+    """
+
+    ips, routers = get_pkt_arrays(pkts)
+
+    return np.sort((ips << 16) | routers).tobytes()
+
+
 def get_sentinels(samples, start, end):
     """ Returns found sentinels
 
-    samples (list);
-        list of packets to use for the sentinel search
+    samples (list or array);
+        packets to use for the sentinel search
     start (int):
         sentinel search prefix start size
     end (int):
@@ -151,22 +322,72 @@ def get_sentinels(samples, start, end):
         list (prefix, router) of found sentinels with corresponding router
     """
 
-    # Load samples as dataframe
-    table = get_table(samples)
+    ips, routers = get_pkt_arrays(samples)
 
-    search = Sentinel()
-    search.t_in = table.copy()
-    search.aggregate(['src_ip', 'router_ip'], {'pkts': 'sum'})
-    found_sentinels = search.sentinel_search(True, 'src_ip', 'check', 'router_ip', start=32-start, end=32-end)
-    search.clean()
+    # same search as Sentinel.sentinel_search on the aggregated (src_ip, router_ip) table
+    found_sentinels, _, _ = search_sentinels(ips, routers, start=32-start, end=32-end)
 
-    # sentinels = list()
-    sentinels = set()
-    for ip, size, router in found_sentinels:
-        prefix = ipv4_to_str(ip)+'/'+str(size)
-        sentinels.add((prefix, router))
+    return get_sentinel_set(found_sentinels)
 
-    return sentinels
+
+def get_sentinel_window(size, start, end):
+    """ Returns an empty sliding window for incremental sentinel searches
+
+    size (int):
+        number of packet batches (iterations) in the window
+    start (int):
+        sentinel search prefix start size
+    end (int):
+        sentinel search prefix end size
+
+    returns:
+        SentinelWindow
+    """
+
+    return SentinelWindow(size, start=32-start, end=32-end)
+
+
+def update_sentinel_window(window, pkts):
+    """ Adds the packets of one iteration to a sentinel window
+    (the oldest iteration expires once the window is full)
+
+    window (SentinelWindow):
+        window from get_sentinel_window
+    pkts (list or array):
+        packets of the new iteration
+    """
+
+    window.push(*get_pkt_arrays(pkts))
+
+
+def get_merged_window_sentinels(window, other):
+    """ Returns found sentinels of all packets in two sentinel windows
+    Same result as get_sentinels on all packets in both windows
+
+    window (SentinelWindow):
+        window from get_sentinel_window
+    other (SentinelWindow):
+        window with the same prefix sizes, should contain fewer packets
+
+    returns:
+        list (prefix, router) of found sentinels with corresponding router
+    """
+
+    return get_sentinel_set(window.get_merged_sentinels(other))
+
+
+def get_window_sentinels(window):
+    """ Returns found sentinels of all packets in a sentinel window
+    Same result as get_sentinels on all packets in the window
+
+    window (SentinelWindow):
+        window from get_sentinel_window
+
+    returns:
+        list (prefix, router) of found sentinels with corresponding router
+    """
+
+    return get_sentinel_set(window.get_sentinels())
 
 
 def get_result_string(data):
@@ -192,11 +413,12 @@ def gt_init():
     }
 
 
+# no longer used
 def get_ground_truth(pkts):
     """ Gets ground truth data
 
-    pkts (list):
-        list of packets (in n)
+    pkts (list or array):
+        list of packets (in n) or packet array
 
     returns:
         dict of sets (key = /24 prefix, set = observed ingress points)
@@ -204,6 +426,10 @@ def get_ground_truth(pkts):
 
     gt_data = defaultdict(gt_init)
 
+    if is_pkt_array(pkts):
+        gt_data.update(get_ground_truth_data(pkts).as_dict())
+        return gt_data
+
     for src_ip, prefix, router in pkts:
         gt_data[prefix]['ingress_router'].add(router)
         gt_data[prefix]['pkt_count'] += 1
@@ -211,6 +437,140 @@ def get_ground_truth(pkts):
     return gt_data
 
 
+class GroundTruth:
+    """ Ground truth data of an iteration as sorted columns (one entry per /24 prefix)
+
+    Prefixes are stored as integer keys (src IP >> 8). The object can be used
+    like the dict returned by get_ground_truth (key = /24 prefix as string,
+    value = dict(ingress_router = set, pkt_count = int)).
+    """
+
+    def __init__(self, src, routers, counts=None):
+        """ constructor
+
+        src (array): src IPs as int of all packets (in n)
+        routers (array): ingress routers of all packets (< 2**16)
+        counts (array): number of packets each entry stands for (default: 1 each)
+        """
+
+        keys = np.asarray(src, dtype=np.int64) >> 8
+        routers = np.asarray(routers, dtype=np.int64)
+
+        # sorted /24 keys and number of packets per key
+        if counts is None:
+            self.keys, self.pkt_counts = np.unique(keys, return_counts=True)
+        else:
+            self.keys, inverse = np.unique(keys, return_inverse=True)
+            self.pkt_counts = np.bincount(inverse, weights=counts, minlength=len(self.keys)).astype(np.int64)
+
+        # sorted distinct (key, router) pairs, routers of a key are consecutive
+        self.pairs = np.unique((keys << 16) | routers)
+        self.pair_starts = np.searchsorted(self.pairs, self.keys << 16)
+        self.n_routers = np.diff(np.append(self.pair_starts, len(self.pairs)))
+        self.unique = self.n_routers == 1
+
+        # string-based view, see as_dict
+        self.entries = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def index(self, prefix):
+        """ Returns the position of a /24 prefix
+
+        prefix (str): /24 prefix
+
+        returns: position in keys, -1 if not active
+        """
+
+        key = ipv4_to_int(prefix[:prefix.index('/')]) >> 8
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+
+        return -1
+
+    def has_router(self, positions, routers):
+        """ Checks if prefixes were observed at given ingress routers
+
+        positions (array): positions in keys
+        routers (array): ingress router for each position
+
+        returns: boolean array
+        """
+
+        wanted = (self.keys[positions] << 16) | np.asarray(routers, dtype=np.int64)
+        if len(self.pairs) == 0:
+            return np.zeros(len(wanted), dtype=bool)
+
+        found = np.searchsorted(self.pairs, wanted)
+
+        return self.pairs[np.minimum(found, len(self.pairs) - 1)] == wanted
+
+    def get_entry(self, i):
+        """ Returns the ground truth data at a given position
+
+        i (int): position in keys
+
+        returns: dict(ingress_router = set of routers, pkt_count = int)
+        """
+
+        routers = self.pairs[self.pair_starts[i]:self.pair_starts[i] + self.n_routers[i]] & 0xffff
+
+        return {
+            'ingress_router': set(routers.tolist()),
+            'pkt_count': int(self.pkt_counts[i])
+        }
+
+    def prefixes(self):
+        """ Returns all /24 prefixes as strings (sorted) """
+
+        return [ipv4_to_str(key << 8)+'/24' for key in self.keys.tolist()]
+
+    def as_dict(self):
+        """ Returns the ground truth data in the format of get_ground_truth
+        The dict is only created on first use (string-based lookups).
+
+        returns: dict (key = /24 prefix, value = dict(ingress_router = set, pkt_count = int))
+        """
+
+        if self.entries is None:
+            self.entries = dict()
+            routers = (self.pairs & 0xffff).tolist()
+            for prefix, start, n, count in zip(self.prefixes(), self.pair_starts.tolist(),
+                                               self.n_routers.tolist(), self.pkt_counts.tolist()):
+                self.entries[prefix] = {
+                    'ingress_router': set(routers[start:start+n]),
+                    'pkt_count': count
+                }
+
+        return self.entries
+
+    def __contains__(self, prefix):
+        return prefix in self.as_dict()
+
+    def __getitem__(self, prefix):
+        return self.as_dict()[prefix]
+
+    def __iter__(self):
+        return iter(self.as_dict())
+
+    def items(self):
+        return self.as_dict().items()
+
+
+def get_ground_truth_data(pkts):
+    """ Gets ground truth data as GroundTruth object
+
+    pkts (list or array):
+        list of packets (in n) or packet array
+
+    returns: GroundTruth
+    """
+
+    return GroundTruth(*get_pkt_arrays(pkts))
+
+
 def compare_sets(set_new, set_old):
     """Compare elements present, added, and removed between
     two versions of the same set.
@@ -244,7 +604,7 @@ def export_sentinels(sentinels, pkts, out_file, iteration):
     """ Exports all found sentinels together with known packet amount
 
     sentinels (set): sentinels to consider
-    pkts (list): list of all pkts the sentinels are based on
+    pkts (list or array): all pkts the sentinels are based on
     out_file (str): file name to write found sentinels to
     iteration (int): current simulation iteration
     """
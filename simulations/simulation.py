@@ -2,17 +2,25 @@
 """
 
 import argparse
+import json
+import pickle
 import random
+import os
 import os.path
 import sys
 
-from sim_util import get_result_string, get_ground_truth, compare_sets
-from sim_pkts import get_sampled_packets_per_router, get_sampled_packets_everflow, get_preprocessed_pkts, prepare_permutations, get_preprocessed_pkts_mapping
-from sim_mirroring import get_mirroring_rules, get_mirrored_packets
-from sim_results import get_results_ground_truth, get_results_ground_truth_sampling, get_results_ground_truth_invalidated_sentinels
-from sim_util import get_sentinels
+import numpy as np
+
+from sim_util import get_ground_truth_data, compare_sets, make_pkt_array
+from sim_pkts import get_sampled_indices_per_router, prepare_permutations, get_store_columns, get_preprocessed_columns, get_column_pkts, get_flag_index, get_flag_packets, get_iteration_row, seek_row, SAMPLING_MODES
+from sim_results import get_results_ground_truth, get_results_ground_truth_sampling
+from sim_util import get_sentinel_window, update_sentinel_window, get_window_sentinels
+from sim_cases import MirroringCase, CaseRunner, CaseWorkers
+from sim_profile import StageProfiler, get_usage, SHARED
+from sim_output import ResultWriter
 
 from common.helpers import setup_logging
+from common.pkt_store import is_pkt_store, load_pkt_store, load_index, index_file
 
 import logging
 log = logging.getLogger(__name__)
@@ -20,9 +28,15 @@ log = logging.getLogger(__name__)
 
 prefix_file = '../input_data/all_prefixes.txt'
 
-# set random seed for simulations
-# influences which packets are sampled
-random.seed('new sim')
+# permutation mappings are cached in this folder (see sim_pkts.prepare_permutations)
+permutation_cache = '../input_data/permutations'
+
+# random seed for simulations, every simulation uses its own generator
+# influences which packets are sampled (and permuted)
+RANDOM_SEED = 'new sim'
+
+# version of the checkpoint files, checkpoints of other versions can not be resumed
+CHECKPOINT_VERSION = 2
 
 # Parameters for top k analysis
 TOP_K = [100, 500, 1000, 5000]
@@ -44,6 +58,8 @@ default_results_everflow = [
     'n_prefixes',
     'max_pkt_router',
     'min_pkt_router',
+    'max_flag_router',
+    'min_flag_router',
     'iteration_end_ts',
     'n_sentinels_total',
     'n_sentinels_added',
@@ -93,6 +109,8 @@ magnifier_results_sentinel_with_mirroring = [
     'n_sentinels_total_mirroring',
     'n_sentinels_added_mirroring',
     'n_sentinels_removed_mirroring',
+    'n_rules_added_mirroring',
+    'n_rules_removed_mirroring',
     'n_mirrored_packets_mirroring',
     'prefix_correct_mirroring',
     'prefix_wrong_mirroring',
@@ -114,504 +132,489 @@ magnifier_results_sentinel_with_mirroring = [
 ]
 
 
-def make_sim_magnifier(in_file, out_file, frequency, duration, pps,
-                       s_start, s_end, iteration, border, use_persistent,
-                       permutation):
-    """ main simulation function
+def checkpoint_file(out_file):
+    """ Returns the name of the checkpoint file of a simulation
 
-    in_file (str): 
-        filename to file with parsed packet information
-    out_file (str): 
-        name of file with results
-    frequency (int): 
-        sampling frequency n -> every n-th packet is sampled
-    duration (int): 
-        how long one iteration takes in seconds
-    pps (int): 
-        number of replayed packets per second (-1 == real replay speed)
-    s_start (int):
-        sentinel search prefix start size
-    s_end (int): 
-        sentinel search prefix end size
-    iteration (int): 
-        number of simulation iterations
-    border (int): 
-        number of border routers to consider
-    permutation (int):
-        percentage of permutations, -1 means not used
+    out_file (str): name of file with results
+
+    returns: file name of the checkpoint
     """
+    return out_file + '.checkpoint'
 
-    # create permutations if needed
-    if permutation != -1:
-        mapping = prepare_permutations(permutation, prefix_file, border)
 
-    # helper - replay_real_speed
-    if pps == -1:
-        replay_real_speed = True
-    else:
-        replay_real_speed = False
+def write_checkpoint(file_name, iteration, row, simulations):
+    """ Writes the state of all simulations after an iteration
 
-    # sampled and mirrored packets of previous iterations
-    mirrored_pkts = []
-    mirrored_pkts_n_1 = []
-    mirrored_pkts_n_2 = []
-    sampled_pkts = []
-    sampled_pkts_n_1 = []
-    sampled_pkts_n_2 = []
-    sentinels_with_mirroring = []
-    sentinels_with_mirroring_n_1 = []
-
-    for order in ORDERING:
-        if order != 'full':
-            for top in TOP_K:
-                mirrored_pkts.append([])
-                mirrored_pkts_n_1.append([])
-                mirrored_pkts_n_2.append([])
-                sentinels_with_mirroring.append({})
-                sentinels_with_mirroring_n_1.append({})
-
-        # for run with all sentinels
-        else:
-            mirrored_pkts.append([])
-            mirrored_pkts_n_1.append([])
-            mirrored_pkts_n_2.append([])
-            sentinels_with_mirroring.append({})
-            sentinels_with_mirroring_n_1.append({})
-
-    # prepare lists to save various results of each iteration
-    result_dict = dict()
-    for name in default_results_magnifier:
-        result_dict[name] = list()
-
-    # top k sentinels do not have an influence on results based on sampling only
-    for name in results_sampling_only:
-        result_dict['full_{}'.format(name)] = list()
-
-    # top k sentinels do not have an influence on results based on sentinels without mirroring
-    for name in results_sentinel_without_mirroring:
-        result_dict['full_{}'.format(name)] = list()
-
-    # top k sentinels do influence the results based on sentinels with mirroring
-    for name in magnifier_results_sentinel_with_mirroring:
-        for order in ORDERING:
-            if order != 'full':
-                for top in TOP_K:
-                    result_dict['top_{}_{}_{}'.format(top, order, name)] = list()
+    The profile of each simulation so far is written as well.
 
-            # for case with unlimited number of mirroring rules
-            else:
-                result_dict['full_{}'.format(name)] = list()
+    file_name (str): checkpoint file
+    iteration (int): next iteration to simulate
+    row (int): first packet (row) of the next iteration in the input
+    simulations (list): MagnifierSimulation and EverflowSimulation objects
+    """
 
-    # preparations for reading packets in
-    file_ptr = open(in_file, 'r')
+    for simulation in simulations:
+        simulation.flush()
 
-    # prepare sampling start points once
-    sampling_progress = list()
-    for i in range(border):
-        sampling_progress.append(random.randrange(0, frequency))
+    checkpoint = {
+        'version': CHECKPOINT_VERSION,
+        'iteration': iteration,
+        'row': row,
+        'out_files': [simulation.out_file for simulation in simulations],
+        'simulations': [simulation.get_state() for simulation in simulations],
+    }
 
-    # main loop
-    for i in range(iteration):
-        log.info("Iteration {}... (magnifier)".format(i))
+    # replace the previous checkpoint at once, a crash while writing keeps it
+    with open(file_name + '.tmp', 'wb') as data_out:
+        pickle.dump(checkpoint, data_out, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(file_name + '.tmp', file_name)
 
-        # prepare this iteration
-        # moved to the top to support continue statements
-        # order is important, do not change
-        # sampled packets do not depend on the top k analysis
-        sampled_pkts_n_2 = sampled_pkts_n_1
-        sampled_pkts_n_1 = sampled_pkts
+    log.info("Checkpoint before iteration {} written to {}".format(iteration, file_name))
+
+
+def load_checkpoint(file_name, simulations):
+    """ Restores the state of all simulations from a checkpoint
+
+    file_name (str): checkpoint file (see write_checkpoint)
+    simulations (list): simulations with the same configurations as when the checkpoint was written
+
+    returns: (iteration, row) next iteration and its first packet (row) in the input
+    """
+
+    with open(file_name, 'rb') as data_in:
+        checkpoint = pickle.load(data_in)
+
+    if checkpoint['version'] != CHECKPOINT_VERSION:
+        raise ValueError('unsupported checkpoint version {} in {}'.format(checkpoint['version'], file_name))
+
+    if checkpoint['out_files'] != [simulation.out_file for simulation in simulations]:
+        raise ValueError('checkpoint {} belongs to other simulations: {}'.format(file_name, checkpoint['out_files']))
+
+    for simulation, state in zip(simulations, checkpoint['simulations']):
+        simulation.set_state(state)
+
+    log.info("Resuming at iteration {} from {}".format(checkpoint['iteration'], file_name))
 
-        # mirrored packets (and sentinels) need to be stored for each top k case
-        i_top = 0
+    return (checkpoint['iteration'], checkpoint['row'])
+
+
+class MagnifierSimulation:
+    """ State of a single magnifier simulation, packets are fed iteration by iteration
+
+    Each simulation has its own random number generator (seeded the same way)
+    such that results do not depend on other simulations in the same process.
+    """
+
+    def __init__(self, out_file, frequency, s_start, s_end, border, use_persistent,
+                 permutation, workers=1, sampling='systematic', profile=False):
+        """ constructor
+
+        out_file (str): name of file with results
+        frequency (int): sampling frequency n -> every n-th packet is sampled
+        s_start (int): sentinel search prefix start size
+        s_end (int): sentinel search prefix end size
+        border (int): number of border routers to consider
+        use_persistent (bool): persistent (True) or random (False) pkt to border mapping
+        permutation (int): percentage of permutations, -1 means not used
+        workers (int): number of worker processes for the top k cases (1 == no extra processes)
+        sampling (str): sampling mode of the border routers (see sim_pkts.SAMPLING_MODES)
+        profile (bool): write the resource usage of each stage into a profile file (see sim_profile.py)
+        """
+
+        self.out_file = out_file
+        self.frequency = frequency
+        self.border = border
+        self.use_persistent = use_persistent
+        self.sampling = sampling
+        self.profiler = StageProfiler(profile)
+
+        # influences which packets are sampled
+        self.random = random.Random(RANDOM_SEED)
+
+        # create permutations if needed
+        self.mapping = None
+        if permutation != -1:
+            self.mapping = prepare_permutations(permutation, prefix_file, border, self.random, permutation_cache)
+
+        # sampled packets of previous iterations
+        self.sampled_pkts = []
+        self.sampled_pkts_n_1 = []
+        self.sampled_pkts_n_2 = []
+
+        # sentinels based on all sampled packets from n, n-1 and n-2 (updated incrementally)
+        self.sentinel_window_samples = get_sentinel_window(3, s_start, s_end)
+
+        # top k cases, each with its own history of mirrored packets and sentinels
+        cases = list()
         for order in ORDERING:
             if order != 'full':
                 for top in TOP_K:
-                    mirrored_pkts_n_2[i_top] = mirrored_pkts_n_1[i_top]
-                    mirrored_pkts_n_1[i_top] = mirrored_pkts[i_top]
-                    sentinels_with_mirroring_n_1[i_top] = sentinels_with_mirroring[i_top]
-                    i_top += 1
+                    cases.append(MirroringCase('top_{}_{}_'.format(top, order), order, top, s_start, s_end, profile))
 
             # for run with all sentinels
             else:
-                mirrored_pkts_n_2[i_top] = mirrored_pkts_n_1[i_top]
-                mirrored_pkts_n_1[i_top] = mirrored_pkts[i_top]
-                sentinels_with_mirroring_n_1[i_top] = sentinels_with_mirroring[i_top]
+                cases.append(MirroringCase('full_', None, None, s_start, s_end, profile))
 
-        # get iteration end points
-        if replay_real_speed:
-            start = i     * duration  # time
-            end   = (i+1) * duration  # time
+        if workers > 1:
+            self.case_runner = CaseWorkers(cases, workers, s_start, s_end)
         else:
-            start = i     * duration * pps    # pkt numb
-            end   = (i+1) * duration * pps    # pkt numb
+            self.case_runner = CaseRunner(cases, s_start, s_end)
+
+        # prepare the columns of the results of each iteration (variant, name)
+        results = list()
+        for name in default_results_magnifier:
+            results.append((SHARED, name))
+
+        # top k sentinels do not have an influence on results based on sampling only
+        for name in results_sampling_only:
+            results.append(('full', name))
+
+        # top k sentinels do not have an influence on results based on sentinels without mirroring
+        for name in results_sentinel_without_mirroring:
+            results.append(('full', name))
+
+        # top k sentinels do influence the results based on sentinels with mirroring
+        for name in magnifier_results_sentinel_with_mirroring:
+            for order in ORDERING:
+                if order != 'full':
+                    for top in TOP_K:
+                        results.append(('top_{}_{}'.format(top, order), name))
+
+                # for case with unlimited number of mirroring rules
+                else:
+                    results.append(('full', name))
+
+        self.writer = ResultWriter(out_file, results)
+
+        # prepare sampling start points once
+        self.sampling_progress = list()
+        for i in range(border):
+            self.sampling_progress.append(self.random.randrange(0, frequency))
+
+        # random sampling modes draw from their own generator (seeded from ours)
+        self.sampling_rng = None
+        if sampling != 'systematic':
+            self.sampling_rng = np.random.default_rng(self.random.getrandbits(64))
+
+    def step(self, i, current_pkts, timestamps, current_flags, border_idx, flag_idx):
+        """ Runs one iteration
+
+        i (int): iteration
+        current_pkts (array): packet array with all packets of the current iteration
+        timestamps (array): pkt timestamps
+        current_flags (array): booleans if at least one everflow TCP flag is set (not used)
+        border_idx (list of arrays): packet indices separated by border router
+        flag_idx (array): indices of all packets with flags (not used)
+        """
 
-        # all packets which belong to the current iteration
-        if permutation != -1:
-            current_pkts, timestamps, _, file_ptr, router_pkts, router_flags = get_preprocessed_pkts_mapping(
-                file_ptr,
-                start,
-                end,
-                replay_real_speed,
-                border,
-                mapping,
-                time_persistent=use_persistent
-            )
-        else:
-            current_pkts, timestamps, _, file_ptr, router_pkts, router_flags = get_preprocessed_pkts(
-                file_ptr,
-                start,
-                end,
-                replay_real_speed,
-                border,
-                time_persistent=use_persistent
-            )
+        log.info("Iteration {}... (magnifier)".format(i))
 
-        # we did not find any packets
-        # => we reached the end of the trace
-        if len(current_pkts) == 0:
-            break
+        # results of this iteration (see sim_output.py)
+        results = dict()
+
+        # prepare this iteration
+        # order is important, do not change
+        # sampled packets do not depend on the top k analysis
+        self.sampled_pkts_n_2 = self.sampled_pkts_n_1
+        self.sampled_pkts_n_1 = self.sampled_pkts
+
+        # mirrored packets (and sentinels) are stored in each top k case
 
         # get sampled packets
-        sampled_pkts, sampling_progress = get_sampled_packets_per_router(
-            router_pkts,
-            router_flags,
-            False,
-            frequency,
-            sampling_progress
-        )
+        with self.profiler.stage(i, SHARED, 'sample'):
+            sampled_idx, self.sampling_progress = get_sampled_indices_per_router(
+                border_idx,
+                None,
+                self.frequency,
+                self.sampling_progress,
+                self.sampling,
+                self.sampling_rng
+            )
+            self.sampled_pkts = current_pkts[sampled_idx]
+            update_sentinel_window(self.sentinel_window_samples, self.sampled_pkts)
 
         # first iteration, we only have sampled packets
         if i == 0:
-            continue
+            return
 
         # real run, compute evaluation results
         # we first handle everything which is unrelated to mirroring
         # and therefore unrelated to the top k analysis
         if i >= 3:
             # get ground truth data based on all packets in n
-            gt_data = get_ground_truth(current_pkts)
+            with self.profiler.stage(i, SHARED, 'ground_truth'):
+                gt_data = get_ground_truth_data(current_pkts)
 
-            temp_length = [len(per_router) for per_router in router_pkts]
+            scoring_start = get_usage()
+
+            temp_length = [len(idx) for idx in border_idx]
 
             # store results
             # ... min and max packets per router in this iteration
-            result_dict['max_pkt_router'].append(max(temp_length))
-            result_dict['min_pkt_router'].append(min(temp_length))
+            results['max_pkt_router'] = max(temp_length)
+            results['min_pkt_router'] = min(temp_length)
 
             # get number of prefixes and packets in the ground truth
             n_prefixes = len(gt_data)
 
             # ... number of packets overall
-            result_dict['n_total_packets'].append(len(current_pkts))
+            results['n_total_packets'] = len(current_pkts)
 
             # ... maximal number of prefixes coverable
-            result_dict['n_prefixes'].append(n_prefixes)
+            results['n_prefixes'] = n_prefixes
 
             # ... iteration timestamp
-            result_dict['iteration_end_ts'].append(timestamps[-1])
+            results['iteration_end_ts'] = float(timestamps[-1])
 
             # full run
             suffix = 'full_'
 
             # if we consider ground truth-based sampling only evaluation
             # we only take the samples from the current iteration
-            results_gt_sampling = get_results_ground_truth_sampling(gt_data, sampled_pkts)
-
-            result_dict[suffix+'prefix_correct_sampling'].append(results_gt_sampling[0])
-            result_dict[suffix+'prefix_covered_not_unique_sampling'].append(results_gt_sampling[1])
-            result_dict[suffix+'prefix_not_covered_sampling'].append(results_gt_sampling[2])
-            result_dict[suffix+'prefix_not_covered_not_unique_sampling'].append(results_gt_sampling[3])
-            result_dict[suffix+'pkt_covered_correct_sampling'].append(results_gt_sampling[4])
-            result_dict[suffix+'pkt_covered_correct_not_unique_sampling'].append(results_gt_sampling[5])
-            result_dict[suffix+'pkt_not_covered_sampling'].append(results_gt_sampling[6])
-            result_dict[suffix+'pkt_not_covered_not_unique_sampling'].append(results_gt_sampling[7])
-            result_dict[suffix+'prefix_not_active_sampling'].append(results_gt_sampling[8])
-
-            # all samples
-            all_samples = (
-                sampled_pkts_n_2 +
-                sampled_pkts_n_1 +
-                sampled_pkts
-            )
+            results_gt_sampling = get_results_ground_truth_sampling(gt_data, self.sampled_pkts)
+
+            results[suffix+'prefix_correct_sampling'] = results_gt_sampling[0]
+            results[suffix+'prefix_covered_not_unique_sampling'] = results_gt_sampling[1]
+            results[suffix+'prefix_not_covered_sampling'] = results_gt_sampling[2]
+            results[suffix+'prefix_not_covered_not_unique_sampling'] = results_gt_sampling[3]
+            results[suffix+'pkt_covered_correct_sampling'] = results_gt_sampling[4]
+            results[suffix+'pkt_covered_correct_not_unique_sampling'] = results_gt_sampling[5]
+            results[suffix+'pkt_not_covered_sampling'] = results_gt_sampling[6]
+            results[suffix+'pkt_not_covered_not_unique_sampling'] = results_gt_sampling[7]
+            results[suffix+'prefix_not_active_sampling'] = results_gt_sampling[8]
+
+            scoring_end = get_usage()
 
             # sentinels based on all sampled packets only
             # for now we consider all samples from n, n-1 and n-2
-            sentinels_all_samples = get_sentinels(all_samples, s_start, s_end)
+            with self.profiler.stage(i, SHARED, 'sentinel'):
+                sentinels_all_samples = get_window_sentinels(self.sentinel_window_samples)
+
+            scoring_start_sentinel = get_usage()
 
             # if we consider ground truth-based sentinel evaluation without mirroring (on a per /24 basis)
             results_gt_sentinel = get_results_ground_truth(gt_data, sentinels_all_samples)
 
             # ... updating result variables
-            result_dict[suffix+'prefix_correct_sentinel_old'].append(results_gt_sentinel[0])
-            result_dict[suffix+'prefix_wrong_sentinel_old'].append(results_gt_sentinel[1])
-            result_dict[suffix+'prefix_not_active_sentinel_old'].append(results_gt_sentinel[2])
-            result_dict[suffix+'prefix_not_covered_sentinel_old'].append(results_gt_sentinel[3])
-            result_dict[suffix+'prefix_covered_not_unique_sentinel_old'].append(results_gt_sentinel[4])
-            result_dict[suffix+'prefix_not_covered_not_unique_sentinel_old'].append(results_gt_sentinel[5])
-            result_dict[suffix+'pkt_covered_correct_sentinel_old'].append(results_gt_sentinel[7])
-            result_dict[suffix+'pkt_covered_wrong_sentinel_old'].append(results_gt_sentinel[8])
-            result_dict[suffix+'pkt_covered_not_unique_sentinel_old'].append(results_gt_sentinel[9])
-            result_dict[suffix+'pkt_not_covered_sentinel_old'].append(results_gt_sentinel[10])
-            result_dict[suffix+'pkt_not_covered_not_unique_sentinel_old'].append(results_gt_sentinel[11])
-            result_dict[suffix+'pkt_all_unique_sentinel_old'].append(results_gt_sentinel[12])
+            results[suffix+'prefix_correct_sentinel_old'] = results_gt_sentinel[0]
+            results[suffix+'prefix_wrong_sentinel_old'] = results_gt_sentinel[1]
+            results[suffix+'prefix_not_active_sentinel_old'] = results_gt_sentinel[2]
+            results[suffix+'prefix_not_covered_sentinel_old'] = results_gt_sentinel[3]
+            results[suffix+'prefix_covered_not_unique_sentinel_old'] = results_gt_sentinel[4]
+            results[suffix+'prefix_not_covered_not_unique_sentinel_old'] = results_gt_sentinel[5]
+            results[suffix+'pkt_covered_correct_sentinel_old'] = results_gt_sentinel[7]
+            results[suffix+'pkt_covered_wrong_sentinel_old'] = results_gt_sentinel[8]
+            results[suffix+'pkt_covered_not_unique_sentinel_old'] = results_gt_sentinel[9]
+            results[suffix+'pkt_not_covered_sentinel_old'] = results_gt_sentinel[10]
+            results[suffix+'pkt_not_covered_not_unique_sentinel_old'] = results_gt_sentinel[11]
+            results[suffix+'pkt_all_unique_sentinel_old'] = results_gt_sentinel[12]
 
             # if we consider ground truth-based sentinel evaluation without mirroring (only valid ones)
             results_gt_sentinel = get_results_ground_truth(gt_data, sentinels_all_samples, True)
 
             # ... updating result variables
-            result_dict[suffix+'prefix_correct_sentinel'].append(results_gt_sentinel[0])
-            result_dict[suffix+'prefix_wrong_sentinel'].append(results_gt_sentinel[1])
-            result_dict[suffix+'prefix_not_active_sentinel'].append(results_gt_sentinel[2])
-            result_dict[suffix+'prefix_not_covered_sentinel'].append(results_gt_sentinel[3])
-            result_dict[suffix+'prefix_covered_not_unique_sentinel'].append(results_gt_sentinel[4])
-            result_dict[suffix+'prefix_not_covered_not_unique_sentinel'].append(results_gt_sentinel[5])
-            result_dict[suffix+'pkt_covered_correct_sentinel'].append(results_gt_sentinel[7])
-            result_dict[suffix+'pkt_covered_wrong_sentinel'].append(results_gt_sentinel[8])
-            result_dict[suffix+'pkt_covered_not_unique_sentinel'].append(results_gt_sentinel[9])
-            result_dict[suffix+'pkt_not_covered_sentinel'].append(results_gt_sentinel[10])
-            result_dict[suffix+'pkt_not_covered_not_unique_sentinel'].append(results_gt_sentinel[11])
-            result_dict[suffix+'pkt_all_unique_sentinel'].append(results_gt_sentinel[12])
+            results[suffix+'prefix_correct_sentinel'] = results_gt_sentinel[0]
+            results[suffix+'prefix_wrong_sentinel'] = results_gt_sentinel[1]
+            results[suffix+'prefix_not_active_sentinel'] = results_gt_sentinel[2]
+            results[suffix+'prefix_not_covered_sentinel'] = results_gt_sentinel[3]
+            results[suffix+'prefix_covered_not_unique_sentinel'] = results_gt_sentinel[4]
+            results[suffix+'prefix_not_covered_not_unique_sentinel'] = results_gt_sentinel[5]
+            results[suffix+'pkt_covered_correct_sentinel'] = results_gt_sentinel[7]
+            results[suffix+'pkt_covered_wrong_sentinel'] = results_gt_sentinel[8]
+            results[suffix+'pkt_covered_not_unique_sentinel'] = results_gt_sentinel[9]
+            results[suffix+'pkt_not_covered_sentinel'] = results_gt_sentinel[10]
+            results[suffix+'pkt_not_covered_not_unique_sentinel'] = results_gt_sentinel[11]
+            results[suffix+'pkt_all_unique_sentinel'] = results_gt_sentinel[12]
+
+            # scoring without mirroring is split by the sentinel computation
+            self.profiler.add(i, SHARED, 'scoring', [(scoring_start, scoring_end), (scoring_start_sentinel, get_usage())])
 
         # now we handle everything related to mirroring
-        # part of the following code also needs to be done for i == 1 and i == 2 to prepare packet history
+        # the cases also need to run for i == 1 and i == 2 to prepare packet history
+        if i < 3:
+            gt_data = None
 
-        # prepare values to use in final loop
-        order_values = list()
-        top_values = list()
-        suffixes = list()
+        for case_results in self.case_runner.run(i, current_pkts, gt_data, self.sampled_pkts_n_1, self.sampled_pkts_n_2):
+            results.update(case_results)
 
-        for order in ORDERING:
-            if order != 'full':
-                for top in TOP_K:
-                    suffixes.append('top_{}_{}_'.format(top, order))
-                    top_values.append(top)
-                    order_values.append(order)
+        self.profiler.extend(self.case_runner.pop_profile())
 
-            else:
-                suffixes.append('full_')
-                top_values.append(None)
-                order_values.append(None)
-
-        # perform final loop
-        for i_top, suffix in enumerate(suffixes):
-
-            # assemble packet history
-            # variables are initialized with empty lists
-            # -> correct history for i == 1 or i == 2
-            pkt_history = (
-                sampled_pkts_n_1 +
-                sampled_pkts_n_2 +
-                mirrored_pkts_n_1[i_top] +
-                mirrored_pkts_n_2[i_top]
-            )
+        self.writer.write(i, results)
 
-            # compute sentinels and matching mirroring rules
-            rules, found_sentinels = get_mirroring_rules(pkt_history, s_start, s_end, order_values[i_top], top_values[i_top])
-            sentinels_with_mirroring[i_top] = found_sentinels
+    # attributes which change from iteration to iteration (see get_state)
+    STATE = ['random', 'sampling_rng', 'sampling_progress', 'sampled_pkts', 'sampled_pkts_n_1',
+             'sampled_pkts_n_2', 'sentinel_window_samples']
 
-            # get mirrored packets
-            mirrored_pkts[i_top], removed_sentinels = get_mirrored_packets(
-                rules,
-                current_pkts,
-                True
-            )
+    def get_state(self):
+        """ Returns the state after an iteration (e.g., to write a checkpoint)
 
-            # first real run, compute evaluation results
-            if i >= 3:
-                # output number of mirrored packets
-                result_dict[suffix+'n_mirrored_packets_mirroring'].append(len(mirrored_pkts[i_top]))
-
-                # compute "old" sentinel statistics
-                n_sentinels_total, n_sentinels_added, n_sentinels_removed = compare_sets(
-                    sentinels_with_mirroring[i_top],
-                    sentinels_with_mirroring_n_1[i_top]
-                )
-
-                # output sentinel statistic results
-                result_dict[suffix+'n_sentinels_total_mirroring'].append(n_sentinels_total)
-                result_dict[suffix+'n_sentinels_added_mirroring'].append(n_sentinels_added)
-                result_dict[suffix+'n_sentinels_removed_mirroring'].append(n_sentinels_removed)
-
-                # get still valid sentinels and results due to invalid sentinels
-                final_sentinels, results_lost = get_results_ground_truth_invalidated_sentinels(
-                    sentinels_with_mirroring[i_top],
-                    removed_sentinels,
-                    gt_data
-                )
-
-                # output all results based on lost sentinels
-                result_dict[suffix+'n_sentinels_invalidated_mirroring'].append(len(sentinels_with_mirroring[i_top]) - len(final_sentinels))
-                result_dict[suffix+'prefix_lost_mirroring'].append(results_lost[0])
-                result_dict[suffix+'prefix_lost_not_unique_mirroring'].append(results_lost[1])
-                result_dict[suffix+'prefix_lost_not_active_mirroring'].append(results_lost[2])
-                result_dict[suffix+'pkt_lost_mirroring'].append(results_lost[3])
-                result_dict[suffix+'pkt_lost_not_unique_mirroring'].append(results_lost[4])
-
-                # output results based on ground truth-based evaluation
-                # for sentinels with mirroring data which are still valid
-                results_gt_mirroring = get_results_ground_truth(
-                    gt_data,
-                    final_sentinels
-                )
-
-                result_dict[suffix+'prefix_correct_mirroring'].append(results_gt_mirroring[0])
-                result_dict[suffix+'prefix_wrong_mirroring'].append(results_gt_mirroring[1])
-                result_dict[suffix+'prefix_not_active_mirroring'].append(results_gt_mirroring[2])
-                result_dict[suffix+'prefix_not_covered_mirroring'].append(results_gt_mirroring[3])
-                result_dict[suffix+'prefix_covered_not_unique_mirroring'].append(results_gt_mirroring[4])
-                result_dict[suffix+'prefix_not_covered_not_unique_mirroring'].append(results_gt_mirroring[5])
-                result_dict[suffix+'pkt_covered_correct_mirroring'].append(results_gt_mirroring[7])
-                result_dict[suffix+'pkt_covered_wrong_mirroring'].append(results_gt_mirroring[8])
-                result_dict[suffix+'pkt_covered_not_unique_mirroring'].append(results_gt_mirroring[9])
-                result_dict[suffix+'pkt_not_covered_mirroring'].append(results_gt_mirroring[10])
-                result_dict[suffix+'pkt_not_covered_not_unique_mirroring'].append(results_gt_mirroring[11])
-
-    # adjust iteration end times to end timestamp of first iteration
-    temp = result_dict['iteration_end_ts'][0]
-    for i in range(len(result_dict['iteration_end_ts'])):
-        result_dict['iteration_end_ts'][i] -= temp
+        returns: dict with all attributes which change between iterations, the profile rows,
+                 the state of the result file and the state of the top k cases
+        """
 
-    # close pkt input file
-    file_ptr.close()
+        state = {name: getattr(self, name) for name in self.STATE}
+        state['profile_rows'] = self.profiler.rows
+        state['results'] = self.writer.get_state()
+        state['cases'] = self.case_runner.get_state()
 
-    # write results to file
-    with open(out_file, 'w') as data_out:
-        for key, values in result_dict.items():
-            data_out.write('{},{}\n'.format(key, get_result_string(values)))
+        return state
 
+    def set_state(self, state):
+        """ Continues with a state returned by get_state
 
-def make_sim_everflow(in_file, out_file, frequency, duration, pps,
-                      s_start, s_end, iteration, border, use_persistent,
-                      permutation):
-    """ main simulation function
+        state (dict): state of a simulation with the same configuration
+        """
 
-    in_file (str): filename to file with parsed packet information
-    out_file (str): name of file with results
-    frequency (int): everflow sampling frequency n -> every n-th packet is sampled
-    duration (int): how long one iteration takes in seconds
-    pps (int): pps of replayed packets per second (-1 == real replay speed)
-    s_start (int): sentinel search prefix start size
-    s_end (int): sentinel search prefix end size
-    iteration (int): number of simulation iterations
-    border (int): number of border routers to consider
-    permutation (int): percentage of permutations, -1 means not used
-    """
+        for name in self.STATE:
+            setattr(self, name, state[name])
+        self.profiler.rows = state['profile_rows']
+        self.writer.set_state(state['results'])
+        self.case_runner.set_state(state['cases'])
 
-    # create permutations if needed
-    if permutation != -1:
-        mapping = prepare_permutations(permutation, prefix_file, border)
+    def flush(self):
+        """ Writes the profile so far (results are written after each iteration) """
 
-    # helper - replay_real_speed
-    if pps == -1:
-        replay_real_speed = True
-    else:
-        replay_real_speed = False
+        self.profiler.write(self.out_file)
 
-    # preparations for reading packets in
-    file_ptr = open(in_file, 'r')
-
-    # prepare sampling start points once
-    sampling_progress = list()
-    for i in range(border):
-        sampling_progress.append(random.randrange(0, frequency))
-
-    # to save sampled packets of previous iterations
-    mirrored_pkts_n_1 = []
-    mirrored_pkts_n_2 = []
-    mirrored_pkts = []
-    sentinels_all_samples = {}
-
-    # prepare lists to save various results of each iteration
-    result_dict = dict()
-    for name in default_results_everflow:
-        result_dict[name] = list()
-
-    # currently we only consider a full run for Everflow
-    # top k runs do not make sense
-    dynamic_everflow = ['full']
-
-    for name in results_sampling_only:
-        for value in dynamic_everflow:
-            result_dict['{}_{}'.format(value, name)] = list()
-    for name in results_sentinel_without_mirroring:
-        for value in dynamic_everflow:
-            result_dict['{}_{}'.format(value, name)] = list()
-
-    for i in range(iteration):
-        log.info("Iteration {}... (everflow)".format(i))
+    def finish(self):
+        """ Stops the top k cases, closes the results and writes the profile """
 
-        # prepare this iteration
-        # moved to the top to support continue statements
-        # order is important, do not change
-        mirrored_pkts_n_2 = mirrored_pkts_n_1
-        mirrored_pkts_n_1 = mirrored_pkts
-        sentinels_samples_only_n_1 = sentinels_all_samples
+        self.case_runner.close()
+        self.writer.close()
+        self.flush()
 
-        # get iteration end points
-        if replay_real_speed:
-            start = i     * duration  # time
-            end   = (i+1) * duration  # time
-        else:
-            start = i     * duration * pps    # pkt numb
-            end   = (i+1) * duration * pps    # pkt numb
 
-        # all packets which belong to the current iteration
+class EverflowSimulation:
+    """ State of a single everflow simulation, packets are fed iteration by iteration
+
+    Each simulation has its own random number generator (seeded the same way)
+    such that results do not depend on other simulations in the same process.
+    """
+
+    def __init__(self, out_file, frequency, s_start, s_end, border, use_persistent, permutation,
+                 sampling='systematic', profile=False):
+        """ constructor
+
+        out_file (str): name of file with results
+        frequency (int): everflow sampling frequency n -> every n-th packet is sampled
+        s_start (int): sentinel search prefix start size
+        s_end (int): sentinel search prefix end size
+        border (int): number of border routers to consider
+        use_persistent (bool): persistent (True) or random (False) pkt to border mapping
+        permutation (int): percentage of permutations, -1 means not used
+        sampling (str): sampling mode of the border routers (see sim_pkts.SAMPLING_MODES)
+        profile (bool): write the resource usage of each stage into a profile file (see sim_profile.py)
+        """
+
+        self.out_file = out_file
+        self.frequency = frequency
+        self.border = border
+        self.use_persistent = use_persistent
+        self.sampling = sampling
+        self.profiler = StageProfiler(profile)
+
+        # influences which packets are sampled
+        self.random = random.Random(RANDOM_SEED)
+
+        # create permutations if needed
+        self.mapping = None
         if permutation != -1:
-            current_pkts, timestamps, current_flags, file_ptr, router_pkts, router_flags = get_preprocessed_pkts_mapping(
-                file_ptr,
-                start,
-                end,
-                replay_real_speed,
-                border,
-                mapping,
-                time_persistent=use_persistent
-            )
-        else:
-            current_pkts, timestamps, current_flags, file_ptr, router_pkts, router_flags = get_preprocessed_pkts(
-                file_ptr,
-                start,
-                end,
-                replay_real_speed,
-                border,
-                time_persistent=use_persistent
-            )
+            self.mapping = prepare_permutations(permutation, prefix_file, border, self.random, permutation_cache)
 
-        # we did not find any packets
-        if len(current_pkts) == 0:
-            break
+        # prepare sampling start points once
+        self.sampling_progress = list()
+        for i in range(border):
+            self.sampling_progress.append(self.random.randrange(0, frequency))
+
+        # random sampling modes draw from their own generator (seeded from ours)
+        self.sampling_rng = None
+        if sampling != 'systematic':
+            self.sampling_rng = np.random.default_rng(self.random.getrandbits(64))
+
+        # to save sampled packets of previous iterations
+        self.mirrored_pkts = []
+        self.sentinels_all_samples = {}
+
+        # sentinels are updated incrementally based on all sampled (mirrored) packets from n, n-1 and n-2
+        self.sentinel_window_samples = get_sentinel_window(3, s_start, s_end)
+
+        # prepare the columns of the results of each iteration (variant, name)
+        results = list()
+        for name in default_results_everflow:
+            results.append((SHARED, name))
+
+        # currently we only consider a full run for Everflow
+        # top k runs do not make sense
+        dynamic_everflow = ['full']
+
+        for name in results_sampling_only:
+            for value in dynamic_everflow:
+                results.append((value, name))
+        for name in results_sentinel_without_mirroring:
+            for value in dynamic_everflow:
+                results.append((value, name))
+
+        self.writer = ResultWriter(out_file, results)
+
+    def step(self, i, current_pkts, timestamps, current_flags, border_idx, flag_idx):
+        """ Runs one iteration, see MagnifierSimulation.step """
+
+        log.info("Iteration {}... (everflow)".format(i))
+
+        # results of this iteration (see sim_output.py)
+        results = dict()
+
+        # prepare this iteration
+        # order is important, do not change
+        sentinels_samples_only_n_1 = self.sentinels_all_samples
 
         # get mirrored packets (== samples)
-        mirrored_pkts, sampling_progress, n_flags, n_random = get_sampled_packets_everflow(
-            current_pkts,
-            current_flags,
-            router_pkts,
-            router_flags,
-            frequency,
-            sampling_progress
-        )
+        # all packets with flags and randomly sampled packets which have no flags
+        with self.profiler.stage(i, SHARED, 'sample'):
+            random_idx, self.sampling_progress = get_sampled_indices_per_router(
+                border_idx,
+                current_flags,
+                self.frequency,
+                self.sampling_progress,
+                self.sampling,
+                self.sampling_rng
+            )
+            flag_pkts, flag_counts = get_flag_packets(current_pkts, flag_idx, self.border)
+            mirrored_pkts = np.concatenate([flag_pkts, current_pkts[random_idx]])
+            n_flags = len(flag_pkts)
+            n_random = len(random_idx)
+            self.mirrored_pkts = mirrored_pkts
+            update_sentinel_window(self.sentinel_window_samples, mirrored_pkts)
 
         # we would already be ready at i == 2 but we only start in interation i == 3
         # to have comparable results with Magnifier
         # results start at i == 3
         if i < 3:
-            continue
+            return
 
-        result_dict['n_total_packets'].append(len(current_pkts))
-        result_dict['n_mirrored_packets'].append(len(mirrored_pkts))
-        result_dict['n_flag_packets'].append(n_flags)
-        result_dict['n_random_packets'].append(n_random)
-        result_dict['iteration_end_ts'].append(timestamps[-1])
+        results['n_total_packets'] = len(current_pkts)
+        results['n_mirrored_packets'] = len(mirrored_pkts)
+        results['n_flag_packets'] = n_flags
+        results['n_random_packets'] = n_random
+        results['iteration_end_ts'] = float(timestamps[-1])
 
-        temp_length = [len(per_router) for per_router in router_pkts]
-        result_dict['max_pkt_router'].append(max(temp_length))
-        result_dict['min_pkt_router'].append(min(temp_length))
+        temp_length = [len(idx) for idx in border_idx]
+        results['max_pkt_router'] = max(temp_length)
+        results['min_pkt_router'] = min(temp_length)
+
+        # ... min and max packets with flags per router in this iteration
+        results['max_flag_router'] = int(flag_counts.max())
+        results['min_flag_router'] = int(flag_counts.min())
 
         # get ground truth data based on all packets in n
-        gt_data = get_ground_truth(current_pkts)
+        with self.profiler.stage(i, SHARED, 'ground_truth'):
+            gt_data = get_ground_truth_data(current_pkts)
+
+        scoring_start = get_usage()
 
         # get number of prefixes and packets in the ground truth
         n_prefixes = len(gt_data)
-        result_dict['n_prefixes'].append(n_prefixes)
+        results['n_prefixes'] = n_prefixes
 
         # full run
         suffix = 'full_'
@@ -620,84 +623,356 @@ def make_sim_everflow(in_file, out_file, frequency, duration, pps,
         # we only consider sampled (mirrored in the case of Everflow) packets from the current iteration
         results_gt_sampling = get_results_ground_truth_sampling(gt_data, mirrored_pkts)
 
-        result_dict[suffix+'prefix_correct_sampling'].append(results_gt_sampling[0])
-        result_dict[suffix+'prefix_covered_not_unique_sampling'].append(results_gt_sampling[1])
-        result_dict[suffix+'prefix_not_covered_sampling'].append(results_gt_sampling[2])
-        result_dict[suffix+'prefix_not_covered_not_unique_sampling'].append(results_gt_sampling[3])
-        result_dict[suffix+'pkt_covered_correct_sampling'].append(results_gt_sampling[4])
-        result_dict[suffix+'pkt_covered_correct_not_unique_sampling'].append(results_gt_sampling[5])
-        result_dict[suffix+'pkt_not_covered_sampling'].append(results_gt_sampling[6])
-        result_dict[suffix+'pkt_not_covered_not_unique_sampling'].append(results_gt_sampling[7])
-        result_dict[suffix+'prefix_not_active_sampling'].append(results_gt_sampling[8])
+        results[suffix+'prefix_correct_sampling'] = results_gt_sampling[0]
+        results[suffix+'prefix_covered_not_unique_sampling'] = results_gt_sampling[1]
+        results[suffix+'prefix_not_covered_sampling'] = results_gt_sampling[2]
+        results[suffix+'prefix_not_covered_not_unique_sampling'] = results_gt_sampling[3]
+        results[suffix+'pkt_covered_correct_sampling'] = results_gt_sampling[4]
+        results[suffix+'pkt_covered_correct_not_unique_sampling'] = results_gt_sampling[5]
+        results[suffix+'pkt_not_covered_sampling'] = results_gt_sampling[6]
+        results[suffix+'pkt_not_covered_not_unique_sampling'] = results_gt_sampling[7]
+        results[suffix+'prefix_not_active_sampling'] = results_gt_sampling[8]
 
-        # all sampled (mirrored) packets from n, n-1 and n-2
-        all_samples = mirrored_pkts_n_1 + mirrored_pkts_n_2 + mirrored_pkts
+        scoring_end = get_usage()
 
-        # compute sentinels based on all sampled (mirrored) packets
+        # compute sentinels based on all sampled (mirrored) packets from n, n-1 and n-2
         # for everflow it does not make sense to distinguish between top k cases
         # as we anyway do not deploy and mirroring rules
-        sentinels_all_samples = get_sentinels(all_samples, s_start, s_end)
+        with self.profiler.stage(i, SHARED, 'sentinel'):
+            self.sentinels_all_samples = get_window_sentinels(self.sentinel_window_samples)
+        sentinels_all_samples = self.sentinels_all_samples
+
+        scoring_start_sentinel = get_usage()
 
         n_sentinels_total, n_sentinels_added, n_sentinels_removed = compare_sets(
             sentinels_all_samples,
             sentinels_samples_only_n_1
         )
 
-        result_dict['n_sentinels_total'].append(n_sentinels_total)
-        result_dict['n_sentinels_added'].append(n_sentinels_added)
-        result_dict['n_sentinels_removed'].append(n_sentinels_removed)
+        results['n_sentinels_total'] = n_sentinels_total
+        results['n_sentinels_added'] = n_sentinels_added
+        results['n_sentinels_removed'] = n_sentinels_removed
 
         # results if we consider ground truth-based sentinel evaluation (we count on a per /24 basis)
         results_gt_sentinel = get_results_ground_truth(gt_data, sentinels_all_samples)
 
-        result_dict[suffix+'prefix_correct_sentinel_old'].append(results_gt_sentinel[0])
-        result_dict[suffix+'prefix_wrong_sentinel_old'].append(results_gt_sentinel[1])
-        result_dict[suffix+'prefix_not_active_sentinel_old'].append(results_gt_sentinel[2])
-        result_dict[suffix+'prefix_not_covered_sentinel_old'].append(results_gt_sentinel[3])
-        result_dict[suffix+'prefix_covered_not_unique_sentinel_old'].append(results_gt_sentinel[4])
-        result_dict[suffix+'prefix_not_covered_not_unique_sentinel_old'].append(results_gt_sentinel[5])
-        result_dict[suffix+'pkt_covered_correct_sentinel_old'].append(results_gt_sentinel[7])
-        result_dict[suffix+'pkt_covered_wrong_sentinel_old'].append(results_gt_sentinel[8])
-        result_dict[suffix+'pkt_covered_not_unique_sentinel_old'].append(results_gt_sentinel[9])
-        result_dict[suffix+'pkt_not_covered_sentinel_old'].append(results_gt_sentinel[10])
-        result_dict[suffix+'pkt_not_covered_not_unique_sentinel_old'].append(results_gt_sentinel[11])
-        result_dict[suffix+'pkt_all_unique_sentinel_old'].append(results_gt_sentinel[12])
+        results[suffix+'prefix_correct_sentinel_old'] = results_gt_sentinel[0]
+        results[suffix+'prefix_wrong_sentinel_old'] = results_gt_sentinel[1]
+        results[suffix+'prefix_not_active_sentinel_old'] = results_gt_sentinel[2]
+        results[suffix+'prefix_not_covered_sentinel_old'] = results_gt_sentinel[3]
+        results[suffix+'prefix_covered_not_unique_sentinel_old'] = results_gt_sentinel[4]
+        results[suffix+'prefix_not_covered_not_unique_sentinel_old'] = results_gt_sentinel[5]
+        results[suffix+'pkt_covered_correct_sentinel_old'] = results_gt_sentinel[7]
+        results[suffix+'pkt_covered_wrong_sentinel_old'] = results_gt_sentinel[8]
+        results[suffix+'pkt_covered_not_unique_sentinel_old'] = results_gt_sentinel[9]
+        results[suffix+'pkt_not_covered_sentinel_old'] = results_gt_sentinel[10]
+        results[suffix+'pkt_not_covered_not_unique_sentinel_old'] = results_gt_sentinel[11]
+        results[suffix+'pkt_all_unique_sentinel_old'] = results_gt_sentinel[12]
 
         # results if we consider ground truth-based sentinel evaluation (invalid sentinels are removed completely)
         results_gt_sentinel = get_results_ground_truth(gt_data, sentinels_all_samples, True)
 
-        result_dict[suffix+'prefix_correct_sentinel'].append(results_gt_sentinel[0])
-        result_dict[suffix+'prefix_wrong_sentinel'].append(results_gt_sentinel[1])
-        result_dict[suffix+'prefix_not_active_sentinel'].append(results_gt_sentinel[2])
-        result_dict[suffix+'prefix_not_covered_sentinel'].append(results_gt_sentinel[3])
-        result_dict[suffix+'prefix_covered_not_unique_sentinel'].append(results_gt_sentinel[4])
-        result_dict[suffix+'prefix_not_covered_not_unique_sentinel'].append(results_gt_sentinel[5])
-        result_dict[suffix+'pkt_covered_correct_sentinel'].append(results_gt_sentinel[7])
-        result_dict[suffix+'pkt_covered_wrong_sentinel'].append(results_gt_sentinel[8])
-        result_dict[suffix+'pkt_covered_not_unique_sentinel'].append(results_gt_sentinel[9])
-        result_dict[suffix+'pkt_not_covered_sentinel'].append(results_gt_sentinel[10])
-        result_dict[suffix+'pkt_not_covered_not_unique_sentinel'].append(results_gt_sentinel[11])
-        result_dict[suffix+'pkt_all_unique_sentinel'].append(results_gt_sentinel[12])
-
-
-    # adjust iteration end times to timestamp of first one
-    temp = result_dict['iteration_end_ts'][0]
-    for i in range(len(result_dict['iteration_end_ts'])):
-        result_dict['iteration_end_ts'][i] -= temp
+        results[suffix+'prefix_correct_sentinel'] = results_gt_sentinel[0]
+        results[suffix+'prefix_wrong_sentinel'] = results_gt_sentinel[1]
+        results[suffix+'prefix_not_active_sentinel'] = results_gt_sentinel[2]
+        results[suffix+'prefix_not_covered_sentinel'] = results_gt_sentinel[3]
+        results[suffix+'prefix_covered_not_unique_sentinel'] = results_gt_sentinel[4]
+        results[suffix+'prefix_not_covered_not_unique_sentinel'] = results_gt_sentinel[5]
+        results[suffix+'pkt_covered_correct_sentinel'] = results_gt_sentinel[7]
+        results[suffix+'pkt_covered_wrong_sentinel'] = results_gt_sentinel[8]
+        results[suffix+'pkt_covered_not_unique_sentinel'] = results_gt_sentinel[9]
+        results[suffix+'pkt_not_covered_sentinel'] = results_gt_sentinel[10]
+        results[suffix+'pkt_not_covered_not_unique_sentinel'] = results_gt_sentinel[11]
+        results[suffix+'pkt_all_unique_sentinel'] = results_gt_sentinel[12]
+
+        # scoring is split by the sentinel computation
+        self.profiler.add(i, SHARED, 'scoring', [(scoring_start, scoring_end), (scoring_start_sentinel, get_usage())])
+
+        self.writer.write(i, results)
+
+    # attributes which change from iteration to iteration (see get_state)
+    STATE = ['random', 'sampling_rng', 'sampling_progress', 'mirrored_pkts', 'sentinels_all_samples',
+             'sentinel_window_samples']
+
+    def get_state(self):
+        """ Returns the state after an iteration, see MagnifierSimulation.get_state """
+
+        state = {name: getattr(self, name) for name in self.STATE}
+        state['profile_rows'] = self.profiler.rows
+        state['results'] = self.writer.get_state()
+
+        return state
+
+    def set_state(self, state):
+        """ Continues with a state returned by get_state """
+
+        for name in self.STATE:
+            setattr(self, name, state[name])
+        self.profiler.rows = state['profile_rows']
+        self.writer.set_state(state['results'])
+
+    def flush(self):
+        """ Writes the profile so far (results are written after each iteration) """
+
+        self.profiler.write(self.out_file)
+
+    def finish(self):
+        """ Closes the results and writes the profile """
+
+        self.writer.close()
+        self.flush()
+
+
+def requires_index(in_file, skip, checkpoint_every, resume):
+    """ Checks if a simulation uses the iteration boundary index of its input
+
+    in_file (str): preprocessed csv file or packet store folder
+    skip (int): number of trace iterations to skip
+    checkpoint_every (int): write a checkpoint every n iterations (0 == never)
+    resume (bool): continue from a checkpoint
+
+    returns: True if the index is required (to skip or to resume a csv input)
+    """
+
+    if skip > 0:
+        return True
+
+    return not is_pkt_store(in_file) and (checkpoint_every > 0 or resume)
+
+
+def check_index(in_file, skip, checkpoint_every, resume):
+    """ Raises an error if a required iteration boundary index is missing (see requires_index)
+    Avoids that checkpoints are written which can not be resumed.
+    """
+
+    if requires_index(in_file, skip, checkpoint_every, resume) and not os.path.isfile(index_file(in_file)):
+        raise FileNotFoundError('missing iteration boundary index {}, build it with '
+                                'input_data/preprocess_pkt_csv.py -x -i {}'.format(index_file(in_file), in_file))
+
+
+def simulate(in_file, simulations, duration, pps, iteration, skip=0, checkpoint=None, checkpoint_every=0,
+             resume=False):
+    """ Reads the packets of each iteration once and feeds them to all simulations
+
+    in_file (str): filename to file (or packet store folder) with parsed packet information
+    simulations (list): MagnifierSimulation and EverflowSimulation objects
+    duration (int): how long one iteration takes in seconds
+    pps (int): pps of replayed packets per second (-1 == real replay speed)
+    iteration (int): number of simulation iterations
+    skip (int): number of trace iterations to skip (requires the iteration boundary index of the input)
+    checkpoint (str): checkpoint file, None to not write checkpoints
+    checkpoint_every (int): write a checkpoint (and the results so far) every n iterations (0 == never)
+    resume (bool): continue from the checkpoint file if it exists (csv input requires the iteration
+        boundary index), the results are the same as without interruption
+    """
+
+    check_index(in_file, skip, checkpoint_every, resume)
+
+    # helper - replay_real_speed
+    if pps == -1:
+        replay_real_speed = True
+    else:
+        replay_real_speed = False
+
+    # preparations for reading packets in
+    # (either from a packet store or from a csv file)
+    if is_pkt_store(in_file):
+        store = load_pkt_store(in_file)
+    else:
+        store = None
+        file_ptr = open(in_file, 'r')
+
+    # first packet (row) of the next iteration in the input
+    row = 0
+    first_iteration = 0
+
+    # directly jump to the first iteration we want to simulate
+    if resume and checkpoint is not None and os.path.isfile(checkpoint):
+        first_iteration, row = load_checkpoint(checkpoint, simulations)
+    elif skip > 0:
+        row = get_iteration_row(load_index(in_file), skip, duration, pps)
+
+    if store is None and row > 0:
+        file_ptr = seek_row(file_ptr, load_index(in_file), row)
+
+    # main loop
+    for i in range(first_iteration, iteration):
+        load_start = get_usage()
+
+        # get iteration end points
+        if replay_real_speed:
+            start = i     * duration  # time
+            end   = (i+1) * duration  # time
+        else:
+            start = i     * duration * pps    # pkt numb
+            end   = (i+1) * duration * pps    # pkt numb
+
+        # all packets which belong to the current iteration (read only once)
+        if store is not None:
+            columns, row = get_store_columns(store, row, start, end, replay_real_speed)
+        else:
+            columns, file_ptr = get_preprocessed_columns(file_ptr, start, end, replay_real_speed)
+            row += len(columns['ts'])
+
+        # we did not find any packets
+        # => we reached the end of the trace
+        if len(columns['ts']) == 0:
+            break
+
+        # packets with flags are the same for all simulations
+        flag_idx = get_flag_index(columns)
+        load_end = get_usage()
+
+        # each simulation has its own border router assignment
+        for simulation in simulations:
+            simulation_start = get_usage()
+            src, timestamps, routers, flags, border_idx = get_column_pkts(
+                columns,
+                simulation.border,
+                time_persistent=simulation.use_persistent,
+                mapping=simulation.mapping
+            )
+            current_pkts = make_pkt_array(src, routers)
+
+            # reading the iteration is shared, every simulation would need it on its own
+            simulation.profiler.add(i, SHARED, 'load', [(load_start, load_end), (simulation_start, get_usage())])
+
+            simulation.step(i, current_pkts, timestamps, flags.astype(bool), border_idx, flag_idx)
+
+        if checkpoint is not None and checkpoint_every > 0 and (i + 1) % checkpoint_every == 0:
+            write_checkpoint(checkpoint, i + 1, row, simulations)
 
     # close pkt input file
-    file_ptr.close()
+    if store is None:
+        file_ptr.close()
 
-    # write results to file
-    with open(out_file, 'w') as data_out:
-        for key, values in result_dict.items():
-            data_out.write('{},{}\n'.format(key, get_result_string(values)))
+    for simulation in simulations:
+        simulation.finish()
+
+    # the simulation is complete, nothing to resume anymore
+    if checkpoint is not None and os.path.isfile(checkpoint):
+        os.remove(checkpoint)
+
+
+def make_sim_magnifier(in_file, out_file, frequency, duration, pps,
+                       s_start, s_end, iteration, border, use_persistent,
+                       permutation, skip=0, workers=1, sampling='systematic', profile=False,
+                       checkpoint=0, resume=False):
+    """ main simulation function
+
+    in_file (str): 
+        filename to file (or packet store folder) with parsed packet information
+    out_file (str): 
+        name of file with results
+    frequency (int): 
+        sampling frequency n -> every n-th packet is sampled
+    duration (int): 
+        how long one iteration takes in seconds
+    pps (int): 
+        number of replayed packets per second (-1 == real replay speed)
+    s_start (int):
+        sentinel search prefix start size
+    s_end (int): 
+        sentinel search prefix end size
+    iteration (int): 
+        number of simulation iterations
+    border (int): 
+        number of border routers to consider
+    permutation (int):
+        percentage of permutations, -1 means not used
+    skip (int):
+        number of trace iterations to skip before the simulation starts
+        (requires the iteration boundary index of the input)
+    workers (int):
+        number of worker processes for the top k cases (1 == no extra processes)
+    sampling (str):
+        sampling mode of the border routers (see sim_pkts.SAMPLING_MODES)
+    profile (bool):
+        write the resource usage of each stage into a profile file (see sim_profile.py)
+    checkpoint (int):
+        write a checkpoint (and the results so far) every n iterations (0 == never)
+    resume (bool):
+        continue from the checkpoint of an interrupted run with the same parameters
+    """
+
+    simulation = MagnifierSimulation(out_file, frequency, s_start, s_end, border,
+                                     use_persistent, permutation, workers, sampling, profile)
+    simulate(in_file, [simulation], duration, pps, iteration, skip,
+             checkpoint_file(out_file) if checkpoint > 0 or resume else None, checkpoint, resume)
+
+
+def make_sim_everflow(in_file, out_file, frequency, duration, pps,
+                      s_start, s_end, iteration, border, use_persistent,
+                      permutation, skip=0, sampling='systematic', profile=False, checkpoint=0, resume=False):
+    """ main simulation function
+
+    in_file (str): filename to file (or packet store folder) with parsed packet information
+    out_file (str): name of file with results
+    frequency (int): everflow sampling frequency n -> every n-th packet is sampled
+    duration (int): how long one iteration takes in seconds
+    pps (int): pps of replayed packets per second (-1 == real replay speed)
+    s_start (int): sentinel search prefix start size
+    s_end (int): sentinel search prefix end size
+    iteration (int): number of simulation iterations
+    border (int): number of border routers to consider
+    permutation (int): percentage of permutations, -1 means not used
+    skip (int): number of trace iterations to skip (requires the iteration boundary index of the input)
+    sampling (str): sampling mode of the border routers (see sim_pkts.SAMPLING_MODES)
+    profile (bool): write the resource usage of each stage into a profile file (see sim_profile.py)
+    checkpoint (int): write a checkpoint (and the results so far) every n iterations (0 == never)
+    resume (bool): continue from the checkpoint of an interrupted run with the same parameters
+    """
+
+    simulation = EverflowSimulation(out_file, frequency, s_start, s_end, border,
+                                    use_persistent, permutation, sampling, profile)
+    simulate(in_file, [simulation], duration, pps, iteration, skip,
+             checkpoint_file(out_file) if checkpoint > 0 or resume else None, checkpoint, resume)
+
+
+def make_sim_sweep(in_file, configs, duration, pps, s_start, s_end, iteration, skip=0, workers=1,
+                   checkpoint=0, resume=False):
+    """ Runs several simulations over a single scan of the trace
+
+    Results are the same as if each configuration runs on its own.
+
+    in_file (str): filename to file (or packet store folder) with parsed packet information
+    configs (list): one dict per simulation with the keys
+        outfile, magnifier (1 or 0), frequency, border, traffic (1 or 0), amount
+        and optionally sampling and profile (same meaning as the command line arguments)
+    duration (int): how long one iteration takes in seconds
+    pps (int): pps of replayed packets per second (-1 == real replay speed)
+    s_start (int): sentinel search prefix start size
+    s_end (int): sentinel search prefix end size
+    iteration (int): number of simulation iterations
+    skip (int): number of trace iterations to skip (requires the iteration boundary index of the input)
+    workers (int): number of worker processes for the top k cases of each magnifier simulation
+    checkpoint (int): write a checkpoint (and the results so far) every n iterations (0 == never),
+        the checkpoint of all simulations is written next to the results of the first one
+    resume (bool): continue from the checkpoint of an interrupted sweep with the same configurations
+    """
+
+    simulations = list()
+    for config in configs:
+        if config['magnifier'] == 1:
+            simulations.append(MagnifierSimulation(config['outfile'], config['frequency'], s_start, s_end,
+                                                   config['border'], config['traffic'] == 1,
+                                                   config['amount'], workers,
+                                                   config.get('sampling', 'systematic'),
+                                                   config.get('profile', False)))
+        else:
+            simulations.append(EverflowSimulation(config['outfile'], config['frequency'], s_start, s_end,
+                                                  config['border'], config['traffic'] == 1,
+                                                  config['amount'], config.get('sampling', 'systematic'),
+                                                  config.get('profile', False)))
+
+    simulate(in_file, simulations, duration, pps, iteration, skip,
+             checkpoint_file(configs[0]['outfile']) if checkpoint > 0 or resume else None, checkpoint, resume)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-p', '--pkts', default='../input_data/simulation_input.csv', type=str,
-                        help='file which contains required pkt information generated from pcap')
+                        help='file (csv) or packet store (folder) which contains required pkt information generated from pcap')
     parser.add_argument('-o', '--outfile', default='test_run.csv', type=str,
                         help='filename to save results')
     parser.add_argument('-f', '--frequency', default=1024, type=int,
@@ -720,6 +995,21 @@ if __name__ == '__main__':
                         help='pkt to border mapping in the best (1, default) or worst (0) way')
     parser.add_argument('-a', '--amount', default=-1, type=int,
                         help='percentage of permutations (0..100), default -1')
+    parser.add_argument('-k', '--skip', default=0, type=int,
+                        help='number of trace iterations to skip before starting (uses the input index)')
+    parser.add_argument('-w', '--workers', default=1, type=int,
+                        help='number of worker processes for the magnifier top k cases (default 1, no extra processes)')
+    parser.add_argument('-r', '--sampling', default='systematic', type=str, choices=SAMPLING_MODES,
+                        help='sampling mode of the border routers, every n-th packet (systematic, default), '
+                             'independently per packet (bernoulli) or with random gaps as in sFlow (random_skip)')
+    parser.add_argument('-x', '--profile', action='store_true',
+                        help='write wall time, CPU time and RSS of each stage and iteration into <outfile>_profile.csv')
+    parser.add_argument('-C', '--checkpoint', default=0, type=int,
+                        help='write a checkpoint and the results so far every n iterations (default 0, never)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted simulation from its checkpoint (<outfile>.checkpoint)')
+    parser.add_argument('-S', '--sweep', default=None, type=str,
+                        help='json file with a list of configurations to simulate over a single scan of the trace')
     parser.add_argument(
         "-v",
         "--verbose",
@@ -743,25 +1033,61 @@ if __name__ == '__main__':
         print('Could not find packet file {}'.format(args.pkts))
         sys.exit()
 
+    # skipping and resuming a csv input requires its index
+    try:
+        check_index(args.pkts, args.skip, args.checkpoint, args.resume)
+    except FileNotFoundError as error:
+        print(error)
+        sys.exit(1)
+
     # also check that in 0-32
     if args.start > args.end:
         print('Unexpected sentinel search start ({}) and ({}) values'.format(args.start, args.end))
         sys.exit()
 
-    if args.border not in [2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]:
-        print('Number of border routers should be power of two and 2 <= N <= 1024: {}'.format(args.border))
-        sys.exit()
-
-    if args.traffic == 1:
-        use_persistent = True
+    # configuration given on the command line
+    configs = [{
+        'outfile': args.outfile,
+        'magnifier': args.magnifier,
+        'frequency': args.frequency,
+        'border': args.border,
+        'traffic': args.traffic,
+        'amount': args.amount,
+        'sampling': args.sampling,
+        'profile': args.profile,
+    }]
+
+    # each configuration of a sweep can overwrite outfile, magnifier, frequency, border, traffic, amount, sampling
+    # and profile
+    if args.sweep is not None:
+        with open(args.sweep, 'r') as data_in:
+            configs = [dict(configs[0], **config) for config in json.load(data_in)]
+
+    for config in configs:
+        if config['border'] not in [2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]:
+            print('Number of border routers should be power of two and 2 <= N <= 1024: {}'.format(config['border']))
+            sys.exit()
+
+        if config['sampling'] not in SAMPLING_MODES:
+            print('Unknown sampling mode {}, expected one of {}'.format(config['sampling'], SAMPLING_MODES))
+            sys.exit()
+
+    if args.sweep is not None:
+        make_sim_sweep(args.pkts, configs, args.duration, args.pps, args.start, args.end,
+                       args.iteration, args.skip, args.workers, args.checkpoint, args.resume)
     else:
-        use_persistent = False
+        if args.traffic == 1:
+            use_persistent = True
+        else:
+            use_persistent = False
 
-    if args.magnifier == 1:
-        make_sim_magnifier(args.pkts, args.outfile, args.frequency, args.duration,
-                           args.pps, args.start, args.end, args.iteration,
-                           args.border, use_persistent, args.amount)
-    else:
-        make_sim_everflow(args.pkts, args.outfile, args.frequency, args.duration,
-                          args.pps, args.start, args.end, args.iteration,
-                          args.border, use_persistent, args.amount)
+        if args.magnifier == 1:
+            make_sim_magnifier(args.pkts, args.outfile, args.frequency, args.duration,
+                               args.pps, args.start, args.end, args.iteration,
+                               args.border, use_persistent, args.amount, args.skip, args.workers,
+                               args.sampling, args.profile, args.checkpoint, args.resume)
+        else:
+            make_sim_everflow(args.pkts, args.outfile, args.frequency, args.duration,
+                              args.pps, args.start, args.end, args.iteration,
+                              args.border, use_persistent, args.amount, args.skip, args.sampling,
+                              args.profile, args.checkpoint, args.resume)